@@ -1,7 +1,24 @@
 from fastapi import APIRouter
+from app.services.worker_pool import worker_pool
+from app.services.render_cache import render_cache
+from app.services.scheduler import scheduler
+from app.services.cancellation import cancellation_monitor
+from app.services.eviction_service import eviction_manager
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@router.get("/metrics")
+async def get_metrics():
+    """运行时指标：进程池利用率、调度队列、渲染缓存命中、断开取消、磁盘回收等"""
+    return {
+        "success": True,
+        "worker_pool": worker_pool.stats(),
+        "scheduler": scheduler.stats(),
+        "render_cache": render_cache.stats(),
+        "cancellations": cancellation_monitor.stats(),
+        "eviction": eviction_manager.stats()
+    }
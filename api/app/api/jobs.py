@@ -0,0 +1,82 @@
+"""
+渲染任务 API - 提交时间线、跟踪进度、获取结果
+"""
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.models.schemas import MultiMixRequest
+from app.services.job_service import job_service, JOB_COMPLETED, JOB_FAILED
+from app.services.scheduler import client_id_from
+import json
+
+router = APIRouter()
+
+@router.post("/jobs/mix/multi")
+async def submit_multi_mix_job(request: MultiMixRequest, http_request: Request):
+    """提交导出渲染任务，立即返回 job_id"""
+    job = job_service.submit('multi', request, client_id_from(http_request))
+    return {
+        "success": True,
+        "job_id": job['job_id'],
+        "job": job
+    }
+
+@router.post("/jobs/mix/preview")
+async def submit_preview_job(request: MultiMixRequest, http_request: Request):
+    """提交预览渲染任务（含波形数据），立即返回 job_id"""
+    job = job_service.submit('preview', request, client_id_from(http_request))
+    return {
+        "success": True,
+        "job_id": job['job_id'],
+        "job": job
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """轮询任务状态：status, stage, progress"""
+    job = job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        "success": True,
+        "job": job
+    }
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """通过 SSE 推送任务进度，任务结束后关闭连接"""
+    if job_service.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_generator():
+        async for job in job_service.watch(job_id):
+            # 进度事件不重复回传请求内容
+            job.pop('request', None)
+            yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
+        }
+    )
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """获取已完成任务的结果（output_id 或 preview_id + waveform）"""
+    job = job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['status'] == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=job['error'])
+    if job['status'] != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        **job['result']
+    }
@@ -3,7 +3,7 @@
 采用结构化输出和多层验证机制确保稳定性
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, validator
 from typing import Dict, List, Any, Optional, Union, Literal
@@ -825,11 +825,12 @@ def format_time(seconds: float) -> str:
 
 
 @router.post("/ai/splice/stream")
-async def generate_muggle_splice_stream(request: MuggleSpliceRequest):
+async def generate_muggle_splice_stream(request: MuggleSpliceRequest, http_request: Request):
     """
     使用 DeepSeek Reasoner 生成麻瓜拼接方案（流式输出）
-    支持实时显示推理过程
+    支持实时显示推理过程，客户端断开后立即关闭上游流，不再消耗 token
     """
+    from app.services.cancellation import cancellation_monitor
     from app.core.config import settings
     import json
     import asyncio
@@ -884,6 +885,11 @@ async def generate_muggle_splice_stream(request: MuggleSpliceRequest):
                     
                     # 读取流式响应
                     async for line in response.aiter_lines():
+                        if await http_request.is_disconnected():
+                            # 退出 async with 时关闭上游连接
+                            cancellation_monitor.record('splice_stream')
+                            return
+
                         if line.startswith("data: "):
                             data_str = line[6:]  # 移除 "data: " 前缀
                             
@@ -920,6 +926,10 @@ async def generate_muggle_splice_stream(request: MuggleSpliceRequest):
                         
                         await asyncio.sleep(0)  # 让出控制权
                         
+        except asyncio.CancelledError:
+            # 客户端断开时 StreamingResponse 取消生成器，上游连接随之关闭
+            cancellation_monitor.record('splice_stream')
+            raise
         except Exception as e:
             logger.error(f"流式生成失败: {str(e)}")
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import FileResponse, StreamingResponse
-from app.models.schemas import MixRequest, MultiMixRequest, MagicFillRequest, BeatSyncRequest
+from app.models.schemas import (
+    MixRequest, MultiMixRequest, MagicFillRequest, BeatSyncRequest, CompatibilityMatrixRequest, ClipOrderRequest,
+    TimelineRecommendRequest
+)
 from app.services.audio_service import AudioService
 from app.services.piapi_service import piapi_service
 from app.services.beat_sync_service import BeatSyncService
 from app.services.transition_optimizer import transition_optimizer
+from app.services.file_service import file_service
+from app.services.render_cache import render_cache
+from app.services.scheduler import admission, admitted, client_id_from
+from app.services.cancellation import cancellation_monitor
+from app.services.eviction_service import eviction_manager
 from app.core.config import settings
 import os
 import uuid
@@ -14,7 +22,7 @@ audio_service = AudioService()
 beat_sync_service = BeatSyncService()
 
 @router.post("/mix")
-async def create_mix(request: MixRequest):
+async def create_mix(request: MixRequest, _slot=Depends(admission('export'))):
     """Create a mixed audio file from two tracks"""
     try:
         output_path = await audio_service.mix_tracks(
@@ -37,34 +45,39 @@ async def create_mix(request: MixRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/mix/multi")
-async def create_multi_mix(request: MultiMixRequest):
+async def create_multi_mix(request: MultiMixRequest, http_request: Request):
     """Create a mixed audio file from multiple segments"""
+    # 只有实际渲染时才占用调度槽位（在 render_cache 中），缓存命中和相同请求合并不占用
     try:
-        output_path = await audio_service.mix_multi_segments(
-            segments=request.segments,
-            transition_duration=request.transition_duration,
-            transition_type=request.transition_type
+        output_path, cached = await cancellation_monitor.run(
+            http_request,
+            render_cache.render(request, task_class='export', client_id=client_id_from(http_request)),
+            'mix_multi'
         )
         
         return {
             "success": True,
             "output_id": os.path.basename(output_path),
+            "cached": cached,
             "message": "Mix created successfully"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/mix/preview")
-async def create_preview(request: MultiMixRequest):
+async def create_preview(request: MultiMixRequest, http_request: Request):
     """Create a preview mix with pre-computed waveform data"""
+    # 只有实际渲染和生成波形时才占用调度槽位，缓存命中和相同请求合并不占用
+    client_id = client_id_from(http_request)
     try:
         from app.services.file_service import file_service
-        import json
         
-        output_path = await audio_service.mix_multi_segments(
-            segments=request.segments,
-            transition_duration=request.transition_duration or 0,
-            transition_type=request.transition_type or 'cut'
+        output_path, cached = await cancellation_monitor.run(
+            http_request,
+            render_cache.render(request, task_class='interactive', client_id=client_id),
+            'mix_preview'
         )
         
         preview_id = os.path.basename(output_path)
@@ -72,16 +85,9 @@ async def create_preview(request: MultiMixRequest):
         # 生成预览波形数据
         waveform_data = None
         try:
-            await file_service._preprocess_audio(output_path)
-            waveform_path = file_service.get_waveform_path(output_path)
-            if waveform_path and os.path.exists(waveform_path):
-                with open(waveform_path, 'r') as f:
-                    raw_data = json.load(f)
-                    # 转换为前端期望的格式
-                    waveform_data = {
-                        "peaks": raw_data.get("waveform", []),
-                        "duration": raw_data.get("duration", 0)
-                    }
+            waveform_data = await file_service.get_preview_waveform(
+                output_path, task_class='interactive', client_id=client_id
+            )
         except Exception as e:
             print(f"Failed to generate preview waveform: {e}")
         
@@ -89,13 +95,16 @@ async def create_preview(request: MultiMixRequest):
             "success": True,
             "preview_id": preview_id,
             "waveform": waveform_data,
+            "cached": cached,
             "message": "Preview created successfully"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/audio/{file_id}")
-async def stream_audio(file_id: str):
+async def stream_audio(file_id: str, http_request: Request):
     """Stream audio file for waveform display (converts to MP3 for browser compatibility)"""
     # Check uploads directory first
     file_path = os.path.join(settings.UPLOAD_DIR, file_id)
@@ -116,6 +125,8 @@ async def stream_audio(file_id: str):
     # Browser-compatible formats
     browser_compatible = ['.mp3', '.wav', '.ogg', '.m4a', '.aac']
     
+    eviction_manager.touch(file_path)
+    
     if ext in browser_compatible:
         # Stream directly
         def iterfile():
@@ -139,7 +150,11 @@ async def stream_audio(file_id: str):
         )
     else:
         # Convert FLAC/other formats to MP3 for browser playback
-        converted_path = await audio_service.get_browser_compatible_audio(file_path)
+        # 只有需要转码时才占用调度槽位，已缓存的结果直接返回
+        converted_path = await file_service.cached_browser_mp3(file_path)
+        if converted_path is None:
+            async with admitted(http_request, 'interactive'):
+                converted_path = await audio_service.get_browser_compatible_audio(file_path)
         
         def iterfile():
             with open(converted_path, "rb") as f:
@@ -160,6 +175,7 @@ async def download_mix(output_id: str):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
+        eviction_manager.touch(file_path)
         return FileResponse(
             file_path,
             media_type="audio/mpeg",
@@ -170,7 +186,7 @@ async def download_mix(output_id: str):
 
 
 @router.post("/magic/fill")
-async def magic_fill_transition(request: MagicFillRequest):
+async def magic_fill_transition(request: MagicFillRequest, http_request: Request):
     """
     魔法填充过渡 - 使用 PiAPI ACE-Step 生成音频过渡
     
@@ -198,16 +214,24 @@ async def magic_fill_transition(request: MagicFillRequest):
         # 临时文件放在 outputs/temp 目录，通过 /api/audio/ 访问
         public_url = f"{settings.SERVER_PUBLIC_URL}/api/audio/{segment_id}"
         
-        # 4. 调用 PiAPI 扩展音频
-        result_url = await piapi_service.extend_audio(
-            audio_url=public_url,
-            right_extend_duration=request.extend_duration,
-            style_prompt=request.style_prompt or "smooth transition",
-            lyrics="[inst]"
-        )
+        # 4. 调用 PiAPI 扩展音频（客户端断开时停止轮询，回源下载期间片段不会被清理）
+        with eviction_manager.pinned(segment_path):
+            result_url = await cancellation_monitor.run(
+                http_request,
+                piapi_service.extend_audio(
+                    audio_url=public_url,
+                    right_extend_duration=request.extend_duration,
+                    style_prompt=request.style_prompt or "smooth transition",
+                    lyrics="[inst]"
+                ),
+                'magic_fill'
+            )
+        # 前端随后会播放源片段和结果
+        eviction_manager.lease(segment_path)
         
         # 5. 下载结果到本地
         output_path = await piapi_service.download_audio(result_url, settings.OUTPUT_DIR)
+        eviction_manager.lease(output_path)
         output_id = os.path.basename(output_path)
         
         return {
@@ -218,6 +242,8 @@ async def magic_fill_transition(request: MagicFillRequest):
             "message": "Magic fill transition created successfully"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -271,14 +297,18 @@ async def test_piapi():
 
 
 @router.post("/beatsync/process")
-async def beatsync_transition(request: BeatSyncRequest):
+async def beatsync_transition(
+    request: BeatSyncRequest,
+    http_request: Request,
+    _slot=Depends(admission('export'))
+):
     """
     节拍对齐过渡 - 使用智能节拍检测进行对齐
     
     流程：
-    1. 截取两段音频片段
-    2. 检测节拍和 BPM
-    3. 在节拍点进行对齐和过渡
+    1. 从缓存的节拍网格读取两段交界处的节拍和 BPM
+    2. 搜索最佳切点
+    3. 从源文件解码片段，在节拍点进行对齐和过渡
     4. 返回处理后的音频
     """
     try:
@@ -291,30 +321,22 @@ async def beatsync_transition(request: BeatSyncRequest):
         if not os.path.exists(file2_path):
             raise HTTPException(status_code=404, detail=f"Audio file not found: {request.audio2_file_id}")
         
-        # 2. 截取片段
-        segment1_path = await audio_service.extract_segment(
-            file1_path,
-            request.audio1_start,
-            request.audio1_end
-        )
-        
-        segment2_path = await audio_service.extract_segment(
-            file2_path,
-            request.audio2_start,
-            request.audio2_end
-        )
-        
-        # 3. 执行节拍对齐
-        result_audio, sync_info = await beat_sync_service.sync_and_transition(
-            segment1_path,
-            segment2_path,
-            request.transition_beats
-        )
-        
-        # 4. 保存结果
+        # 2-3. 执行节拍对齐（客户端断开时取消）
         output_id = f"{uuid.uuid4()}.mp3"
         output_path = os.path.join(settings.OUTPUT_DIR, output_id)
-        result_audio.export(output_path, format="mp3", bitrate="320k")
+
+        async def process():
+            # 片段直接从源文件解码，无需截取临时文件
+            result = await beat_sync_service.sync_and_transition(
+                (file1_path, request.audio1_start, request.audio1_end),
+                (file2_path, request.audio2_start, request.audio2_end),
+                output_path,
+                request.transition_beats
+            )
+            eviction_manager.lease(output_path)
+            return result
+
+        _, sync_info = await cancellation_monitor.run(http_request, process(), 'beatsync')
         
         return {
             "success": sync_info.get('success', True),
@@ -323,15 +345,29 @@ async def beatsync_transition(request: BeatSyncRequest):
             "message": "Beat sync transition created successfully"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _clip_range(start: float | None, end: float | None):
+    """片段范围参数，均未给出时分析整首曲目"""
+    if start is None and end is None:
+        return None
+    return (start or 0.0, end)
+
+
 @router.post("/transition/analyze")
 async def analyze_transition_compatibility(
     audio1_file_id: str,
     audio2_file_id: str,
-    transition_type: str = "beatsync"
+    transition_type: str = "beatsync",
+    audio1_start: float = None,
+    audio1_end: float = None,
+    audio2_start: float = None,
+    audio2_end: float = None,
+    _slot=Depends(admission('analysis'))
 ):
     """
     分析两段音频的过渡兼容性
@@ -340,6 +376,8 @@ async def analyze_transition_compatibility(
         audio1_file_id: 第一段音频文件 ID
         audio2_file_id: 第二段音频文件 ID
         transition_type: 过渡类型 (beatsync, crossfade)
+        audio1_start/audio1_end: 第一段片段范围（可选，给出时只分析片段末尾）
+        audio2_start/audio2_end: 第二段片段范围（可选，给出时只分析片段开头）
     """
     try:
         file1_path = os.path.join(settings.UPLOAD_DIR, audio1_file_id)
@@ -353,7 +391,9 @@ async def analyze_transition_compatibility(
         result = await transition_optimizer.analyze_compatibility(
             file1_path,
             file2_path,
-            transition_type
+            transition_type,
+            _clip_range(audio1_start, audio1_end),
+            _clip_range(audio2_start, audio2_end)
         )
         
         return {
@@ -369,7 +409,12 @@ async def analyze_transition_compatibility(
 async def recommend_transition(
     audio1_file_id: str,
     audio2_file_id: str,
-    user_preference: str = None
+    user_preference: str = None,
+    audio1_start: float = None,
+    audio1_end: float = None,
+    audio2_start: float = None,
+    audio2_end: float = None,
+    _slot=Depends(admission('analysis'))
 ):
     """
     推荐最佳过渡方案
@@ -378,6 +423,8 @@ async def recommend_transition(
         audio1_file_id: 第一段音频文件 ID
         audio2_file_id: 第二段音频文件 ID
         user_preference: 用户偏好的过渡类型（可选）
+        audio1_start/audio1_end: 第一段片段范围（可选，给出时只分析片段末尾）
+        audio2_start/audio2_end: 第二段片段范围（可选，给出时只分析片段开头）
     """
     try:
         file1_path = os.path.join(settings.UPLOAD_DIR, audio1_file_id)
@@ -391,7 +438,9 @@ async def recommend_transition(
         result = await transition_optimizer.recommend_transition(
             file1_path,
             file2_path,
-            user_preference
+            user_preference,
+            _clip_range(audio1_start, audio1_end),
+            _clip_range(audio2_start, audio2_end)
         )
         
         return {
@@ -401,3 +450,131 @@ async def recommend_transition(
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/transition/matrix")
+async def transition_compatibility_matrix(
+    request: CompatibilityMatrixRequest,
+    _slot=Depends(admission('analysis'))
+):
+    """
+    多段音频两两之间的过渡兼容性矩阵
+    
+    matrix 中第 i 行第 j 列表示从 items[i] 过渡到 items[j]。
+    片段给出 start/end 时只分析片段末尾和开头，否则使用整首曲目的特征。
+    """
+    try:
+        clips = []
+        for item in request.items:
+            file_path = os.path.join(settings.UPLOAD_DIR, item.file_id)
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail=f"Audio file not found: {item.file_id}")
+            clips.append((file_path, _clip_range(item.start, item.end)))
+        
+        result = await transition_optimizer.compatibility_matrix(clips)
+        
+        return {
+            "success": True,
+            "items": [item.model_dump() for item in request.items],
+            "matrix": result
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/transition/order")
+async def order_transition_clips(
+    request: ClipOrderRequest,
+    _slot=Depends(admission('analysis'))
+):
+    """
+    按过渡兼容性给出片段的排列顺序
+    
+    返回 order（items 中的下标）、相邻片段之间推荐的过渡类型和时长（毫秒），
+    以及可直接提交给 /api/mix/multi 的 mix_request。
+    
+    mix_request 中推荐 beatsync 的交界使用节拍对齐过渡块，其余使用推荐时长的 crossfade。
+    """
+    try:
+        clips = []
+        for item in request.items:
+            file_path = os.path.join(settings.UPLOAD_DIR, item.file_id)
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail=f"Audio file not found: {item.file_id}")
+            clips.append((file_path, _clip_range(item.start, item.end)))
+        
+        result = await transition_optimizer.order_clips(clips, request.keep_first)
+        
+        # 按推荐顺序组装时间线：片段之间插入过渡块
+        segments = []
+        for position, index in enumerate(result['order']):
+            item = request.items[index]
+            if position > 0:
+                transition = result['transitions'][position - 1]
+                segments.append({
+                    'file_id': '__transition__',
+                    'start': 0,
+                    'end': transition['duration_ms'] / 1000,
+                    'transition_type': 'beatsync' if transition['type'] == 'beatsync' else 'crossfade'
+                })
+            end = item.end
+            if end is None:
+                end = (await file_service.get_audio_info(clips[index][0]))['duration']
+            segments.append({'file_id': item.file_id, 'start': item.start or 0, 'end': end})
+        mix_request = MultiMixRequest(segments=segments)
+        
+        return {
+            "success": True,
+            **result,
+            "items": [request.items[index].model_dump() for index in result['order']],
+            "mix_request": mix_request.model_dump(exclude_none=True)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/transition/recommend/timeline")
+async def recommend_timeline_transitions(
+    request: TimelineRecommendRequest,
+    _slot=Depends(admission('analysis'))
+):
+    """
+    为整条时间线的每个交界推荐过渡方案
+    
+    segments 与 /api/mix/multi 相同；相邻的两个音频片段之间（中间可以隔一个过渡块）
+    视为一个交界。boundaries 中的 from/to 为前后片段在 segments 中的下标。
+    """
+    try:
+        clips = []
+        for index, seg in enumerate(request.segments):
+            if seg.file_id in ('__transition__', '__gap__'):
+                continue
+            file_path = os.path.join(settings.UPLOAD_DIR, seg.file_id)
+            if not os.path.exists(file_path):
+                raise HTTPException(status_code=404, detail=f"Audio file not found: {seg.file_id}")
+            clips.append((index, (file_path, (seg.start, seg.end))))
+        
+        pairs = list(zip(clips, clips[1:]))
+        recommendations = await transition_optimizer.recommend_timeline(
+            [(clip1, clip2) for (_, clip1), (_, clip2) in pairs],
+            request.user_preference
+        )
+        
+        return {
+            "success": True,
+            "boundaries": [
+                {"from": index1, "to": index2, "recommendation": recommendation}
+                for ((index1, _), (index2, _)), recommendation in zip(pairs, recommendations)
+            ]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,26 +1,191 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from app.services.file_service import FileService
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.models.schemas import UploadNegotiation
+from app.services.file_service import file_service
+from app.services.upload_session_service import upload_sessions
+from app.services.scheduler import admitted
+from app.core.config import settings
+import json
 import os
 
 router = APIRouter()
-file_service = FileService()
 
-@router.post("/upload")
-async def upload_audio(file: UploadFile = File(...)):
-    """Upload an audio file"""
+# /upload 自行解析 multipart 请求体，在接口文档中补充表单结构
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
+
+# /upload/batch 同样自行解析请求体，files 字段可重复
+UPLOAD_BATCH_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"]
+                }
+            }
+        }
+    }
+}
+
+def _uploaded_response(file_path: str, filename: str, **extra) -> dict:
+    file_id = os.path.basename(file_path)
+    status = file_service.get_artifact_status(file_id)
+    return {
+        "success": True,
+        **extra,
+        "file_id": file_id,
+        "filename": filename,
+        # 元数据尚未就绪时为 null，前端通过 /info 或 /status 获取
+        "info": status['artifacts']['metadata']['data'],
+        "status": status
+    }
+
+@router.post("/upload", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_audio(http_request: Request):
+    """Upload an audio file (preprocessing continues in the background)"""
+    # 不占用调度槽位：保存只是磁盘写入，预处理在后台另行调度
+    # 声明的请求体大小已超限时在读取请求体之前拒绝
+    content_length = http_request.headers.get('content-length')
+    if content_length and content_length.isdigit() \
+            and int(content_length) > settings.MAX_UPLOAD_SIZE + file_service.MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail="File size exceeds maximum allowed size")
+    
     try:
-        file_path = await file_service.save_upload(file)
-        file_info = await file_service.get_audio_info(file_path)
+        # 直接解析请求体流写入目标文件，不经过 Starlette 的表单临时文件
+        file_path, filename = await file_service.save_upload_stream(
+            http_request.headers.get('content-type'), http_request.stream()
+        )
+        return _uploaded_response(file_path, filename)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/upload/batch", openapi_extra=UPLOAD_BATCH_FORM_SCHEMA)
+async def upload_batch(http_request: Request):
+    """批量上传：保存后各文件并行预处理，通过 SSE 推送每个文件的就绪状态"""
+    # 不占用调度槽位：保存只是磁盘写入，SSE 推送期间也不应占着槽位
+    # 声明的请求体大小超过整批上限时在读取请求体之前拒绝
+    max_files = file_service.MAX_HISTORY_FILES
+    content_length = http_request.headers.get('content-length')
+    if content_length and content_length.isdigit() \
+            and int(content_length) > max_files * (settings.MAX_UPLOAD_SIZE + file_service.MULTIPART_OVERHEAD):
+        raise HTTPException(status_code=413, detail="Batch size exceeds maximum allowed size")
+    
+    # 逐个文件边接收边写入，单个文件失败不影响其他文件
+    try:
+        saved = await file_service.save_upload_batch_stream(
+            http_request.headers.get('content-type'), http_request.stream(), max_files
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    results = [
+        {"success": False, "filename": item['filename'], "error": item['error']} if 'error' in item
+        else _uploaded_response(item['path'], item['filename'])
+        for item in saved
+    ]
+    
+    async def event_generator():
+        indexes = {}
+        for index, result in enumerate(results):
+            yield f"data: {json.dumps({'type': 'uploaded', 'index': index, **result}, ensure_ascii=False)}\n\n"
+            if result['success']:
+                indexes.setdefault(result['file_id'], []).append(index)
         
-        return {
-            "success": True,
-            "file_id": os.path.basename(file_path),
-            "filename": file.filename,
-            "info": file_info
+        async for file_id, status in file_service.watch_artifacts(list(indexes)):
+            # 客户端断开后只停止推送，预处理继续在后台完成
+            if await http_request.is_disconnected():
+                return
+            for index in indexes[file_id]:
+                event = {'type': 'status', 'index': index, 'file_id': file_id, 'status': status}
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        
+        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # 禁用 Nginx 缓冲
         }
+    )
+
+@router.post("/upload/negotiate")
+async def negotiate_upload(request: UploadNegotiation):
+    """Hash-first upload: skip the transfer when the server already has this content"""
+    try:
+        file_path = file_service.register_existing(request.content_hash, request.size, request.filename)
+        if file_path is None:
+            return {"success": True, "exists": False}
+        return _uploaded_response(file_path, request.filename, exists=True)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/upload/sessions")
+async def create_upload_session(request: UploadNegotiation):
+    """Start (or resume) a chunked upload; known content is registered without a transfer"""
+    try:
+        file_path = file_service.register_existing(request.content_hash, request.size, request.filename)
+        if file_path is not None:
+            return _uploaded_response(file_path, request.filename, exists=True)
+        
+        session = upload_sessions.create(request.filename, request.size, request.content_hash)
+        return {"success": True, "exists": False, "session": session}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/upload/sessions/{session_id}")
+async def get_upload_session(session_id: str):
+    """Received parts of a chunked upload (used to resume)"""
+    try:
+        return {"success": True, "session": upload_sessions.status(session_id)}
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.put("/upload/sessions/{session_id}/parts/{part_index}")
+async def upload_part(session_id: str, part_index: int, http_request: Request):
+    """Upload one part (raw request body); parts may arrive in any order and in parallel"""
+    try:
+        session = await upload_sessions.write_part(session_id, part_index, http_request.stream())
+        return {"success": True, "session": session}
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/upload/sessions/{session_id}/complete")
+async def complete_upload_session(session_id: str):
+    """Verify the assembled file against its hash and add it to the uploads"""
+    try:
+        session = upload_sessions.status(session_id)
+        file_path = await upload_sessions.complete(session_id)
+        return _uploaded_response(file_path, session['filename'])
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/upload/sessions/{session_id}")
+async def abort_upload_session(session_id: str):
+    """Abort a chunked upload and discard received parts"""
+    upload_sessions.abort(session_id)
+    return {"success": True}
+
 @router.get("/uploads")
 async def list_uploads():
     """Get list of uploaded files (history)"""
@@ -34,7 +199,7 @@ async def list_uploads():
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/uploads/{file_id}/info")
-async def get_upload_info(file_id: str):
+async def get_upload_info(file_id: str, http_request: Request):
     """Get audio info for an uploaded file"""
     try:
         from app.core.config import settings
@@ -42,7 +207,11 @@ async def get_upload_info(file_id: str):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
-        file_info = await file_service.get_audio_info(file_path)
+        # 后台预处理已读出元数据时直接返回，否则解码时才占用调度槽位
+        file_info = file_service.cached_audio_info(file_path)
+        if file_info is None:
+            async with admitted(http_request, 'interactive'):
+                file_info = await file_service.get_audio_info(file_path)
         return {
             "success": True,
             "file_id": file_id,
@@ -53,6 +222,37 @@ async def get_upload_info(file_id: str):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/uploads/{file_id}/status")
+async def get_upload_status(file_id: str):
+    """后台预处理进度：estimate, metadata, peaks, mp3, features 各自的状态"""
+    from app.core.config import settings
+    file_path = os.path.join(settings.UPLOAD_DIR, file_id)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # 补上未完成且无人处理的产物（例如处理它的 worker 已重启）
+    file_service.schedule_preprocess(file_path)
+    return {
+        "success": True,
+        "file_id": file_id,
+        **file_service.get_artifact_status(file_id)
+    }
+
+@router.post("/uploads/{file_id}/retry")
+async def retry_upload_preprocess(file_id: str):
+    """重新生成失败的产物（例如源文件当时不可读）"""
+    from app.core.config import settings
+    file_path = os.path.join(settings.UPLOAD_DIR, file_id)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    file_service.schedule_preprocess(file_path, retry_failed=True)
+    return {
+        "success": True,
+        "file_id": file_id,
+        **file_service.get_artifact_status(file_id)
+    }
+
 @router.delete("/upload/{file_id}")
 async def delete_upload(file_id: str):
     """Delete an uploaded file"""
@@ -63,7 +263,7 @@ async def delete_upload(file_id: str):
         raise HTTPException(status_code=404, detail=str(e))
 
 @router.get("/uploads/{file_id}/waveform")
-async def get_waveform(file_id: str):
+async def get_waveform(file_id: str, http_request: Request):
     """获取预计算的波形数据"""
     try:
         from app.core.config import settings
@@ -73,7 +273,7 @@ async def get_waveform(file_id: str):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
-        waveform_path = file_service.get_waveform_path(file_path)
+        waveform_path = await file_service.get_waveform_path(file_path)
         
         if waveform_path and os.path.exists(waveform_path):
             with open(waveform_path, 'r') as f:
@@ -85,9 +285,10 @@ async def get_waveform(file_id: str):
                 **data
             }
         else:
-            # 波形数据不存在，触发生成
-            await file_service._preprocess_audio(file_path)
-            waveform_path = file_service.get_waveform_path(file_path)
+            # 波形数据不存在，触发生成（只有生成时才占用调度槽位）
+            async with admitted(http_request, 'analysis'):
+                await file_service._preprocess_audio(file_path)
+            waveform_path = await file_service.get_waveform_path(file_path)
             
             if waveform_path and os.path.exists(waveform_path):
                 with open(waveform_path, 'r') as f:
@@ -9,6 +9,8 @@ API_DIR = Path(__file__).resolve().parent.parent.parent
 class Settings(BaseSettings):
     UPLOAD_DIR: str = "./data/uploads"
     OUTPUT_DIR: str = "./data/outputs"
+    # 共享状态数据库（SQLite WAL，多 worker 共享）
+    STATE_DB_PATH: str = "./data/state.db"
     MAX_UPLOAD_SIZE: int = 52428800  # 50MB
     ALLOWED_EXTENSIONS: str = "mp3,wav,flac,m4a,ogg"
     CORS_ORIGINS: str = "http://localhost:3000,http://localhost:8080,http://127.0.0.1:8080,*"
@@ -25,6 +27,40 @@ class Settings(BaseSettings):
     TENCENT_SECRET_KEY: str = ""
     TENCENT_APP_ID: str = ""
     
+    # 进程池配置（0 表示使用 CPU 核数）
+    WORKER_POOL_SIZE: int = 0
+    # 每个工作进程执行多少个任务后重启，释放 librosa/numba 占用的内存（0 表示不限制）
+    WORKER_POOL_MAX_TASKS_PER_CHILD: int = 50
+    
+    # 调度配置：同时运行的重任务总数（0 表示不另设上限，只受各类任务并发上限约束）
+    SCHEDULER_MAX_ACTIVE: int = 0
+    # 各类任务并发上限（优先级：交互预览 > 最终导出 > 后台分析）
+    SCHEDULER_INTERACTIVE_CONCURRENCY: int = 4
+    SCHEDULER_EXPORT_CONCURRENCY: int = 2
+    SCHEDULER_ANALYSIS_CONCURRENCY: int = 2
+    # 上传后台预处理的并发上限（内部任务，不限排队长度，不占用分析请求的队列）
+    SCHEDULER_BACKGROUND_CONCURRENCY: int = 2
+    # 各类任务最大排队数，超过返回 429
+    SCHEDULER_INTERACTIVE_QUEUE: int = 16
+    SCHEDULER_EXPORT_QUEUE: int = 8
+    SCHEDULER_ANALYSIS_QUEUE: int = 16
+    # 单个客户端在每类任务中最多排队数（应小于各类队列长度，0 表示不单独限制）
+    SCHEDULER_CLIENT_QUEUE: int = 4
+    
+    # 缓存清理配置：各目录字节预算（0 表示不限制）和过期时间（秒，0 表示不过期）
+    EVICTION_INTERVAL_SECONDS: int = 300
+    OUTPUT_MAX_BYTES: int = 2 * 1024 ** 3  # outputs/ 混音结果与预览
+    OUTPUT_TTL_SECONDS: int = 7 * 24 * 3600
+    CACHE_MAX_BYTES: int = 2 * 1024 ** 3  # outputs/cache 转码与波形缓存
+    CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    TEMP_MAX_BYTES: int = 512 * 1024 ** 2  # outputs/temp 截取片段与渲染中间文件
+    TEMP_TTL_SECONDS: int = 3600
+    # 渲染结果生成后保留的最短时间，期间不会被清理（供下载和预览播放）
+    RESULT_LEASE_SECONDS: int = 3600
+    
+    # 节拍对齐只分析片段交界处的窗口（秒）：前段末尾和后段开头各取这么长
+    BEATSYNC_WINDOW_SECONDS: float = 12.0
+    
     # AI 配置
     APIKEY_MacOS_Code_DeepSeek: str = ""
     APIKEY_MacOS_Code_MoonShot: str = ""
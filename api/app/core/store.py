@@ -0,0 +1,194 @@
+"""
+共享状态存储 - SQLite (WAL) 本机多进程共享
+BigEyeMix 后端并发
+
+上传目录、任务状态、缓存记录都放在同一个 SQLite 数据库里，
+同一台机器上的多个 uvicorn / gunicorn worker 共享一致的状态：
+- WAL 模式：读写互不阻塞
+- 写操作使用 BEGIN IMMEDIATE 获取写锁，避免丢失更新
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from app.core.config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file_id TEXT PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    mtime REAL NOT NULL,
+    duration REAL,
+    analysis_status TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_mtime ON uploads (mtime);
+CREATE INDEX IF NOT EXISTS idx_uploads_original_name ON uploads (original_name);
+
+-- 派生产物按内容哈希记录，重命名和重复上传都能复用
+CREATE TABLE IF NOT EXISTS artifacts (
+    content_hash TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT,
+    error TEXT,
+    owner_pid INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (content_hash, artifact)
+);
+
+-- 分片上传会话，分片可以由不同 worker 并行接收
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    session_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    part_size INTEGER NOT NULL,
+    probe TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_hash ON upload_sessions (content_hash);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+    session_id TEXT NOT NULL,
+    part_index INTEGER NOT NULL,
+    PRIMARY KEY (session_id, part_index)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    request TEXT,
+    result TEXT,
+    error TEXT,
+    client_id TEXT,
+    owner_pid INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at);
+
+CREATE TABLE IF NOT EXISTS render_cache (
+    cache_key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    output_id TEXT NOT NULL,
+    owner_pid INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS artifact_access (
+    path TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS artifact_refs (
+    path TEXT NOT NULL,
+    owner_pid INTEGER NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (path, owner_pid)
+);
+
+-- 已不再使用但可能仍在被读取的文件，固定和保留都释放后删除
+CREATE TABLE IF NOT EXISTS retired_files (
+    path TEXT PRIMARY KEY
+);
+"""
+
+# 一次性迁移：按顺序执行，已执行的条数记录在 PRAGMA user_version 中。
+# 只能追加，不能修改或删除已有的条目。
+MIGRATIONS: list = []
+
+
+class StateStore:
+    """
+    SQLite 共享状态存储（每个线程一个连接）
+
+    数据库在第一次访问时才创建和迁移：导入模块（包括进程池子进程、
+    只用到其他服务的脚本）不会在当前目录下生成数据库文件。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._init_lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                # isolation_level=None：由 transaction() 显式控制事务
+                conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=30000")
+                self._local.conn = conn
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    self._migrate()
+                    self._initialized = True
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务：BEGIN IMMEDIATE 立即获取写锁，跨进程互斥"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _migrate(self):
+        """执行尚未执行的迁移（写锁内检查版本，多个进程同时启动时只执行一次）"""
+        if self.query_one("PRAGMA user_version")[0] >= len(MIGRATIONS):
+            return
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for statement in MIGRATIONS[version:]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        """只读查询"""
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params: tuple = ()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def execute(self, sql: str, params: tuple = ()) -> int:
+        """单条写语句（自动提交），返回影响行数"""
+        return self.connection().execute(sql, params).rowcount
+
+
+def pid_alive(pid: int | None) -> bool:
+    """同一台机器上的进程是否仍在运行"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# 单例
+store = StateStore(settings.STATE_DB_PATH)
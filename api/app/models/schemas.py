@@ -48,3 +48,29 @@ class AudioInfo(BaseModel):
     sample_rate: int
     channels: int
     format: str
+
+class UploadNegotiation(BaseModel):
+    """上传前协商 - 服务器已有相同内容时跳过传输"""
+    content_hash: str = Field(..., min_length=32, max_length=32, description="文件内容 MD5")
+    size: int = Field(..., ge=0, description="文件大小（字节）")
+    filename: str = Field(..., description="原始文件名")
+
+class TransitionClip(BaseModel):
+    """过渡分析中的一段音频：整首曲目或其中的片段"""
+    file_id: str = Field(..., description="音频文件 ID")
+    start: Optional[float] = Field(None, ge=0, description="片段开始时间（不填则分析整首曲目）")
+    end: Optional[float] = Field(None, ge=0, description="片段结束时间")
+
+class CompatibilityMatrixRequest(BaseModel):
+    """过渡兼容性矩阵请求 - 多段音频两两之间的兼容性"""
+    items: List[TransitionClip] = Field(..., min_length=1, max_length=64, description="参与比较的音频或片段")
+
+class ClipOrderRequest(BaseModel):
+    """片段排序请求 - 按过渡兼容性给出衔接最顺的顺序"""
+    items: List[TransitionClip] = Field(..., min_length=1, max_length=64, description="需要排序的音频或片段")
+    keep_first: bool = Field(False, description="第一项固定在开头")
+
+class TimelineRecommendRequest(BaseModel):
+    """时间线过渡推荐请求 - 为每个相邻片段的交界推荐过渡方案"""
+    segments: List[SegmentInfo] = Field(..., min_length=1, description="时间线片段（与 /api/mix/multi 相同，过渡块会被跳过）")
+    user_preference: Optional[str] = Field(None, description="用户偏好的过渡类型")
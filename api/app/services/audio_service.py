@@ -1,10 +1,12 @@
 import os
 import uuid
-import hashlib
+from typing import Callable
 from pydub import AudioSegment
 from app.core.config import settings
 import librosa
 import numpy as np
+from app.services.worker_pool import worker_pool
+from app.services.eviction_service import eviction_manager
 
 class AudioService:
     def __init__(self):
@@ -22,34 +24,27 @@ class AudioService:
     
     async def extract_segment(self, file_path: str, start: float, end: float) -> str:
         """截取音频片段并保存为 MP3"""
+        output_id = f"{uuid.uuid4()}.mp3"
+        output_path = os.path.join(self.temp_dir, output_id)
+        await worker_pool.run('encode', self._export_segment, file_path, start, end, output_path)
+        
+        return output_path
+    
+    def _export_segment(self, file_path: str, start: float, end: float, output_path: str):
+        """截取并编码片段（在进程池中执行）"""
         audio = AudioSegment.from_file(file_path)
         
         start_ms = int(start * 1000)
         end_ms = int(end * 1000)
         segment = audio[start_ms:end_ms]
         
-        output_id = f"{uuid.uuid4()}.mp3"
-        output_path = os.path.join(self.temp_dir, output_id)
         segment.export(output_path, format="mp3", bitrate="192k")
-        
-        return output_path
     
     async def get_browser_compatible_audio(self, file_path: str) -> str:
         """Convert audio to browser-compatible MP3 format, with caching"""
-        # Generate cache key based on file path and modification time
-        file_stat = os.stat(file_path)
-        cache_key = hashlib.md5(f"{file_path}_{file_stat.st_mtime}".encode()).hexdigest()
-        cache_path = os.path.join(self.cache_dir, f"{cache_key}.mp3")
-        
-        # Return cached version if exists
-        if os.path.exists(cache_path):
-            return cache_path
-        
-        # Convert to MP3
-        audio = AudioSegment.from_file(file_path)
-        audio.export(cache_path, format="mp3", bitrate="192k")
-        
-        return cache_path
+        # 转码结果按内容哈希缓存，与上传预处理共用
+        from app.services.file_service import file_service
+        return await file_service.get_browser_mp3(file_path)
     
     async def mix_tracks(
         self,
@@ -71,6 +66,34 @@ class AudioService:
         if not os.path.exists(track_a_path) or not os.path.exists(track_b_path):
             raise FileNotFoundError("One or both audio files not found")
         
+        output_id = f"{uuid.uuid4()}.mp3"
+        output_path = os.path.join(settings.OUTPUT_DIR, output_id)
+        await worker_pool.run(
+            'render',
+            self._render_two_tracks,
+            track_a_path, track_b_path,
+            track_a_start, track_a_end,
+            track_b_start, track_b_end,
+            target_duration, transition_duration,
+            output_path
+        )
+        eviction_manager.lease(output_path)
+        
+        return output_path
+    
+    def _render_two_tracks(
+        self,
+        track_a_path: str,
+        track_b_path: str,
+        track_a_start: float,
+        track_a_end: float | None,
+        track_b_start: float,
+        track_b_end: float | None,
+        target_duration: float | None,
+        transition_duration: float,
+        output_path: str
+    ):
+        """双轨混音渲染（在进程池中执行）"""
         # Load with pydub
         audio_a = AudioSegment.from_file(track_a_path)
         audio_b = AudioSegment.from_file(track_b_path)
@@ -97,17 +120,16 @@ class AudioService:
                 mixed = mixed[:target_ms]
         
         # Export
-        output_id = f"{uuid.uuid4()}.mp3"
-        output_path = os.path.join(settings.OUTPUT_DIR, output_id)
         mixed.export(output_path, format="mp3", bitrate="320k")
-        
-        return output_path
 
     async def mix_multi_segments(
         self,
         segments: list,
         transition_duration: float,
-        transition_type: str = "cut"
+        transition_type: str = "cut",
+        progress: Callable[[str, float], None] | None = None,
+        output_path: str | None = None,
+        fallbacks: list | None = None
     ) -> str:
         """
         Mix multiple audio segments with transitions
@@ -117,8 +139,15 @@ class AudioService:
         - silence: 静音过渡
         - crossfade: 淡入淡出（前段渐弱 + 后段渐强）
         - beatsync: 根据节奏（基于BPM节拍对齐）
+        
+        网络调用（PiAPI）和节拍分析在事件循环中先行完成，生成渲染计划，
+        再把解码、拼接、编码整体交给进程池执行。
+        
+        progress: 可选进度回调 (stage, percent)，stage 为 prepare / render
+        output_path: 可选输出路径，默认在 OUTPUT_DIR 下生成 uuid 文件名
+        fallbacks: 可选列表，过渡生成失败降级为静音时追加 (片段序号, 过渡类型)；
+                   降级结果只是临时替代，调用方据此决定是否缓存
         """
-        from app.services.piapi_service import piapi_service
         from app.services.beat_sync_service import BeatSyncService
         
         beat_sync_service = BeatSyncService()
@@ -126,121 +155,181 @@ class AudioService:
         if not segments or len(segments) < 1:
             raise ValueError("At least one segment is required")
         
-        mixed = None
-        prev_segment = None  # 用于魔法填充时获取前一段音频
-        prev_file_id = None
-        prev_end = 0
+        # 源文件、魔法填充和节拍分析生成的中间文件在渲染完成前不会被清理
+        with eviction_manager.pinned() as pins:
+            for seg in segments:
+                if seg.file_id not in ('__transition__', '__gap__'):
+                    pins.add(os.path.join(settings.UPLOAD_DIR, seg.file_id))
+            
+            plan = []
+            prev_file_id = None  # 用于魔法填充时获取前一段音频
+            prev_end = 0
         
-        for i, seg in enumerate(segments):
-            # 处理过渡块
-            if seg.file_id == '__transition__' or seg.file_id == '__gap__':
-                trans_duration_ms = int(seg.end * 1000)
-                trans_type = getattr(seg, 'transition_type', None) or getattr(seg, 'gap_type', 'silence') or 'silence'
+            for i, seg in enumerate(segments):
+                if progress:
+                    progress('prepare', i / len(segments) * 100)
+            
+                # 处理过渡块
+                if seg.file_id == '__transition__' or seg.file_id == '__gap__':
+                    trans_duration_ms = int(seg.end * 1000)
+                    trans_type = getattr(seg, 'transition_type', None) or getattr(seg, 'gap_type', 'silence') or 'silence'
+                    step = {'type': 'silence', 'duration_ms': trans_duration_ms}
                 
-                if trans_type == 'magicfill' and prev_segment is not None and i + 1 < len(segments):
-                    # 魔法填充：使用前一段音频的结尾生成过渡
-                    try:
-                        magic_segment = await self._generate_magic_transition(
-                            prev_file_id,
-                            prev_end,
-                            int(seg.end)  # 扩展时长（秒）
-                        )
-                        if magic_segment:
-                            segment = magic_segment
-                        else:
-                            # 魔法填充失败，降级为静音
-                            segment = AudioSegment.silent(duration=trans_duration_ms)
-                    except Exception as e:
-                        print(f"Magic fill failed: {e}, falling back to silence")
-                        segment = AudioSegment.silent(duration=trans_duration_ms)
+                    if trans_type == 'magicfill' and prev_file_id is not None and i + 1 < len(segments):
+                        # 魔法填充：使用前一段音频的结尾生成过渡
+                        try:
+                            magic_step = await self._generate_magic_transition(
+                                prev_file_id,
+                                prev_end,
+                                int(seg.end)  # 扩展时长（秒）
+                            )
+                            if magic_step:
+                                pins.add(magic_step['path'])
+                                step = magic_step
+                            elif fallbacks is not None:
+                                # 魔法填充失败，降级为静音
+                                fallbacks.append((i, trans_type))
+                        except Exception as e:
+                            print(f"Magic fill failed: {e}, falling back to silence")
+                            if fallbacks is not None:
+                                fallbacks.append((i, trans_type))
                 
-                elif trans_type == 'beatsync' and prev_segment is not None and i + 1 < len(segments):
-                    # 节拍对齐：使用智能节拍检测
-                    try:
-                        # 获取前一段和下一段的文件路径
-                        prev_seg = segments[i - 1]
-                        next_seg = segments[i + 1]
+                    elif trans_type == 'beatsync' and prev_file_id is not None and i + 1 < len(segments):
+                        # 节拍对齐：使用智能节拍检测
+                        try:
+                            # 获取前一段和下一段的文件路径
+                            prev_seg = segments[i - 1]
+                            next_seg = segments[i + 1]
                         
-                        if prev_seg.file_id != '__transition__' and next_seg.file_id != '__transition__':
-                            prev_path = os.path.join(settings.UPLOAD_DIR, prev_seg.file_id)
-                            next_path = os.path.join(settings.UPLOAD_DIR, next_seg.file_id)
+                            if (prev_seg.file_id not in ('__transition__', '__gap__')
+                                    and next_seg.file_id not in ('__transition__', '__gap__')):
+                                prev_path = os.path.join(settings.UPLOAD_DIR, prev_seg.file_id)
+                                next_path = os.path.join(settings.UPLOAD_DIR, next_seg.file_id)
                             
-                            # 截取片段
-                            prev_segment_path = await self.extract_segment(prev_path, prev_seg.start, prev_seg.end)
-                            next_segment_path = await self.extract_segment(next_path, next_seg.start, next_seg.end)
-                            
-                            # 执行节拍对齐
-                            transition_beats = max(2, int(seg.end / 0.5))  # 根据时长估算节拍数
-                            result_audio, sync_info = await beat_sync_service.sync_and_transition(
-                                prev_segment_path,
-                                next_segment_path,
-                                transition_beats
-                            )
+                                # 执行节拍分析（从源文件的节拍网格切片，无需截取片段）
+                                transition_beats = max(2, int(seg.end / 0.5))  # 根据时长估算节拍数
+                                sync_info = await beat_sync_service.analyze_transition(
+                                    (prev_path, prev_seg.start, prev_seg.end),
+                                    (next_path, next_seg.start, next_seg.end),
+                                    transition_beats
+                                )
                             
-                            # 使用对齐后的音频替换原有的前后片段
-                            # 注意：这里需要重新构建混合逻辑
-                            # 暂时降级为普通 crossfade
-                            segment = AudioSegment.silent(duration=trans_duration_ms)
-                            print(f"Beat sync info: {sync_info}")
-                        else:
-                            segment = AudioSegment.silent(duration=trans_duration_ms)
-                    except Exception as e:
-                        print(f"Beat sync failed: {e}, falling back to silence")
-                        segment = AudioSegment.silent(duration=trans_duration_ms)
+                                # 渲染时前段在 point1 处截断，后段从 point2 开始，两者在对齐的节拍上交叉淡化；
+                                # 过渡块本身不占时长
+                                step = {
+                                    'type': 'beatsync',
+                                    'point1': sync_info['transition_point1'],
+                                    'point2': sync_info['transition_point2'],
+                                    'duration': sync_info['transition_duration']
+                                }
+                        except Exception as e:
+                            print(f"Beat sync failed: {e}, falling back to silence")
+                            if fallbacks is not None:
+                                fallbacks.append((i, trans_type))
                         
-                elif trans_type == 'crossfade' and prev_segment is not None:
-                    # 淡入淡出：前段渐弱
-                    fade_duration = min(trans_duration_ms, len(prev_segment) // 2)
-                    if mixed and fade_duration > 0:
-                        # 对已混合的音频末尾应用淡出
-                        mixed = mixed.fade_out(fade_duration)
-                    # 添加静音过渡
-                    segment = AudioSegment.silent(duration=trans_duration_ms)
+                    elif trans_type == 'crossfade' and prev_file_id is not None:
+                        # 淡入淡出：前段渐弱 + 静音过渡
+                        step = {'type': 'crossfade', 'duration_ms': trans_duration_ms}
                 else:
-                    # 静音过渡
-                    segment = AudioSegment.silent(duration=trans_duration_ms)
-            else:
-                # 普通音频片段
-                file_path = os.path.join(settings.UPLOAD_DIR, seg.file_id)
-                if not os.path.exists(file_path):
-                    raise FileNotFoundError(f"Audio file not found: {seg.file_id}")
+                    # 普通音频片段
+                    file_path = os.path.join(settings.UPLOAD_DIR, seg.file_id)
+                    if not os.path.exists(file_path):
+                        raise FileNotFoundError(f"Audio file not found: {seg.file_id}")
+                
+                    step = {
+                        'type': 'clip',
+                        'path': file_path,
+                        'start_ms': int(seg.start * 1000),
+                        'end_ms': int(seg.end * 1000),
+                        'fade_in_ms': 0
+                    }
                 
-                audio = AudioSegment.from_file(file_path)
-                start_ms = int(seg.start * 1000)
-                end_ms = int(seg.end * 1000)
-                segment = audio[start_ms:end_ms]
+                    # 检查前一个是否是 crossfade 过渡，如果是则应用淡入
+                    if i > 0 and (segments[i-1].file_id == '__transition__' or segments[i-1].file_id == '__gap__'):
+                        prev_trans_type = getattr(segments[i-1], 'transition_type', None) or getattr(segments[i-1], 'gap_type', 'silence')
+                        if prev_trans_type == 'crossfade':
+                            step['fade_in_ms'] = int(segments[i-1].end * 1000)
+                
+                    # 保存当前片段信息，供魔法填充使用
+                    prev_file_id = seg.file_id
+                    prev_end = seg.end
+            
+                plan.append(step)
+        
+            # Render & export
+            if progress:
+                progress('render', 0)
+            if output_path is None:
+                output_path = os.path.join(settings.OUTPUT_DIR, f"{uuid.uuid4()}.mp3")
+            await worker_pool.run('render', self._render_timeline, plan, output_path)
+            if progress:
+                progress('render', 100)
+        
+        return output_path
+    
+    def _render_timeline(self, plan: list, output_path: str):
+        """按渲染计划拼接并导出（在进程池中执行）"""
+        from app.services.beat_sync_service import BeatSyncService
+        
+        sources = {}  # 同一源文件在时间线中多次出现时只解码一次
+        mixed = None
+        prev_segment = None
+        beat_sync = None  # 待与下一段衔接的节拍对齐过渡
+        
+        for step in plan:
+            if step['type'] == 'clip':
+                if step['path'] not in sources:
+                    sources[step['path']] = AudioSegment.from_file(step['path'])
+                segment = sources[step['path']][step['start_ms']:step['end_ms']]
                 
-                # 检查前一个是否是 crossfade 过渡，如果是则应用淡入
-                if i > 0 and (segments[i-1].file_id == '__transition__' or segments[i-1].file_id == '__gap__'):
-                    prev_trans_type = getattr(segments[i-1], 'transition_type', None) or getattr(segments[i-1], 'gap_type', 'silence')
-                    if prev_trans_type == 'crossfade':
-                        fade_duration = min(int(segments[i-1].end * 1000), len(segment) // 2)
-                        if fade_duration > 0:
-                            segment = segment.fade_in(fade_duration)
+                fade_duration = min(step['fade_in_ms'], len(segment) // 2)
+                if fade_duration > 0:
+                    segment = segment.fade_in(fade_duration)
                 
-                # 保存当前片段信息，供魔法填充使用
+                if beat_sync is not None and mixed is not None and prev_segment is not None:
+                    # 前段位于已混合音频的末尾，切点换算为在已混合音频中的位置
+                    prev_offset = (len(mixed) - len(prev_segment)) / 1000
+                    mixed = BeatSyncService()._execute_beat_transition(
+                        mixed, segment,
+                        prev_offset + beat_sync['point1'], beat_sync['point2'], beat_sync['duration']
+                    )
+                    # 已混合音频的末尾是后段切点之后的部分
+                    prev_segment = segment[int(beat_sync['point2'] * 1000):]
+                    beat_sync = None
+                    continue
                 prev_segment = segment
-                prev_file_id = seg.file_id
-                prev_end = seg.end
+            elif step['type'] == 'beatsync':
+                beat_sync = step
+                continue
+            elif step['type'] == 'audio':
+                # 魔法填充：只取扩展的部分（去掉原始参考音频）
+                extended_audio = AudioSegment.from_file(step['path'])
+                if len(extended_audio) > step['skip_ms']:
+                    segment = extended_audio[step['skip_ms']:]
+                else:
+                    segment = extended_audio
+            elif step['type'] == 'crossfade':
+                # 对已混合的音频末尾应用淡出
+                fade_duration = min(step['duration_ms'], len(prev_segment) // 2)
+                if mixed and fade_duration > 0:
+                    mixed = mixed.fade_out(fade_duration)
+                segment = AudioSegment.silent(duration=step['duration_ms'])
+            else:
+                segment = AudioSegment.silent(duration=step['duration_ms'])
             
             if mixed is None:
                 mixed = segment
             else:
                 mixed = mixed + segment
         
-        # Export
-        output_id = f"{uuid.uuid4()}.mp3"
-        output_path = os.path.join(settings.OUTPUT_DIR, output_id)
         mixed.export(output_path, format="mp3", bitrate="320k")
-        
-        return output_path
     
     async def _generate_magic_transition(
         self,
         file_id: str,
         end_time: float,
         extend_duration: int
-    ) -> AudioSegment | None:
+    ) -> dict | None:
         """
         使用 PiAPI ACE-Step 生成魔法填充过渡音频
         
@@ -250,14 +339,13 @@ class AudioService:
             extend_duration: 扩展时长（秒）
         
         Returns:
-            生成的过渡音频片段，或 None（失败时）
+            过渡音频的渲染步骤，或 None（失败时）
         """
         from app.services.piapi_service import piapi_service
         
         try:
             # 1. 截取源音频的最后 10 秒（或更短）
             file_path = os.path.join(settings.UPLOAD_DIR, file_id)
-            audio = AudioSegment.from_file(file_path)
             
             # 取最后 10 秒作为参考
             ref_duration = min(10, end_time)
@@ -269,29 +357,24 @@ class AudioService:
             # 2. 生成公网 URL
             public_url = f"{settings.SERVER_PUBLIC_URL}/api/audio/{segment_id}"
             
-            # 3. 调用 PiAPI 扩展
-            result_url = await piapi_service.extend_audio(
-                audio_url=public_url,
-                right_extend_duration=extend_duration,
-                style_prompt="smooth transition, same style",
-                lyrics="[inst]"
-            )
+            # 3. 调用 PiAPI 扩展（PiAPI 回源下载期间片段不能被清理）
+            with eviction_manager.pinned(segment_path):
+                result_url = await piapi_service.extend_audio(
+                    audio_url=public_url,
+                    right_extend_duration=extend_duration,
+                    style_prompt="smooth transition, same style",
+                    lyrics="[inst]"
+                )
             
             # 4. 下载结果
             output_path = await piapi_service.download_audio(result_url, self.temp_dir)
             
-            # 5. 加载并提取扩展部分（去掉原始音频）
-            extended_audio = AudioSegment.from_file(output_path)
-            
-            # 原始片段长度
-            original_length_ms = int(ref_duration * 1000)
-            
-            # 只取扩展的部分
-            if len(extended_audio) > original_length_ms:
-                transition_audio = extended_audio[original_length_ms:]
-                return transition_audio
-            else:
-                return extended_audio
+            # 5. 渲染时只取扩展部分（去掉原始片段长度）
+            return {
+                'type': 'audio',
+                'path': output_path,
+                'skip_ms': int(ref_duration * 1000)
+            }
                 
         except Exception as e:
             print(f"Magic transition generation failed: {e}")
@@ -2,14 +2,126 @@
 节拍对齐服务 - 智能节拍检测和对齐
 BigEyeMix 音频拼接过渡增强
 """
+import asyncio
 import librosa
 import numpy as np
 from pydub import AudioSegment
 import logging
 from typing import Dict, Tuple, Optional
+from app.core.config import settings
+from app.services.file_service import file_service, BEAT_GRID_SR, BEAT_GRID_HOP
+from app.services.worker_pool import worker_pool
 
 logger = logging.getLogger(__name__)
 
+# 片段：(源文件路径, 开始秒, 结束秒)
+Clip = Tuple[str, float, float]
+
+
+def boundary_window(start: float, end: float, edge: str) -> Tuple[float, float]:
+    """片段交界处的分析窗口：前段末尾（edge='tail'）或后段开头（edge='head'）"""
+    window = settings.BEATSYNC_WINDOW_SECONDS
+    if edge == 'tail':
+        return max(start, end - window), end
+    return start, min(end, start + window)
+
+
+def slice_beat_grid(grid: Dict, start: float, end: float) -> Dict:
+    """
+    从整首曲目的节拍网格中切出片段的节拍（二分查找，无需解码音频）
+
+    Returns:
+        与片段开头对齐的节拍信息
+    """
+    end = min(end, grid['duration'])
+    start = min(start, end)
+    frame_rate = grid['sr'] / grid['hop_length']
+    first_frame = int(start * frame_rate)
+    lo, hi = np.searchsorted(grid['beat_times'], [start, end])
+    # 节拍帧号与 onset 包络使用同一个起点，避免取整误差错开一帧
+    beats = np.round(grid['beat_times'][lo:hi] * frame_rate).astype(int) - first_frame
+    return {
+        'tempo': grid['tempo'],
+        'beats': beats,
+        'beat_times': grid['beat_times'][lo:hi] - start,
+        'onset_env': grid['onset_env'][first_frame:int(np.ceil(end * frame_rate))],
+        'frame_rate': frame_rate,
+        'duration': end - start,
+        'beat_count': int(hi - lo)
+    }
+
+
+def detect_window_beats(file_path: str, start: float, end: float) -> Dict:
+    """只解码并分析 [start, end) 窗口的节拍（在进程池中执行）"""
+    y, sr = librosa.load(file_path, sr=BEAT_GRID_SR, mono=True, offset=start, duration=end - start)
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=BEAT_GRID_HOP)
+    tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=BEAT_GRID_HOP)
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr, hop_length=BEAT_GRID_HOP)
+    return {
+        'tempo': float(np.atleast_1d(tempo)[0]),
+        'beats': beat_frames,
+        'beat_times': beat_times,
+        'onset_env': onset_env.astype(np.float32),
+        'frame_rate': sr / BEAT_GRID_HOP,
+        'duration': len(y) / sr,
+        'beat_count': len(beat_frames)
+    }
+
+
+def load_clip(clip: Clip) -> AudioSegment:
+    """只解码片段范围内的音频，直接在内存中使用（在进程池中执行）"""
+    file_path, start, end = clip
+    return AudioSegment.from_file(file_path, start_second=start, duration=end - start)
+
+
+def score_alignments(
+    tail_env: np.ndarray,
+    tail_beats: np.ndarray,
+    head_env: np.ndarray,
+    head_beats: np.ndarray,
+    length: int
+) -> Dict[str, np.ndarray]:
+    """
+    为所有 (前段节拍, 后段节拍) 切点组合打分
+
+    过渡时前段切点之前 length 帧与后段切点之后 length 帧重叠。对每个前段候选，
+    用 FFT 一次算出它与后段所有位置的 onset 包络互相关，再取出后段节拍处的值。
+
+    Args:
+        tail_env: 前段末尾窗口的 onset 包络
+        tail_beats: 前段候选切点（tail_env 中的帧序号，重叠区在切点之前）
+        head_env: 后段开头窗口的 onset 包络
+        head_beats: 后段候选切点（head_env 中的帧序号，重叠区在切点之后）
+        length: 重叠长度（帧）
+
+    Returns:
+        correlation, energy: 形状均为 (前段候选数, 后段候选数)，取值 0-1
+    """
+    # 两端补零，窗口越界的候选也能参与比较
+    a = np.concatenate([np.zeros(length), tail_env])
+    b = np.concatenate([head_env, np.zeros(length)])
+    tail_windows = np.lib.stride_tricks.sliding_window_view(a, length)[tail_beats]
+
+    # 互相关 = 与反转窗口卷积，批量 rfft
+    n = 1 << int(np.ceil(np.log2(len(b) + length)))
+    spectrum = np.fft.rfft(tail_windows[:, ::-1], n, axis=1) * np.fft.rfft(b, n)[None, :]
+    dots = np.fft.irfft(spectrum, n, axis=1)[:, head_beats + length - 1]
+
+    # 各窗口的能量和范数（前缀和）
+    b_sum = np.concatenate([[0.0], np.cumsum(b)])
+    b_sq = np.concatenate([[0.0], np.cumsum(b ** 2)])
+    head_mean = (b_sum[head_beats + length] - b_sum[head_beats]) / length
+    head_norm = np.sqrt(b_sq[head_beats + length] - b_sq[head_beats])
+    tail_mean = tail_windows.mean(axis=1)
+    tail_norm = np.linalg.norm(tail_windows, axis=1)
+
+    correlation = dots / np.maximum(tail_norm[:, None] * head_norm[None, :], 1e-9)
+    energy = 1 - np.abs(tail_mean[:, None] - head_mean[None, :]) / np.maximum(
+        tail_mean[:, None] + head_mean[None, :], 1e-9
+    )
+    return {'correlation': np.clip(correlation, 0, 1), 'energy': energy}
+
+
 class BeatSyncService:
     """节拍对齐处理服务"""
     
@@ -17,109 +129,225 @@ class BeatSyncService:
         self.default_transition_beats = 4  # 默认4拍过渡
         self.min_tempo = 60  # 最小BPM
         self.max_tempo = 200  # 最大BPM
+        # 切点评分权重：节奏对齐、能量接近、靠近片段交界
+        self.alignment_weights = {'correlation': 0.6, 'energy': 0.25, 'position': 0.15}
+        self.top_k = 3  # 返回的候选切点数
     
-    async def sync_and_transition(
-        self, 
-        audio1_path: str, 
-        audio2_path: str,
+    async def boundary_beats(self, clip: Clip, edge: str) -> Dict:
+        """
+        片段交界处窗口的节拍信息
+
+        只看前段末尾（edge='tail'）或后段开头（edge='head'）BEATSYNC_WINDOW_SECONDS 秒：
+        源文件已有节拍网格时直接切片，否则只解码这个窗口，耗时与片段长度无关。
+
+        Returns:
+            窗口内的节拍信息，offset 为窗口在片段中的起点
+        """
+        file_path, start, end = clip
+        window_start, window_end = boundary_window(start, end, edge)
+        
+        grid = await file_service.cached_beat_grid(file_path)
+        if grid is not None:
+            beat_info = slice_beat_grid(grid, window_start, window_end)
+        else:
+            beat_info = await worker_pool.run('analysis', detect_window_beats, file_path, window_start, window_end)
+            # 整首的节拍网格在后台补上
+            file_service.schedule_preprocess(file_path)
+        beat_info['offset'] = window_start - start
+        
+        # 验证tempo合理性
+        if beat_info['tempo'] < self.min_tempo or beat_info['tempo'] > self.max_tempo:
+            logger.warning(f"检测到异常BPM: {beat_info['tempo']}, 使用默认值120")
+            beat_info['tempo'] = 120.0
+        return beat_info
+    
+    async def analyze_transition(
+        self,
+        clip1: Clip,
+        clip2: Clip,
         transition_beats: int = 4
-    ) -> Tuple[AudioSegment, Dict]:
+    ) -> Dict:
         """
-        在节拍点进行智能对齐和过渡
+        分析节拍并计算过渡方案（不渲染音频）
         
         Args:
-            audio1_path: 第一段音频路径
-            audio2_path: 第二段音频路径
+            clip1: 第一段片段 (源文件路径, 开始, 结束)
+            clip2: 第二段片段
             transition_beats: 过渡节拍数
             
         Returns:
-            (处理后的音频, 处理信息)
+            过渡方案信息（过渡点相对各片段开头）
         """
-        try:
-            logger.info(f"开始节拍对齐: {audio1_path} -> {audio2_path}")
-            
-            # 1. 检测节拍
-            beat_info1 = self._detect_beats(audio1_path)
-            beat_info2 = self._detect_beats(audio2_path)
-            
-            logger.info(f"音频1 BPM: {beat_info1['tempo']:.1f}, 音频2 BPM: {beat_info2['tempo']:.1f}")
-            
-            # 2. 计算最佳过渡点
-            transition_point1 = self._find_best_transition_point(
+        logger.info(f"开始节拍对齐: {clip1} -> {clip2}")
+        
+        # 1. 读取交界处的节拍：前段末尾、后段开头
+        beat_info1, beat_info2 = await asyncio.gather(
+            self.boundary_beats(clip1, 'tail'),
+            self.boundary_beats(clip2, 'head')
+        )
+        
+        logger.info(f"音频1 BPM: {beat_info1['tempo']:.1f}, 音频2 BPM: {beat_info2['tempo']:.1f}")
+        
+        # 2. 计算过渡时长
+        avg_tempo = (beat_info1['tempo'] + beat_info2['tempo']) / 2
+        beat_duration = 60.0 / avg_tempo
+        transition_duration = beat_duration * transition_beats
+        
+        # 3. 搜索最佳过渡点（窗口内时间换算为片段内时间）
+        alignments = self._search_alignments(beat_info1, beat_info2, transition_duration)
+        if alignments:
+            transition_point1 = alignments[0]['transition_point1']
+            transition_point2 = alignments[0]['transition_point2']
+        else:
+            # 没有检测到节拍，使用固定位置
+            transition_point1 = beat_info1['offset'] + self._find_best_transition_point(
                 beat_info1, 
                 from_end=True
             )
-            transition_point2 = self._find_best_transition_point(
+            transition_point2 = beat_info2['offset'] + self._find_best_transition_point(
                 beat_info2, 
                 from_end=False
             )
+        
+        logger.info(f"过渡点: {transition_point1:.2f}s -> {transition_point2:.2f}s, 时长: {transition_duration:.2f}s")
+        
+        return {
+            'success': True,
+            'tempo1': float(beat_info1['tempo']),
+            'tempo2': float(beat_info2['tempo']),
+            'transition_point1': float(transition_point1),
+            'transition_point2': float(transition_point2),
+            'transition_duration': float(transition_duration),
+            'transition_beats': transition_beats,
+            'alignments': alignments
+        }
+    
+    async def sync_and_transition(
+        self, 
+        clip1: Clip,
+        clip2: Clip,
+        output_path: str,
+        transition_beats: int = 4
+    ) -> Tuple[str, Dict]:
+        """
+        在节拍点进行智能对齐和过渡
+        
+        节拍来自缓存的节拍网格，渲染时直接从源文件解码片段范围，
+        不生成截取片段的临时文件。
+        
+        Args:
+            clip1: 第一段片段 (源文件路径, 开始, 结束)
+            clip2: 第二段片段
+            output_path: 输出文件路径
+            transition_beats: 过渡节拍数
             
-            # 3. 计算过渡时长
-            avg_tempo = (beat_info1['tempo'] + beat_info2['tempo']) / 2
-            beat_duration = 60.0 / avg_tempo
-            transition_duration = beat_duration * transition_beats
-            
-            logger.info(f"过渡点: {transition_point1:.2f}s -> {transition_point2:.2f}s, 时长: {transition_duration:.2f}s")
+        Returns:
+            (输出文件路径, 处理信息)
+        """
+        try:
+            info = await self.analyze_transition(clip1, clip2, transition_beats)
             
-            # 4. 执行过渡
-            result = self._execute_beat_transition(
-                audio1_path,
-                audio2_path,
-                transition_point1,
-                transition_point2,
-                transition_duration
+            # 4. 执行过渡并导出
+            await worker_pool.run(
+                'render',
+                self._render_beat_transition,
+                clip1,
+                clip2,
+                info['transition_point1'],
+                info['transition_point2'],
+                info['transition_duration'],
+                output_path
             )
             
-            # 5. 返回处理信息
-            info = {
-                'success': True,
-                'tempo1': float(beat_info1['tempo']),
-                'tempo2': float(beat_info2['tempo']),
-                'transition_point1': float(transition_point1),
-                'transition_point2': float(transition_point2),
-                'transition_duration': float(transition_duration),
-                'transition_beats': transition_beats
-            }
-            
             logger.info(f"节拍对齐完成: {transition_beats}拍过渡")
-            return result, info
+            return output_path, info
             
         except Exception as e:
             logger.error(f"节拍对齐失败: {str(e)}, 降级到普通crossfade")
             # 降级到普通crossfade
-            result = self._fallback_crossfade(audio1_path, audio2_path)
+            await worker_pool.run(
+                'render',
+                self._render_fallback_crossfade,
+                clip1,
+                clip2,
+                output_path
+            )
             info = {
                 'success': False,
                 'error': str(e),
                 'fallback': 'crossfade'
             }
-            return result, info
+            return output_path, info
     
-    def _detect_beats(self, audio_path: str) -> Dict:
-        """检测音频节拍信息"""
-        try:
-            # 加载音频（降采样以提高速度）
-            y, sr = librosa.load(audio_path, sr=22050)
-            
-            # 检测节拍
-            tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-            beat_times = librosa.frames_to_time(beats, sr=sr)
-            
-            # 验证tempo合理性
-            if tempo < self.min_tempo or tempo > self.max_tempo:
-                logger.warning(f"检测到异常BPM: {tempo}, 使用默认值120")
-                tempo = 120.0
-            
-            return {
-                'tempo': float(tempo),
-                'beats': beats,
-                'beat_times': beat_times,
-                'duration': len(y) / sr,
-                'beat_count': len(beats)
-            }
-        except Exception as e:
-            logger.error(f"节拍检测失败: {str(e)}")
-            raise
+    def _render_beat_transition(
+        self,
+        clip1: Clip,
+        clip2: Clip,
+        point1: float,
+        point2: float,
+        duration: float,
+        output_path: str
+    ):
+        """执行节拍过渡并导出（在进程池中执行）"""
+        result = self._execute_beat_transition(load_clip(clip1), load_clip(clip2), point1, point2, duration)
+        result.export(output_path, format="mp3", bitrate="320k")
+    
+    def _render_fallback_crossfade(self, clip1: Clip, clip2: Clip, output_path: str):
+        """普通淡化过渡并导出（在进程池中执行）"""
+        result = self._fallback_crossfade(load_clip(clip1), load_clip(clip2))
+        result.export(output_path, format="mp3", bitrate="320k")
+    
+    def _search_alignments(self, tail_info: Dict, head_info: Dict, transition_duration: float) -> list:
+        """
+        对前段末尾和后段开头的所有节拍组合评分，返回得分最高的 top_k 个切点
+
+        Returns:
+            [{'transition_point1', 'transition_point2', 'score', 'correlation', 'energy'}]，
+            时间相对各片段开头；任一窗口没有节拍时为空
+        """
+        frame_rate = tail_info['frame_rate']
+        length = max(1, int(round(transition_duration * frame_rate)))
+        
+        # 只保留重叠区完整落在分析窗口内的切点：前段切点之前、后段切点之后都要有
+        # length 帧音频，渲染时的重叠长度才与评分时一致
+        tail_beats = tail_info['beats']
+        head_beats = head_info['beats']
+        tail_beats = tail_beats[(tail_beats >= length) & (tail_beats < len(tail_info['onset_env']))]
+        head_beats = head_beats[(head_beats >= 0) & (head_beats + length <= len(head_info['onset_env']))]
+        if len(tail_beats) == 0 or len(head_beats) == 0:
+            return []
+        
+        # onset 峰只有一两帧宽，平滑后容忍节拍检测的一帧误差
+        kernel = np.ones(3) / 3
+        scores = score_alignments(
+            np.convolve(tail_info['onset_env'], kernel, mode='same'), tail_beats,
+            np.convolve(head_info['onset_env'], kernel, mode='same'), head_beats,
+            length
+        )
+        
+        # 越靠近交界保留的内容越多
+        position = (
+            tail_beats[:, None] / max(len(tail_info['onset_env']), 1)
+            + 1 - head_beats[None, :] / max(len(head_info['onset_env']), 1)
+        ) / 2
+        weights = self.alignment_weights
+        total = (
+            weights['correlation'] * scores['correlation']
+            + weights['energy'] * scores['energy']
+            + weights['position'] * position
+        )
+        
+        best = np.argsort(total, axis=None)[::-1][:self.top_k]
+        alignments = []
+        for i, j in zip(*np.unravel_index(best, total.shape)):
+            alignments.append({
+                'transition_point1': float(tail_info['offset'] + tail_beats[i] / frame_rate),
+                'transition_point2': float(head_info['offset'] + head_beats[j] / frame_rate),
+                'score': round(float(total[i, j]), 4),
+                'correlation': round(float(scores['correlation'][i, j]), 4),
+                'energy': round(float(scores['energy'][i, j]), 4)
+            })
+        return alignments
     
     def _find_best_transition_point(
         self, 
@@ -150,16 +378,13 @@ class BeatSyncService:
     
     def _execute_beat_transition(
         self,
-        audio1_path: str,
-        audio2_path: str,
+        audio1: AudioSegment,
+        audio2: AudioSegment,
         point1: float,
         point2: float,
         duration: float
     ) -> AudioSegment:
-        """执行节拍对齐的过渡"""
-        audio1 = AudioSegment.from_file(audio1_path)
-        audio2 = AudioSegment.from_file(audio2_path)
-        
+        """执行节拍对齐的过渡（输入为已解码的片段）"""
         # 转换为毫秒
         cut_point1 = int(point1 * 1000)
         cut_point2 = int(point2 * 1000)
@@ -169,17 +394,14 @@ class BeatSyncService:
         cut_point1 = min(cut_point1, len(audio1))
         cut_point2 = min(cut_point2, len(audio2))
         
-        # 确保crossfade时长不超过音频长度
-        crossfade_duration = min(
-            crossfade_duration,
-            len(audio1) - cut_point1,
-            len(audio2) - cut_point2
-        )
-        
         # 裁剪音频
         part1 = audio1[:cut_point1]
         part2 = audio2[cut_point2:]
         
+        # 重叠区是前段切点之前和后段切点之后的音频（与切点评分一致），
+        # 不超过保留部分的长度
+        crossfade_duration = min(crossfade_duration, len(part1), len(part2))
+        
         # 应用crossfade
         if crossfade_duration > 0:
             result = part1.append(part2, crossfade=crossfade_duration)
@@ -190,15 +412,12 @@ class BeatSyncService:
     
     def _fallback_crossfade(
         self, 
-        audio1_path: str, 
-        audio2_path: str,
+        audio1: AudioSegment, 
+        audio2: AudioSegment,
         duration_ms: int = 3000
     ) -> AudioSegment:
         """降级方案：普通淡化过渡"""
-        audio1 = AudioSegment.from_file(audio1_path)
-        audio2 = AudioSegment.from_file(audio2_path)
-        
-        return audio1.append(audio2, crossfade=duration_ms)
+        return audio1.append(audio2, crossfade=min(duration_ms, len(audio1), len(audio2)))
     
     def estimate_optimal_beats(self, tempo1: float, tempo2: float) -> int:
         """
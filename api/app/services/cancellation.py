@@ -0,0 +1,81 @@
+"""
+取消服务 - 客户端断开时取消请求范围内的后台工作
+BigEyeMix 后端并发
+
+用户关闭预览或拼接流后，继续渲染、轮询 PiAPI、消耗 DeepSeek token
+都是白费。这里在请求处理期间监听客户端连接，断开后取消正在执行的任务，
+并按端点统计取消次数，在 /api/metrics 中查看节省了多少工作。
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Dict, TypeVar
+
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class ClientDisconnected(HTTPException):
+    """客户端已断开（与 Nginx 一致使用 499）"""
+
+    def __init__(self, name: str):
+        super().__init__(status_code=499, detail=f"Client closed request: {name}")
+        self.name = name
+
+
+class CancellationMonitor:
+    """监听客户端断开并取消对应任务"""
+    POLL_SECONDS = 0.5  # 检查连接状态的间隔
+
+    def __init__(self):
+        self._cancelled: Dict[str, int] = defaultdict(int)
+
+    def record(self, name: str):
+        """记录一次因客户端断开而取消的工作"""
+        self._cancelled[name] += 1
+        logger.info(f"客户端已断开，取消任务: {name}")
+
+    async def run(self, request: Request, awaitable: Awaitable[T], name: str) -> T:
+        """
+        执行任务，客户端断开时取消
+
+        Args:
+            request: 当前请求
+            awaitable: 要执行的协程
+            name: 统计用的任务名称
+
+        Raises:
+            ClientDisconnected: 客户端在任务完成前断开
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.POLL_SECONDS)
+                if done:
+                    return task.result()
+                if await request.is_disconnected():
+                    task.cancel()
+                    # 等待取消完成，确保临时文件等资源已清理
+                    await asyncio.gather(task, return_exceptions=True)
+                    if not task.cancelled():
+                        # 取消前任务已经完成，结果（例如已获取的槽位）交给调用方处理
+                        return task.result()
+                    self.record(name)
+                    raise ClientDisconnected(name)
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def stats(self) -> Dict:
+        """各端点的取消次数"""
+        return {
+            'total': sum(self._cancelled.values()),
+            'by_name': dict(self._cancelled)
+        }
+
+
+# 单例
+cancellation_monitor = CancellationMonitor()
@@ -0,0 +1,262 @@
+"""
+清理服务 - 输出目录、转码缓存和临时文件的容量控制
+BigEyeMix 后端并发
+
+outputs/、outputs/cache、outputs/temp 只写不删会一直增长。这里定期清理：
+- 每个目录独立的字节预算和过期时间
+- 超出预算时按最近访问时间（LRU）淘汰
+- 正在使用的文件不会被清理：进行中的渲染、魔法填充片段用 pinned() 固定，
+  刚生成的结果用 lease() 保留一段时间供下载和预览播放
+- 不再使用的文件用 retire() 删除：仍被固定时推迟到释放之后
+- 访问记录和固定记录保存在共享状态库中，多个 worker 互相可见
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from app.core.config import settings
+from app.core.store import store, pid_alive
+
+logger = logging.getLogger(__name__)
+
+
+class PinSet:
+    """一组被固定的文件，退出 pinned() 时统一释放"""
+
+    def __init__(self, manager: "EvictionManager"):
+        self._manager = manager
+        self.paths: List[str] = []
+
+    def add(self, path: str):
+        self._manager._pin(path)
+        self.paths.append(path)
+
+
+class EvictionManager:
+    """按预算、过期时间和 LRU 清理派生文件"""
+    ACCESS_WRITE_INTERVAL = 60  # 同一文件的访问时间最多每分钟写一次
+
+    def __init__(self):
+        self.budgets = {
+            'outputs': (settings.OUTPUT_DIR, settings.OUTPUT_MAX_BYTES, settings.OUTPUT_TTL_SECONDS),
+            'cache': (os.path.join(settings.OUTPUT_DIR, 'cache'), settings.CACHE_MAX_BYTES, settings.CACHE_TTL_SECONDS),
+            'temp': (os.path.join(settings.OUTPUT_DIR, 'temp'), settings.TEMP_MAX_BYTES, settings.TEMP_TTL_SECONDS),
+        }
+        self._pins: Dict[str, int] = {}
+        self._touched: Dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+        self._last_sweep_at: float | None = None
+        self._stats = {
+            name: {'files': 0, 'bytes': 0, 'reclaimed_files': 0, 'reclaimed_bytes': 0}
+            for name in self.budgets
+        }
+
+    def start(self):
+        """启动定期清理"""
+        if self._task is None and settings.EVICTION_INTERVAL_SECONDS > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.EVICTION_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"缓存清理失败: {e}")
+
+    def touch(self, path: str):
+        """记录文件被访问，用于 LRU 淘汰"""
+        path = os.path.abspath(path)
+        now = time.time()
+        if now - self._touched.get(path, 0) < self.ACCESS_WRITE_INTERVAL:
+            return
+        self._touched[path] = now
+        store.execute(
+            "INSERT OR REPLACE INTO artifact_access (path, last_access) VALUES (?, ?)", (path, now)
+        )
+
+    def lease(self, path: str, seconds: float | None = None):
+        """在给定时间内保留文件（默认 RESULT_LEASE_SECONDS）"""
+        expires_at = time.time() + (seconds if seconds is not None else settings.RESULT_LEASE_SECONDS)
+        store.execute(
+            """INSERT INTO artifact_refs (path, owner_pid, expires_at) VALUES (?, 0, ?)
+               ON CONFLICT (path, owner_pid) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)""",
+            (os.path.abspath(path), expires_at)
+        )
+
+    @contextmanager
+    def pinned(self, *paths: str) -> Iterator[PinSet]:
+        """
+        在 with 块内固定文件，不会被清理
+
+        可在块内通过 pins.add(path) 追加之后生成的文件。
+        """
+        pins = PinSet(self)
+        for path in paths:
+            pins.add(path)
+        try:
+            yield pins
+        finally:
+            for path in pins.paths:
+                self._unpin(path)
+
+    def _pin(self, path: str):
+        path = os.path.abspath(path)
+        self._pins[path] = self._pins.get(path, 0) + 1
+        if self._pins[path] == 1:
+            store.execute(
+                "INSERT OR REPLACE INTO artifact_refs (path, owner_pid, expires_at) VALUES (?, ?, NULL)",
+                (path, os.getpid())
+            )
+
+    def _unpin(self, path: str):
+        path = os.path.abspath(path)
+        self._pins[path] -= 1
+        if not self._pins[path]:
+            del self._pins[path]
+            store.execute(
+                "DELETE FROM artifact_refs WHERE path = ? AND owner_pid = ?", (path, os.getpid())
+            )
+            if store.query_one("SELECT 1 FROM retired_files WHERE path = ?", (path,)):
+                self.remove_retired()
+
+    def retire(self, path: str):
+        """
+        删除不再使用的文件（例如换名后的旧上传文件）
+
+        仍被固定或在保留期内时先记录下来，释放时或下一次清理时删除。
+        """
+        store.execute("INSERT OR IGNORE INTO retired_files (path) VALUES (?)", (os.path.abspath(path),))
+        self.remove_retired()
+
+    def remove_retired(self):
+        """删除已没有固定和保留的待删除文件"""
+        self._remove_retired(self._protected_paths(time.time()))
+
+    def _remove_retired(self, protected: set):
+        for row in store.query("SELECT path FROM retired_files"):
+            if row['path'] in protected:
+                continue
+            self._remove(row['path'])
+            store.execute("DELETE FROM retired_files WHERE path = ?", (row['path'],))
+
+    def _protected_paths(self, now: float) -> set:
+        """仍被固定或在保留期内的文件；顺带清除过期记录"""
+        with store.transaction() as conn:
+            conn.execute(
+                "DELETE FROM artifact_refs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            )
+            protected = set()
+            for row in conn.execute("SELECT path, owner_pid, expires_at FROM artifact_refs").fetchall():
+                if row['expires_at'] is None and not pid_alive(row['owner_pid']):
+                    # 固定文件的进程已退出
+                    conn.execute(
+                        "DELETE FROM artifact_refs WHERE path = ? AND owner_pid = ?",
+                        (row['path'], row['owner_pid'])
+                    )
+                else:
+                    protected.add(row['path'])
+        return protected
+
+    def sweep(self) -> Dict:
+        """
+        执行一次清理（阻塞，定期任务在线程中调用）
+
+        Returns:
+            本次各目录回收的文件数和字节数
+        """
+        now = time.time()
+        protected = self._protected_paths(now)
+        self._remove_retired(protected)
+        access = {row['path']: row['last_access'] for row in store.query("SELECT path, last_access FROM artifact_access")}
+        reclaimed = {}
+
+        for name, (directory, max_bytes, ttl) in self.budgets.items():
+            entries = []
+            if os.path.isdir(directory):
+                for entry in os.scandir(directory):
+                    if not entry.is_file():
+                        continue
+                    path = os.path.abspath(entry.path)
+                    stat = entry.stat()
+                    entries.append((max(stat.st_mtime, access.get(path, 0)), stat.st_size, path))
+
+            # 最久未访问的在前
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            removed_files, removed_bytes = 0, 0
+
+            for last_access, size, path in entries:
+                expired = ttl and now - last_access > ttl
+                over_budget = max_bytes and total > max_bytes
+                if not expired and not over_budget:
+                    break
+                if path in protected:
+                    continue
+                if self._remove(path):
+                    total -= size
+                    removed_files += 1
+                    removed_bytes += size
+
+            stats = self._stats[name]
+            stats['files'] = len(entries) - removed_files
+            stats['bytes'] = total
+            stats['reclaimed_files'] += removed_files
+            stats['reclaimed_bytes'] += removed_bytes
+            reclaimed[name] = {'files': removed_files, 'bytes': removed_bytes}
+            if removed_files:
+                logger.info(f"清理 {name}: {removed_files} 个文件, {removed_bytes / 1024 / 1024:.1f} MB")
+
+        # 已删除上传文件的产物记录，过期后清除
+        store.execute(
+            """DELETE FROM artifacts WHERE updated_at < ?
+               AND content_hash NOT IN (SELECT content_hash FROM uploads)""",
+            (now - settings.CACHE_TTL_SECONDS,)
+        )
+
+        self._last_sweep_at = now
+        return reclaimed
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"无法删除 {path}: {e}")
+            return False
+
+        self._touched.pop(path, None)
+        store.execute("DELETE FROM artifact_access WHERE path = ?", (path,))
+        # 渲染缓存记录随结果文件一起删除
+        store.execute("DELETE FROM render_cache WHERE output_id = ?", (os.path.basename(path),))
+        return True
+
+    def stats(self) -> Dict:
+        """各目录占用与累计回收量"""
+        return {
+            'last_sweep_at': self._last_sweep_at,
+            'pinned': len(self._pins),
+            'reclaimed_bytes': sum(s['reclaimed_bytes'] for s in self._stats.values()),
+            'directories': {
+                name: {
+                    **self._stats[name],
+                    'max_bytes': max_bytes,
+                    'ttl_seconds': ttl
+                }
+                for name, (_, max_bytes, ttl) in self.budgets.items()
+            }
+        }
+
+
+# 单例
+eviction_manager = EvictionManager()
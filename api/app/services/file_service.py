@@ -1,144 +1,880 @@
 import os
 import uuid
+import asyncio
 import hashlib
 import json
+import time
 import aiofiles
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator
 from fastapi import UploadFile
+from multipart.multipart import MultipartParser, parse_options_header
 from pydub import AudioSegment
 from app.core.config import settings
+from app.core.store import store
 import librosa
 import numpy as np
 from datetime import datetime
+from app.core.store import pid_alive
+from app.services.worker_pool import worker_pool
+from app.services.eviction_service import eviction_manager
+from app.services.scheduler import scheduler
+from app.services.feature_kernel import analyze_signal, estimate_features, BEAT_GRID_SR, BEAT_GRID_HOP
+
+# 上传后在后台生成的产物，按生成顺序排列
+# estimate 是特征的一级快速估计，不排队立即生成；features 完整分析完成后取代它
+# 节拍网格（tempo、beat_times、onset 包络）包含在 features 中，同一次解码和 STFT 得到
+ARTIFACTS = ('estimate', 'metadata', 'peaks', 'mp3', 'features')
+
+# 产物算法版本：修改生成逻辑时递增，旧产物自动失效
+ARTIFACT_VERSIONS = {'metadata': 1, 'peaks': 1, 'mp3': 1, 'features': 3, 'estimate': 1}
+
+# 以文件形式缓存的产物及其扩展名
+ARTIFACT_FILES = {'peaks': 'json', 'mp3': 'mp3', 'features': 'npz'}
+
+# 产物状态
+ARTIFACT_PENDING = 'pending'
+ARTIFACT_RUNNING = 'running'
+ARTIFACT_READY = 'ready'
+ARTIFACT_FAILED = 'failed'
 
 class FileService:
     MAX_HISTORY_FILES = 10
     WAVEFORM_SAMPLES = 800  # 波形采样点数
+    UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传分块大小，内存占用与文件大小无关
+    MULTIPART_OVERHEAD = 64 * 1024  # multipart 边界和字段头允许占用的字节数
+    WATCH_POLL_SECONDS = 0.5  # 订阅产物状态时的轮询间隔
     
     def __init__(self):
-        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
         # 缓存目录
         self.cache_dir = os.path.join(settings.OUTPUT_DIR, 'cache')
-        os.makedirs(self.cache_dir, exist_ok=True)
-        # MD5 index file
+        # 旧版 MD5 索引文件，迁移到上传目录表后不再使用
         self.md5_index_path = os.path.join(settings.UPLOAD_DIR, '.md5_index')
-        self.md5_index = self._load_md5_index()
+        # 非上传文件的内容哈希缓存: (path, size, mtime_ns) -> md5
+        self._hash_memo = {}
+        # 本进程正在生成（或排队等待生成）的产物: (content_hash, artifact) -> Task
+        self._building = {}
+        # 本进程正在生成的预览波形: 预览文件路径 -> Task（相同预览的请求共用）
+        self._preview_waveforms = {}
     
-    def _load_md5_index(self) -> dict:
-        """Load MD5 index from file"""
-        index = {}
+    def start(self):
+        """
+        创建目录并使上传目录表与磁盘一致（应用启动时调用）
+
+        不在导入模块时执行：进程池的子进程会重新导入本模块，
+        在子进程中扫描上传目录会与主进程的上传和重命名相互竞争。
+        """
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 换名前的旧文件先删除，不重新登记到目录表
+        eviction_manager.remove_retired()
+        self._reconcile_catalog()
+    
+    def __getstate__(self):
+        # 方法提交到进程池时会 pickle 实例，进程内的状态不随之传递
+        state = self.__dict__.copy()
+        state['_hash_memo'] = {}
+        state['_building'] = {}
+        state['_preview_waveforms'] = {}
+        return state
+    
+    def _legacy_hashes(self) -> dict:
+        """Collect file_id -> md5 from the legacy .md5_index file"""
+        hashes = {}
         if os.path.exists(self.md5_index_path):
             try:
                 with open(self.md5_index_path, 'r') as f:
                     for line in f:
                         parts = line.strip().split('|')
                         if len(parts) == 2:
-                            md5, file_id = parts
-                            # Only keep if file still exists
-                            if os.path.exists(os.path.join(settings.UPLOAD_DIR, file_id)):
-                                index[md5] = file_id
-            except:
+                            hashes[parts[1]] = parts[0]
+                os.replace(self.md5_index_path, f"{self.md5_index_path}.migrated")
+            except FileNotFoundError:
+                # 另一个 worker 已完成迁移
                 pass
-        return index
+        return hashes
     
-    def _save_md5_index(self):
-        """Save MD5 index to file"""
-        try:
-            with open(self.md5_index_path, 'w') as f:
-                for md5, file_id in self.md5_index.items():
-                    f.write(f"{md5}|{file_id}\n")
-        except:
-            pass
+    def _reconcile_catalog(self):
+        """Bring the upload catalog in line with the upload directory (startup only)"""
+        legacy = self._legacy_hashes()
+        on_disk = {
+            entry.name: entry.stat()
+            for entry in os.scandir(settings.UPLOAD_DIR)
+            if not entry.name.startswith('.') and entry.is_file()
+        }
+        catalogued = {row['file_id'] for row in store.query("SELECT file_id FROM uploads")}
+        
+        # Hash new files outside the write lock
+        missing = {}
+        for file_id in on_disk.keys() - catalogued:
+            file_path = os.path.join(settings.UPLOAD_DIR, file_id)
+            missing[file_id] = legacy.get(file_id) or self.hash_file(file_path)
+        
+        with store.transaction() as conn:
+            for file_id in catalogued - on_disk.keys():
+                conn.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,))
+            for file_id, content_hash in missing.items():
+                stat = on_disk[file_id]
+                conn.execute(
+                    """INSERT OR IGNORE INTO uploads
+                       (file_id, original_name, size, content_hash, mtime)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (file_id, self._extract_original_name(file_id), stat.st_size, content_hash, stat.st_mtime)
+                )
     
-    def _calculate_md5(self, content: bytes) -> str:
-        """Calculate MD5 hash of content"""
-        return hashlib.md5(content).hexdigest()
+    def hash_file(self, file_path: str) -> str:
+        """Calculate MD5 hash of a file without loading it into memory"""
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                md5.update(chunk)
+        return md5.hexdigest()
     
-    async def save_upload(self, file: UploadFile) -> str:
-        """Save uploaded file and return file path (with MD5 deduplication)"""
-        # Validate file extension
-        ext = file.filename.split('.')[-1].lower()
+    async def get_content_hash(self, file_path: str) -> str:
+        """获取文件内容哈希（优先使用上传目录表，其次计算并缓存）"""
+        row = store.query_one(
+            "SELECT content_hash FROM uploads WHERE file_id = ?",
+            (os.path.basename(file_path),)
+        )
+        if row:
+            return row['content_hash']
+        
+        stat = os.stat(file_path)
+        memo_key = (file_path, stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._hash_memo:
+            self._hash_memo[memo_key] = await asyncio.to_thread(self.hash_file, file_path)
+        return self._hash_memo[memo_key]
+    
+    def validate_filename(self, filename: str) -> str:
+        """Check that the file type may be uploaded and return its extension"""
+        ext = filename.split('.')[-1].lower()
         if ext not in settings.allowed_extensions_list:
             raise ValueError(f"File type .{ext} not allowed")
+        return ext
+    
+    def _new_file_id(self, filename: str) -> tuple:
+        """Validate the extension and build (original_name, file_id) for an upload"""
+        ext = self.validate_filename(filename)
+        
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        safe_name = "".join(c for c in filename.rsplit('.', 1)[0] if c.isalnum() or c in '._- ')[:50]
+        new_name = f"{safe_name}.{ext}"
+        return new_name, f"{timestamp}_{new_name}"
+    
+    def register_existing(self, content_hash: str, size: int, filename: str) -> str | None:
+        """
+        Register a name against content the server already has (no transfer needed)
+
+        Args:
+            content_hash: MD5 of the file computed by the client
+            size: file size in bytes
+            filename: original filename
+
+        Returns:
+            Path of the uploaded file, or None if the content is unknown
+        """
+        new_name, new_file_id = self._new_file_id(filename)
+        retired = None
         
-        # Read content
-        content = await file.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT file_id, original_name, size FROM uploads WHERE content_hash = ?",
+                (content_hash.lower(),)
+            ).fetchone()
+            if row is None or row['size'] != size:
+                return None
+            existing_path = os.path.join(settings.UPLOAD_DIR, row['file_id'])
+            if not os.path.exists(existing_path):
+                return None
+            
+            if row['original_name'] == new_name:
+                # Same name - just move it to the top of the history
+                conn.execute(
+                    "UPDATE uploads SET mtime = ? WHERE file_id = ?", (time.time(), row['file_id'])
+                )
+                file_path = existing_path
+            else:
+                # Different name - link the content under the new name and point the catalog at it.
+                # Artifacts are keyed by content and carry over; the old name is removed once
+                # builds and renders still reading it have finished
+                file_path = os.path.join(settings.UPLOAD_DIR, new_file_id)
+                os.link(existing_path, file_path)
+                conn.execute(
+                    "UPDATE uploads SET file_id = ?, original_name = ?, mtime = ? WHERE file_id = ?",
+                    (new_file_id, new_name, time.time(), row['file_id'])
+                )
+                retired = existing_path
+        
+        if retired:
+            eviction_manager.retire(retired)
+        # 之前失败或被清理的产物在后台补上
+        self.schedule_preprocess(file_path, retry_failed=True)
+        return file_path
+    
+    async def save_upload(self, file: UploadFile) -> str:
+        """Save uploaded file and return file path (with MD5 deduplication)"""
+        self._new_file_id(file.filename)
+        # 客户端声明的大小已超限时无需读取
+        if file.size is not None and file.size > settings.MAX_UPLOAD_SIZE:
             raise ValueError("File size exceeds maximum allowed size")
         
-        # Calculate MD5
-        file_md5 = self._calculate_md5(content)
+        async def chunks():
+            while chunk := await file.read(self.UPLOAD_CHUNK_SIZE):
+                yield chunk
         
-        # Generate new filename
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        safe_name = "".join(c for c in file.filename.rsplit('.', 1)[0] if c.isalnum() or c in '._- ')[:50]
-        new_file_id = f"{timestamp}_{safe_name}.{ext}"
+        # Stream to a temp file chunk by chunk, hashing as we go
+        tmp_path = os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+        file_md5, size = await self._stream_to_file(chunks(), tmp_path)
+        return await self.ingest_file(tmp_path, file.filename, file_md5, size)
+    
+    async def save_upload_stream(self, content_type: str, stream: AsyncIterator[bytes]) -> tuple:
+        """
+        Save the file field of a multipart request body as it arrives
+
+        The body is parsed incrementally and the file data goes straight to the
+        temp file, without Starlette spooling the whole form to disk first.
+
+        Returns:
+            (file path, original filename)
+        """
+        upload = {}
+        tmp_path = os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+        file_md5, size = await self._stream_to_file(
+            self._multipart_file(content_type, stream, upload), tmp_path
+        )
+        file_path = await self.ingest_file(tmp_path, upload['filename'], file_md5, size)
+        return file_path, upload['filename']
+    
+    async def save_upload_batch_stream(
+        self,
+        content_type: str,
+        stream: AsyncIterator[bytes],
+        max_files: int
+    ) -> list:
+        """
+        Save every file in the "files" fields of a multipart request body as it arrives
+
+        Each file is streamed to its own temp file with the same size limit as a
+        single upload. A file that fails (type not allowed, too large, more than
+        max_files) is skipped without affecting the others.
+
+        Returns:
+            [{'filename', 'path'} or {'filename', 'error'}] in request order
+        """
+        results = []
+        events = self._multipart_parts(content_type, stream, b'files')
+        async for _, filename in events:
+            body = self._part_body(events)
+            try:
+                if len(results) >= max_files:
+                    raise ValueError(f"At most {max_files} files per batch")
+                self._new_file_id(filename)
+                tmp_path = os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+                file_md5, size = await self._stream_to_file(body, tmp_path)
+                results.append({'filename': filename, 'path': await self.ingest_file(tmp_path, filename, file_md5, size)})
+            except Exception as e:
+                results.append({'filename': filename, 'error': str(e)})
+            # 跳过失败文件尚未接收的数据
+            async for _ in body:
+                pass
+        
+        if not results:
+            raise ValueError("No files in upload")
+        return results
+    
+    async def _multipart_file(self, content_type: str, stream: AsyncIterator[bytes], upload: dict) -> AsyncIterator[bytes]:
+        """
+        逐块解析 multipart 请求体，产出第一个 file 字段的数据
+
+        file 字段的头部解析完成后立即校验扩展名（写入 upload['filename']），
+        不允许的类型在接收文件内容之前就被拒绝。
+        """
+        events = self._multipart_parts(content_type, stream, b'file')
+        try:
+            async for _, filename in events:
+                upload['filename'] = filename
+                self._new_file_id(filename)
+                async for chunk in self._part_body(events):
+                    yield chunk
+                # 只接收第一个 file 字段
+                return
+        finally:
+            await events.aclose()
+        raise ValueError("No file field in upload")
+    
+    async def _part_body(self, events: AsyncIterator[tuple]) -> AsyncIterator[bytes]:
+        """当前文件字段的数据，直到该字段结束；请求体提前结束时报错"""
+        async for event, value in events:
+            if event == 'end':
+                return
+            yield value
+        raise ValueError("Upload incomplete")
+    
+    async def _multipart_parts(self, content_type: str, stream: AsyncIterator[bytes], field: bytes) -> AsyncIterator[tuple]:
+        """
+        逐块解析 multipart 请求体中名为 field 的文件字段
+
+        Yields:
+            ('begin', 文件名)、('data', 数据块)、('end', None)，按请求体中的顺序；
+            其他字段忽略
+        """
+        mime_type, options = parse_options_header(content_type or '')
+        if mime_type != b'multipart/form-data' or b'boundary' not in options:
+            raise ValueError("Expected a multipart/form-data body with a file field")
+        
+        part = {'field': b'', 'value': b'', 'headers': {}, 'is_file': False}
+        received = []  # 本次 write 解析出的事件
+        
+        def on_part_begin():
+            part.update(headers={}, is_file=False)
+        
+        def on_header_field(data, start, end):
+            part['field'] += data[start:end]
+        
+        def on_header_value(data, start, end):
+            part['value'] += data[start:end]
+        
+        def on_header_end():
+            part['headers'][part['field'].lower()] = part['value']
+            part.update(field=b'', value=b'')
+        
+        def on_headers_finished():
+            _, disposition = parse_options_header(part['headers'].get(b'content-disposition', b''))
+            if disposition.get(b'name') == field:
+                part['is_file'] = True
+                received.append(('begin', disposition.get(b'filename', b'').decode('utf-8', 'replace')))
+        
+        def on_part_data(data, start, end):
+            if part['is_file']:
+                received.append(('data', data[start:end]))
+        
+        def on_part_end():
+            if part['is_file']:
+                received.append(('end', None))
+                part['is_file'] = False
+        
+        parser = MultipartParser(options[b'boundary'], {
+            'on_part_begin': on_part_begin,
+            'on_header_field': on_header_field,
+            'on_header_value': on_header_value,
+            'on_header_end': on_header_end,
+            'on_headers_finished': on_headers_finished,
+            'on_part_data': on_part_data,
+            'on_part_end': on_part_end
+        })
+        async for body in stream:
+            parser.write(body)
+            events = received[:]
+            received.clear()
+            for event in events:
+                yield event
+        parser.finalize()
+    
+    async def ingest_file(self, tmp_path: str, filename: str, file_md5: str, size: int) -> str:
+        """
+        Move a fully received temp file into the upload directory and catalog it
+
+        Args:
+            tmp_path: received file (moved or removed)
+            filename: original filename
+            file_md5: verified content MD5
+            size: file size in bytes
+
+        Returns:
+            Path of the uploaded file (an existing one if the content is a duplicate)
+        """
+        new_name, new_file_id = self._new_file_id(filename)
         new_file_path = os.path.join(settings.UPLOAD_DIR, new_file_id)
+        retired = None
         
-        # Check if file with same MD5 already exists
-        if file_md5 in self.md5_index:
-            existing_file_id = self.md5_index[file_md5]
-            existing_path = os.path.join(settings.UPLOAD_DIR, existing_file_id)
-            
-            # Check if filename is the same (ignore timestamp prefix)
-            existing_name = self._extract_original_name(existing_file_id)
-            new_name = self._extract_original_name(new_file_id)
-            
-            if existing_name == new_name and os.path.exists(existing_path):
-                # Same file, same name - just update modification time
-                os.utime(existing_path, None)
-                return existing_path
+        # Check if file with same MD5 already exists (under the store write lock,
+        # so concurrent uploads from several workers cannot both win)
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT file_id, original_name FROM uploads WHERE content_hash = ?", (file_md5,)
+            ).fetchone()
+            if row is None:
+                # Move new file into place and add it to the catalog
+                os.replace(tmp_path, new_file_path)
+                conn.execute(
+                    """INSERT OR REPLACE INTO uploads
+                       (file_id, original_name, size, content_hash, mtime)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (new_file_id, new_name, size, file_md5, time.time())
+                )
             else:
-                # Same file, different name - delete old, save new
-                if os.path.exists(existing_path):
-                    try:
-                        os.remove(existing_path)
-                    except:
-                        pass
-        
-        # Save new file
-        async with aiofiles.open(new_file_path, 'wb') as f:
-            await f.write(content)
+                existing_path = os.path.join(settings.UPLOAD_DIR, row['file_id'])
+                
+                if row['original_name'] == new_name and os.path.exists(existing_path):
+                    # Same file, same name - just move it to the top of the history
+                    os.remove(tmp_path)
+                    conn.execute(
+                        "UPDATE uploads SET mtime = ? WHERE file_id = ?", (time.time(), row['file_id'])
+                    )
+                    new_file_path = existing_path
+                else:
+                    # Same file, different name - point the catalog row at the new file. The old
+                    # file is removed once builds and renders still reading it have finished
+                    os.replace(tmp_path, new_file_path)
+                    conn.execute(
+                        """UPDATE OR REPLACE uploads SET file_id = ?, original_name = ?, size = ?, mtime = ?
+                           WHERE file_id = ?""",
+                        (new_file_id, new_name, size, time.time(), row['file_id'])
+                    )
+                    if existing_path != new_file_path:
+                        retired = existing_path
         
-        # Update MD5 index
-        self.md5_index[file_md5] = new_file_id
-        self._save_md5_index()
+        if retired:
+            eviction_manager.retire(retired)
         
-        # 预处理：转换为 MP3 + 生成波形数据
-        await self._preprocess_audio(new_file_path)
+        # 预处理（元数据、波形、MP3、节拍网格和特征）在后台执行，上传立即返回
+        self.schedule_preprocess(new_file_path, retry_failed=True)
         
         # Cleanup old files
         await self.cleanup_old_files()
         
         return new_file_path
     
+    async def _stream_to_file(self, chunks: AsyncIterator[bytes], dest_path: str) -> tuple:
+        """
+        分块写入上传内容并增量计算 MD5，超过大小限制立即中止
+
+        Returns:
+            (内容 MD5, 字节数)
+        """
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            async with aiofiles.open(dest_path, 'wb') as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > settings.MAX_UPLOAD_SIZE:
+                        raise ValueError("File size exceeds maximum allowed size")
+                    md5.update(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            raise
+        return md5.hexdigest(), size
+    
     async def _preprocess_audio(self, file_path: str):
         """预处理音频：转换为 MP3 缓存 + 生成波形数据"""
         try:
-            file_id = os.path.basename(file_path)
-            ext = file_id.split('.')[-1].lower()
-            
-            # 生成缓存 key
-            file_stat = os.stat(file_path)
-            cache_key = hashlib.md5(f"{file_path}_{file_stat.st_mtime}".encode()).hexdigest()
-            
             # 1. 非 MP3 格式转换为 MP3
-            if ext not in ['mp3']:
-                mp3_cache_path = os.path.join(self.cache_dir, f"{cache_key}.mp3")
-                if not os.path.exists(mp3_cache_path):
-                    audio = AudioSegment.from_file(file_path)
-                    audio.export(mp3_cache_path, format="mp3", bitrate="192k")
+            await self.get_browser_mp3(file_path)
             
             # 2. 生成波形数据
-            waveform_path = os.path.join(self.cache_dir, f"{cache_key}.waveform.json")
+            waveform_path = await self.artifact_path(file_path, 'peaks')
             if not os.path.exists(waveform_path):
-                await self._generate_waveform(file_path, waveform_path)
+                await worker_pool.run('analysis', self._generate_waveform, file_path, waveform_path)
+            
                 
         except Exception as e:
             print(f"Preprocess audio failed: {e}")
     
-    async def _generate_waveform(self, file_path: str, output_path: str):
-        """生成波形数据 JSON"""
+    def _catalog_hash(self, file_id: str) -> str | None:
+        row = store.query_one("SELECT content_hash FROM uploads WHERE file_id = ?", (file_id,))
+        return row['content_hash'] if row else None
+    
+    @contextmanager
+    def _pinned_upload(self, content_hash: str) -> Iterator[str]:
+        """
+        按内容哈希从目录表取得上传文件的当前路径，并在 with 块内固定它
+
+        同一内容换名上传后目录表指向新文件名，旧文件在固定释放后才删除，
+        进行中的解码不会读到已删除的路径。
+        """
+        with eviction_manager.pinned() as pins:
+            file_id = None
+            while True:
+                row = store.query_one("SELECT file_id FROM uploads WHERE content_hash = ?", (content_hash,))
+                if row is None or row['file_id'] == file_id:
+                    raise FileNotFoundError(f"Upload with content {content_hash} not found")
+                file_id = row['file_id']
+                file_path = os.path.join(settings.UPLOAD_DIR, file_id)
+                pins.add(file_path)
+                # 固定之前可能恰好被换名删除，重新读取目录表
+                if os.path.exists(file_path):
+                    break
+            yield file_path
+    
+    def _artifact_file(self, content_hash: str, artifact: str) -> str:
+        """文件型产物的缓存路径：内容哈希 + 产物名 + 算法版本"""
+        return os.path.join(
+            self.cache_dir,
+            f"{content_hash}.{artifact}.v{ARTIFACT_VERSIONS[artifact]}.{ARTIFACT_FILES[artifact]}"
+        )
+    
+    async def artifact_path(self, file_path: str, artifact: str) -> str:
+        """文件型产物的缓存路径（按内容寻址，重命名和重复上传共用）"""
+        return self._artifact_file(await self.get_content_hash(file_path), artifact)
+    
+    def _artifact_ready(self, content_hash: str, artifact: str, row) -> bool:
+        """产物记录是否可以直接复用（版本一致且缓存文件仍在）"""
+        if row is None or row['version'] != ARTIFACT_VERSIONS[artifact] or row['status'] != ARTIFACT_READY:
+            return False
+        if artifact in ARTIFACT_FILES and not (row['data'] and json.loads(row['data']).get('source')):
+            # 文件可能已被清理服务淘汰
+            return os.path.exists(self._artifact_file(content_hash, artifact))
+        return True
+    
+    def schedule_preprocess(self, file_path: str, retry_failed: bool = False):
+        """
+        在后台生成上传文件的产物（已就绪或正在生成的跳过）
+
+        Args:
+            file_path: 上传文件路径
+            retry_failed: 是否重新生成失败的产物
+
+        产物按内容哈希记录在 artifacts 表中：同一内容换个名字重新上传，
+        或被其他 worker 生成过，都直接复用。任何 worker 都可以通过
+        get_artifact_status 查询进度。本进程正在生成的产物跳过，
+        其余产物（例如已失败的）仍可以重新安排。
+        """
+        content_hash = self._catalog_hash(os.path.basename(file_path))
+        if content_hash is None:
+            return
+        
+        now = time.time()
+        with store.transaction() as conn:
+            rows = {
+                row['artifact']: row
+                for row in conn.execute(
+                    "SELECT artifact, version, status, data, owner_pid FROM artifacts WHERE content_hash = ?",
+                    (content_hash,)
+                )
+            }
+            todo = []
+            for artifact in ARTIFACTS:
+                if (content_hash, artifact) in self._building:
+                    continue
+                row = rows.get(artifact)
+                if self._artifact_ready(content_hash, artifact, row):
+                    if artifact == 'metadata':
+                        # 复用已有元数据时补上目录中的时长
+                        conn.execute(
+                            "UPDATE uploads SET duration = ? WHERE content_hash = ? AND duration IS NULL",
+                            (json.loads(row['data'])['duration'], content_hash)
+                        )
+                    continue
+                current = row is not None and row['version'] == ARTIFACT_VERSIONS[artifact]
+                if current and row['status'] == ARTIFACT_FAILED and not retry_failed:
+                    continue
+                # 其他存活的 worker 正在生成
+                if current and row['status'] in (ARTIFACT_PENDING, ARTIFACT_RUNNING) \
+                        and row['owner_pid'] != os.getpid() and pid_alive(row['owner_pid']):
+                    continue
+                todo.append(artifact)
+                conn.execute(
+                    """INSERT OR REPLACE INTO artifacts
+                       (content_hash, artifact, version, status, data, error, owner_pid, updated_at)
+                       VALUES (?, ?, ?, ?, NULL, NULL, ?, ?)""",
+                    (content_hash, artifact, ARTIFACT_VERSIONS[artifact], ARTIFACT_PENDING, os.getpid(), now)
+                )
+            conn.execute(
+                "UPDATE uploads SET analysis_status = ? WHERE content_hash = ?",
+                (self._analysis_status(conn, content_hash), content_hash)
+            )
+        
+        estimate = None
+        for artifact in todo:
+            if artifact == 'estimate':
+                # 一级估计很快，不排队；get_features 可以直接等待这个任务而不是重新计算
+                task = estimate = asyncio.create_task(self._build_artifact(content_hash, artifact))
+            else:
+                task = asyncio.create_task(self._build_artifact_queued(content_hash, artifact, estimate))
+            key = (content_hash, artifact)
+            self._building[key] = task
+            task.add_done_callback(lambda _, key=key: self._building.pop(key, None))
+    
+    def seed_artifact(self, content_hash: str, artifact: str, data: dict):
+        """记录入库前已经算好的产物（例如分片上传期间的一级估计），已就绪的不覆盖"""
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT version, status, data FROM artifacts WHERE content_hash = ? AND artifact = ?",
+                (content_hash, artifact)
+            ).fetchone()
+            if self._artifact_ready(content_hash, artifact, row):
+                return
+            conn.execute(
+                """INSERT OR REPLACE INTO artifacts
+                   (content_hash, artifact, version, status, data, error, owner_pid, updated_at)
+                   VALUES (?, ?, ?, ?, ?, NULL, ?, ?)""",
+                (content_hash, artifact, ARTIFACT_VERSIONS[artifact], ARTIFACT_READY,
+                 json.dumps(data), os.getpid(), time.time())
+            )
+    
+    def _analysis_status(self, conn, content_hash: str) -> str:
+        """汇总各产物状态"""
+        statuses = {row['status'] for row in conn.execute(
+            "SELECT status FROM artifacts WHERE content_hash = ?", (content_hash,)
+        )}
+        if statuses <= {ARTIFACT_READY}:
+            return ARTIFACT_READY
+        if ARTIFACT_FAILED in statuses:
+            return ARTIFACT_FAILED
+        return ARTIFACT_PENDING
+    
+    async def _build_artifact_queued(self, content_hash: str, artifact: str, estimate: asyncio.Task | None = None):
+        """
+        后台任务按最低优先级排队，不抢占也不挤占交互和分析请求的队列
+
+        每个产物单独占用一个后台槽位，按文件轮转排队：批量上传时各文件的元数据、
+        波形先后就绪，全部完成的时间接近进程池能并行处理的上限。
+        同一文件的一级估计（estimate）完成后才开始排队。
+        """
+        if estimate is not None:
+            await asyncio.wait({estimate})
+        async with scheduler.slot('background', f"preprocess:{content_hash}"):
+            await self._build_artifact(content_hash, artifact)
+    
+    async def _build_artifact(self, content_hash: str, artifact: str):
+        """
+        生成单个产物并记录状态
+
+        开始生成时才按内容哈希取得文件路径：排队期间文件可能已换名。
+        """
+        self._set_artifact(content_hash, artifact, ARTIFACT_RUNNING)
+        try:
+            with self._pinned_upload(content_hash) as file_path:
+                data = None
+                if artifact == 'metadata':
+                    data = await worker_pool.run('decode', self._read_audio_info, file_path)
+                    store.execute(
+                        "UPDATE uploads SET duration = ? WHERE content_hash = ?", (data['duration'], content_hash)
+                    )
+                elif artifact == 'peaks':
+                    waveform_path = self._artifact_file(content_hash, 'peaks')
+                    if not os.path.exists(waveform_path):
+                        await worker_pool.run('analysis', self._generate_waveform, file_path, waveform_path)
+                    if not os.path.exists(waveform_path):
+                        raise RuntimeError("Failed to generate waveform")
+                elif artifact == 'mp3':
+                    if file_path.lower().endswith('.mp3'):
+                        # MP3 源文件浏览器可直接播放，无需转换
+                        data = {'source': True}
+                    else:
+                        mp3_path = self._artifact_file(content_hash, 'mp3')
+                        if not os.path.exists(mp3_path):
+                            await worker_pool.run('encode', self._transcode_to_mp3, file_path, mp3_path)
+                elif artifact == 'estimate':
+                    data = await worker_pool.run('analysis', estimate_features, file_path)
+                elif artifact == 'features':
+                    data = await worker_pool.run(
+                        'analysis', self._extract_features, file_path, self._artifact_file(content_hash, 'features')
+                    )
+            self._set_artifact(content_hash, artifact, ARTIFACT_READY, data=data)
+        except Exception as e:
+            print(f"Build {artifact} for {content_hash} failed: {e}")
+            self._set_artifact(content_hash, artifact, ARTIFACT_FAILED, error=str(e))
+        
+        with store.transaction() as conn:
+            conn.execute(
+                "UPDATE uploads SET analysis_status = ? WHERE content_hash = ?",
+                (self._analysis_status(conn, content_hash), content_hash)
+            )
+    
+    def _set_artifact(self, content_hash: str, artifact: str, status: str, data=None, error: str = None):
+        store.execute(
+            """UPDATE artifacts SET status = ?, data = ?, error = ?, updated_at = ?
+               WHERE content_hash = ? AND artifact = ?""",
+            (status, json.dumps(data) if data is not None else None, error, time.time(), content_hash, artifact)
+        )
+    
+    def get_artifact_status(self, file_id: str) -> dict:
+        """上传文件各产物的状态（metadata、estimate 和 features 附带数据）"""
+        row = store.query_one(
+            "SELECT content_hash, analysis_status FROM uploads WHERE file_id = ?", (file_id,)
+        )
+        artifacts = {}
+        if row:
+            for artifact_row in store.query(
+                "SELECT artifact, version, status, data, error FROM artifacts WHERE content_hash = ?",
+                (row['content_hash'],)
+            ):
+                artifact = artifact_row['artifact']
+                if artifact not in ARTIFACT_VERSIONS or artifact_row['version'] != ARTIFACT_VERSIONS[artifact]:
+                    # 旧版本算法的产物视为不存在
+                    continue
+                status = artifact_row['status']
+                if status == ARTIFACT_READY and not self._artifact_ready(row['content_hash'], artifact, artifact_row):
+                    status = ARTIFACT_PENDING
+                artifacts[artifact] = {
+                    'status': status,
+                    'data': json.loads(artifact_row['data']) if artifact_row['data'] else None,
+                    'error': artifact_row['error']
+                }
+        return {
+            'analysis_status': row['analysis_status'] if row else None,
+            'artifacts': {
+                artifact: artifacts.get(artifact, {'status': ARTIFACT_PENDING, 'data': None, 'error': None})
+                for artifact in ARTIFACTS
+            }
+        }
+    
+    async def watch_artifacts(self, file_ids: list) -> AsyncIterator[tuple]:
+        """
+        订阅多个上传文件的产物状态，直到全部就绪或失败
+
+        Yields:
+            (file_id, 状态) — 每个文件的首个状态及之后的每次变化
+        """
+        last = {}
+        pending = list(file_ids)
+        while pending:
+            for file_id in list(pending):
+                status = self.get_artifact_status(file_id)
+                if status != last.get(file_id):
+                    last[file_id] = status
+                    yield file_id, status
+                if status['analysis_status'] in (ARTIFACT_READY, ARTIFACT_FAILED, None):
+                    pending.remove(file_id)
+            if pending:
+                # 产物可能由其他 worker 生成，定期重新读取
+                await asyncio.sleep(self.WATCH_POLL_SECONDS)
+    
+    async def get_beat_grid(self, file_path: str) -> dict:
+        """
+        整首曲目的节拍网格（features 产物，缺失时在进程池中生成）
+
+        Returns:
+            至少包含 {'tempo', 'beat_times', 'onset_env', 'sr', 'hop_length', 'duration'}
+        """
+        features_path = await self.artifact_path(file_path, 'features')
+        if not os.path.exists(features_path):
+            await worker_pool.run('analysis', self._extract_features, file_path, features_path)
+        return self._load_npz(features_path)
+    
+    async def cached_beat_grid(self, file_path: str) -> dict | None:
+        """已生成的节拍网格，尚未生成时返回 None（不触发整首分析）"""
+        return await self.cached_feature_frames(file_path)
+    
+    def _write_npz(self, output_path: str, **arrays):
+        # 先写临时文件再原子重命名，多个 worker 同时生成时不会读到半成品
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, output_path)
+    
+    def _load_npz(self, path: str) -> dict:
+        eviction_manager.touch(path)
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        for key, value in arrays.items():
+            if value.ndim == 0:
+                arrays[key] = value.item()
+        return arrays
+    
+    def _extract_features(self, file_path: str, output_path: str) -> dict:
+        """
+        提取整首曲目的逐帧特征并保存为 npz（在进程池中执行）
+
+        特征由 analyze_signal 单次 STFT 计算：onset 包络、节拍时间、RMS、频谱质心、
+        零交叉率、色度和响度。任意片段交界窗口的特征都可以从中切片再求均值。
+        新增特征时在内核中添加数组并递增 ARTIFACT_VERSIONS['features']。
+
+        Returns:
+            整首曲目的特征摘要
+        """
+        y, sr = librosa.load(file_path, sr=BEAT_GRID_SR, mono=True)
+        frames = analyze_signal(y, sr, BEAT_GRID_HOP)
+        self._write_npz(output_path, **frames, sr=sr, hop_length=BEAT_GRID_HOP, duration=len(y) / sr)
+        return {
+            'tempo': frames['tempo'],
+            'beat_count': int(len(frames['beat_times'])),
+            'energy': float(np.mean(frames['rms'])),
+            'spectral_centroid': float(np.mean(frames['spectral_centroid'])),
+            'zero_crossing_rate': float(np.mean(frames['zero_crossing_rate'])),
+            'loudness': float(np.mean(frames['loudness'])),
+            'chroma': [round(float(v), 4) for v in np.mean(frames['chroma'], axis=1)],
+            'duration': len(y) / sr,
+            'analysis_tier': 2
+        }
+    
+    async def get_features(self, file_path: str) -> dict:
+        """
+        整首曲目的特征摘要，analysis_tier 表示来源
+
+        - 2：上传时生成的 features 产物（完整分析）
+        - 1：完整分析尚未完成（或其文件已被清理）时的一级估计（estimate 产物），
+          同时在后台安排完整分析
+
+        两者都没有时（旧文件或生成失败）安排后台预处理，等待其中的一级估计完成后返回，
+        完整分析在后台继续。不在上传目录表中的文件直接做完整分析。
+        """
+        content_hash = await self.get_content_hash(file_path)
+        rows = {
+            row['artifact']: row
+            for row in store.query(
+                """SELECT artifact, version, status, data FROM artifacts
+                   WHERE content_hash = ? AND artifact IN ('features', 'estimate')""",
+                (content_hash,)
+            )
+        }
+        for artifact, tier in (('features', 2), ('estimate', 1)):
+            row = rows.get(artifact)
+            if self._artifact_ready(content_hash, artifact, row) and row['data']:
+                if tier == 1:
+                    # features.npz 被清理后记录仍为就绪，这里重新安排（正在生成的会跳过）
+                    self.schedule_preprocess(file_path)
+                return {'analysis_tier': tier, **json.loads(row['data'])}
+        
+        if self._catalog_hash(os.path.basename(file_path)) is None:
+            return await worker_pool.run(
+                'analysis', self._extract_features, file_path, self._artifact_file(content_hash, 'features')
+            )
+        
+        self.schedule_preprocess(file_path)
+        return await self._wait_estimate(content_hash)
+    
+    async def _wait_estimate(self, content_hash: str) -> dict:
+        """等待一级估计生成完成（本进程的后台任务，或其他 worker 正在生成），不重复计算"""
+        while True:
+            task = self._building.get((content_hash, 'estimate'))
+            if task is not None:
+                # shield：调用方取消不影响后台预处理
+                await asyncio.shield(task)
+            row = store.query_one(
+                """SELECT version, status, data, error, owner_pid FROM artifacts
+                   WHERE content_hash = ? AND artifact = 'estimate'""",
+                (content_hash,)
+            )
+            if row is None or row['version'] != ARTIFACT_VERSIONS['estimate']:
+                raise ValueError("Feature estimate is not scheduled")
+            if row['status'] == ARTIFACT_READY:
+                return {'analysis_tier': 1, **json.loads(row['data'])}
+            if row['status'] == ARTIFACT_FAILED:
+                raise ValueError(f"Feature estimate failed: {row['error']}")
+            if (content_hash, 'estimate') not in self._building and (
+                    row['owner_pid'] == os.getpid() or not pid_alive(row['owner_pid'])):
+                raise ValueError("Feature estimate is not being generated")
+            # 其他 worker 正在生成
+            await asyncio.sleep(self.WATCH_POLL_SECONDS)
+    
+    async def cached_feature_frames(self, file_path: str) -> dict | None:
+        """
+        整首曲目的逐帧特征，完整分析尚未完成时返回 None（不触发分析）
+
+        Returns:
+            {'tempo', 'beat_times', 'onset_env', 'rms', 'spectral_centroid', 'zero_crossing_rate',
+             'chroma', 'loudness', 'sr', 'hop_length', 'duration'}
+        """
+        features_path = await self.artifact_path(file_path, 'features')
+        if not os.path.exists(features_path):
+            return None
+        return self._load_npz(features_path)
+    
+    def _transcode_to_mp3(self, file_path: str, output_path: str):
+        """转换为 MP3 缓存（在进程池中执行）"""
+        audio = AudioSegment.from_file(file_path)
+        # 先写临时文件再原子重命名，多个 worker 同时生成时不会读到半成品
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        audio.export(tmp_path, format="mp3", bitrate="192k")
+        os.replace(tmp_path, output_path)
+    
+    def _generate_waveform(self, file_path: str, output_path: str):
+        """生成波形数据 JSON（在进程池中执行）"""
         try:
             # 加载音频
             y, sr = librosa.load(file_path, sr=22050, mono=True)
@@ -171,71 +907,112 @@ class FileService:
                 "waveform": waveform
             }
             
-            with open(output_path, 'w') as f:
+            tmp_path = f"{output_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
                 json.dump(data, f)
+            os.replace(tmp_path, output_path)
                 
         except Exception as e:
             print(f"Generate waveform failed: {e}")
     
-    def get_waveform_path(self, file_path: str) -> str | None:
+    async def get_waveform_path(self, file_path: str) -> str | None:
         """获取波形数据文件路径"""
         try:
-            file_stat = os.stat(file_path)
-            cache_key = hashlib.md5(f"{file_path}_{file_stat.st_mtime}".encode()).hexdigest()
-            waveform_path = os.path.join(self.cache_dir, f"{cache_key}.waveform.json")
+            waveform_path = await self.artifact_path(file_path, 'peaks')
             if os.path.exists(waveform_path):
+                eviction_manager.touch(waveform_path)
                 return waveform_path
         except:
             pass
         return None
     
-    def get_mp3_cache_path(self, file_path: str) -> str | None:
-        """获取 MP3 缓存文件路径"""
-        try:
-            file_stat = os.stat(file_path)
-            cache_key = hashlib.md5(f"{file_path}_{file_stat.st_mtime}".encode()).hexdigest()
-            mp3_path = os.path.join(self.cache_dir, f"{cache_key}.mp3")
-            if os.path.exists(mp3_path):
-                return mp3_path
-        except:
-            pass
-        return None
+    async def cached_browser_mp3(self, file_path: str) -> str | None:
+        """已有的浏览器可播放 MP3（源文件本身或已缓存的转码结果），需要转码时返回 None"""
+        if file_path.lower().endswith('.mp3'):
+            return file_path
+        mp3_path = await self.artifact_path(file_path, 'mp3')
+        if not os.path.exists(mp3_path):
+            return None
+        eviction_manager.touch(mp3_path)
+        return mp3_path
+    
+    async def get_browser_mp3(self, file_path: str) -> str:
+        """浏览器可播放的 MP3（非 MP3 源文件按内容哈希缓存转码结果）"""
+        mp3_path = await self.cached_browser_mp3(file_path)
+        if mp3_path is None:
+            mp3_path = await self.artifact_path(file_path, 'mp3')
+            await worker_pool.run('encode', self._transcode_to_mp3, file_path, mp3_path)
+        return mp3_path
+    
+    async def get_preview_waveform(
+        self,
+        file_path: str,
+        task_class: str = 'interactive',
+        client_id: str = 'unknown'
+    ) -> dict | None:
+        """
+        生成并读取预览波形数据（前端 peaks 格式）
+
+        需要生成时才占用调度槽位；同一预览的并发请求共用一次生成。
+        """
+        waveform_path = await self.get_waveform_path(file_path)
+        if waveform_path is None:
+            task = self._preview_waveforms.get(file_path)
+            if task is None:
+                task = asyncio.create_task(self._generate_preview_waveform(file_path, task_class, client_id))
+                self._preview_waveforms[file_path] = task
+                task.add_done_callback(lambda _: self._preview_waveforms.pop(file_path, None))
+            await asyncio.shield(task)
+            waveform_path = await self.get_waveform_path(file_path)
+        if not waveform_path or not os.path.exists(waveform_path):
+            return None
+        
+        with open(waveform_path, 'r') as f:
+            raw_data = json.load(f)
+        # 转换为前端期望的格式
+        return {
+            "peaks": raw_data.get("waveform", []),
+            "duration": raw_data.get("duration", 0)
+        }
+    
+    async def _generate_preview_waveform(self, file_path: str, task_class: str, client_id: str):
+        async with scheduler.slot(task_class, client_id):
+            await self._preprocess_audio(file_path)
     
     async def cleanup_old_files(self):
         """Keep only the most recent MAX_HISTORY_FILES files"""
-        files = []
-        for f in os.listdir(settings.UPLOAD_DIR):
-            file_path = os.path.join(settings.UPLOAD_DIR, f)
-            if os.path.isfile(file_path):
-                files.append((file_path, os.path.getmtime(file_path)))
-        
-        # Sort by modification time, newest first
-        files.sort(key=lambda x: x[1], reverse=True)
+        # Hold the store write lock so several workers never clean up concurrently
+        with store.transaction() as conn:
+            expired = conn.execute(
+                "SELECT file_id FROM uploads ORDER BY mtime DESC LIMIT -1 OFFSET ?",
+                (self.MAX_HISTORY_FILES,)
+            ).fetchall()
+            
+            for row in expired:
+                conn.execute("DELETE FROM uploads WHERE file_id = ?", (row['file_id'],))
         
-        # Delete old files
-        for file_path, _ in files[self.MAX_HISTORY_FILES:]:
-            try:
-                os.remove(file_path)
-            except:
-                pass
+        # Delete old files (deferred while a build or render is still reading them)
+        for row in expired:
+            eviction_manager.retire(os.path.join(settings.UPLOAD_DIR, row['file_id']))
     
     async def get_history_files(self) -> list:
-        """Get list of uploaded files"""
-        files = []
-        for f in os.listdir(settings.UPLOAD_DIR):
-            file_path = os.path.join(settings.UPLOAD_DIR, f)
-            if os.path.isfile(file_path):
-                stat = os.stat(file_path)
-                files.append({
-                    "file_id": f,
-                    "filename": self._extract_original_name(f),
-                    "size": stat.st_size,
-                    "created_at": stat.st_mtime
-                })
-        
-        # Sort by creation time, newest first
-        files.sort(key=lambda x: x["created_at"], reverse=True)
-        return files[:self.MAX_HISTORY_FILES]
+        """Get list of uploaded files, newest first"""
+        rows = store.query(
+            """SELECT file_id, original_name, size, mtime, duration, analysis_status
+               FROM uploads ORDER BY mtime DESC LIMIT ?""",
+            (self.MAX_HISTORY_FILES,)
+        )
+        return [
+            {
+                "file_id": row['file_id'],
+                "filename": row['original_name'],
+                "size": row['size'],
+                "created_at": row['mtime'],
+                "duration": row['duration'],
+                "analysis_status": row['analysis_status']
+            }
+            for row in rows
+        ]
     
     def _extract_original_name(self, file_id: str) -> str:
         """Extract original filename from file_id"""
@@ -245,8 +1022,32 @@ class FileService:
             return parts[1]
         return file_id
     
+    def cached_audio_info(self, file_path: str) -> dict | None:
+        """Audio information from the background metadata artifact, or None if not ready"""
+        row = store.query_one(
+            """SELECT a.data FROM uploads u JOIN artifacts a ON a.content_hash = u.content_hash
+               WHERE u.file_id = ? AND a.artifact = 'metadata' AND a.status = ? AND a.version = ?""",
+            (os.path.basename(file_path), ARTIFACT_READY, ARTIFACT_VERSIONS['metadata'])
+        )
+        if row and row['data']:
+            return json.loads(row['data'])
+        return None
+    
     async def get_audio_info(self, file_path: str) -> dict:
-        """Get audio file information"""
+        """Get audio file information (reuses the background metadata artifact when ready)"""
+        info = self.cached_audio_info(file_path)
+        if info is not None:
+            return info
+        
+        info = await worker_pool.run('decode', self._read_audio_info, file_path)
+        store.execute(
+            "UPDATE uploads SET duration = ? WHERE file_id = ?",
+            (info['duration'], os.path.basename(file_path))
+        )
+        return info
+    
+    def _read_audio_info(self, file_path: str) -> dict:
+        """Decode audio and read its information (runs in the worker pool)"""
         try:
             y, sr = librosa.load(file_path, sr=None)
             duration = librosa.get_duration(y=y, sr=sr)
@@ -264,6 +1065,10 @@ class FileService:
         """Delete uploaded file"""
         file_path = os.path.join(settings.UPLOAD_DIR, file_id)
         if os.path.exists(file_path):
-            os.remove(file_path)
+            store.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,))
+            eviction_manager.retire(file_path)
         else:
             raise FileNotFoundError(f"File {file_id} not found")
+
+
+file_service = FileService()
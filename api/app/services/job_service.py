@@ -0,0 +1,217 @@
+"""
+渲染任务服务 - 异步渲染任务、进度事件和持久化
+BigEyeMix 后端并发
+
+长时间线（尤其包含魔法填充）同步渲染会超过 nginx 的 proxy_read_timeout。
+这里把渲染变成任务：提交后立即返回 job_id，前端通过 SSE 或轮询跟踪
+阶段和进度，完成后获取结果。任务状态保存在共享状态库中，
+页面刷新、API 重启或请求落到其他 worker 都不会丢失已完成的结果。
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+
+from app.core.store import store, pid_alive
+from app.services.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+TERMINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+# 任务类型对应的调度类别
+JOB_TASK_CLASSES = {'multi': 'export', 'preview': 'interactive'}
+
+# 各阶段在总进度中的区间 (起点, 终点)
+STAGE_RANGES = {
+    'multi': {'prepare': (0, 60), 'render': (60, 100)},
+    'preview': {'prepare': (0, 55), 'render': (55, 90), 'waveform': (90, 100)},
+}
+
+
+class JobService:
+    """渲染任务管理"""
+    MAX_JOBS = 200  # 保留的历史任务数
+    WATCH_POLL_SECONDS = 1.0  # 任务可能在其他 worker 中执行，订阅时定期重新读取
+
+    def __init__(self):
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def start(self):
+        """恢复中断的任务（应用启动时调用，不在导入模块时访问状态库）"""
+        self._recover_jobs()
+
+    def _recover_jobs(self):
+        """执行进程已退出但未结束的任务标记为失败"""
+        rows = store.query(
+            "SELECT job_id, owner_pid FROM jobs WHERE status NOT IN (?, ?)",
+            TERMINAL_STATUSES
+        )
+        for row in rows:
+            if not pid_alive(row['owner_pid']):
+                self._update(row['job_id'], status=JOB_FAILED, error='Interrupted by server restart')
+
+    def _insert(self, job: dict):
+        store.execute(
+            """INSERT INTO jobs
+               (job_id, kind, status, stage, progress, request, result, error,
+                client_id, owner_pid, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                job['job_id'], job['kind'], job['status'], job['stage'], job['progress'],
+                json.dumps(job.get('request'), ensure_ascii=False),
+                json.dumps(job.get('result'), ensure_ascii=False),
+                job.get('error'), job.get('client_id'), job.get('owner_pid'),
+                job['created_at'], job['updated_at']
+            )
+        )
+
+    def _update(self, job_id: str, **changes):
+        """更新任务状态、持久化并唤醒本进程内的订阅者"""
+        changes['updated_at'] = time.time()
+        if 'result' in changes:
+            changes['result'] = json.dumps(changes['result'], ensure_ascii=False)
+        columns = ', '.join(f"{column} = ?" for column in changes)
+        store.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*changes.values(), job_id))
+
+        event = self._changed.pop(job_id, None)
+        if event:
+            event.set()
+
+    def _prune_jobs(self):
+        """只保留最近 MAX_JOBS 个已结束的任务"""
+        store.execute(
+            """DELETE FROM jobs WHERE job_id IN (
+                   SELECT job_id FROM jobs WHERE status IN (?, ?)
+                   ORDER BY created_at DESC LIMIT -1 OFFSET ?
+               )""",
+            (*TERMINAL_STATUSES, self.MAX_JOBS)
+        )
+
+    def submit(self, kind: str, request, client_id: str = 'unknown') -> dict:
+        """
+        提交渲染任务
+
+        Args:
+            kind: 任务类型 (multi, preview)
+            request: MultiMixRequest
+            client_id: 客户端标识，用于公平排队
+
+        Returns:
+            任务信息
+        """
+        if kind not in STAGE_RANGES:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        # 队列已满时直接拒绝（429），不创建任务
+        scheduler.ensure_admissible(JOB_TASK_CLASSES[kind], client_id)
+
+        now = time.time()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': JOB_QUEUED,
+            'stage': 'queued',
+            'progress': 0,
+            'request': request.model_dump(),
+            'result': None,
+            'error': None,
+            'client_id': client_id,
+            'owner_pid': os.getpid(),
+            'created_at': now,
+            'updated_at': now
+        }
+        self._insert(job)
+        self._prune_jobs()
+
+        task = asyncio.create_task(self._run(job['job_id'], kind, request, client_id))
+        self._tasks[job['job_id']] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job['job_id'], None))
+        return dict(job)
+
+    async def _run(self, job_id: str, kind: str, request, client_id: str):
+        """执行渲染任务"""
+        from app.services.file_service import file_service
+        from app.services.render_cache import render_cache
+
+        ranges = STAGE_RANGES[kind]
+
+        def report(stage: str, percent: float):
+            start, end = ranges[stage]
+            self._update(
+                job_id,
+                status=JOB_RUNNING,
+                stage=stage,
+                progress=round(start + (end - start) * percent / 100, 1)
+            )
+
+        try:
+            # 实际渲染时才占用调度槽位，缓存命中和合并到进行中渲染的任务不占用
+            output_path, cached = await render_cache.render(
+                request, progress=report, task_class=JOB_TASK_CLASSES[kind], client_id=client_id
+            )
+            output_id = os.path.basename(output_path)
+
+            if kind == 'preview':
+                report('waveform', 0)
+                waveform_data = None
+                try:
+                    waveform_data = await file_service.get_preview_waveform(
+                        output_path, task_class=JOB_TASK_CLASSES[kind], client_id=client_id
+                    )
+                except Exception as e:
+                    logger.error(f"预览波形生成失败: {e}")
+                result = {'preview_id': output_id, 'waveform': waveform_data, 'cached': cached}
+            else:
+                result = {'output_id': output_id, 'cached': cached}
+
+            self._update(job_id, status=JOB_COMPLETED, stage='done', progress=100, result=result)
+            logger.info(f"渲染任务完成: {job_id}")
+
+        except Exception as e:
+            logger.error(f"渲染任务失败: {job_id}, {e}")
+            self._update(job_id, status=JOB_FAILED, error=str(e))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """获取任务状态"""
+        row = store.query_one("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        if row is None:
+            return None
+        job = dict(row)
+        job['request'] = json.loads(job['request']) if job['request'] else None
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    async def watch(self, job_id: str) -> AsyncIterator[dict]:
+        """订阅任务状态变化，直到任务结束"""
+        job = self.get(job_id)
+        if job is None:
+            return
+
+        yield job
+        while job['status'] not in TERMINAL_STATUSES:
+            event = self._changed.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout=self.WATCH_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+            latest = self.get(job_id)
+            if latest is None:
+                return
+            if latest['updated_at'] != job['updated_at']:
+                job = latest
+                yield job
+
+
+# 单例
+job_service = JobService()
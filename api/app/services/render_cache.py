@@ -0,0 +1,238 @@
+"""
+渲染缓存服务 - 内容寻址的混音结果缓存与相同请求合并
+BigEyeMix 后端并发
+
+每个 MultiMixRequest 规范化后与源文件内容哈希一起计算缓存 key：
+- 已完成的结果直接从缓存返回，不再重新渲染
+- 正在渲染中的相同请求挂到同一个渲染任务上，不重复启动
+- 渲染记录保存在共享状态库中，其他 worker 收到相同请求时等待结果而不是重复渲染
+- 所有等待方都取消（例如客户端断开）后才取消渲染任务
+- 只有实际渲染时才占用调度槽位，缓存命中和挂到进行中渲染上的请求不占用
+
+注意：魔法填充由 AI 生成，内容不确定；缓存命中时会复用首次生成的过渡。
+过渡生成失败降级为静音的渲染结果不写入缓存，下一次相同请求重新渲染。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.store import store, pid_alive
+from app.services.eviction_service import eviction_manager
+from app.services.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCache:
+    """内容寻址渲染缓存"""
+    # 渲染流程版本：修改渲染逻辑时递增，使旧缓存失效
+    RENDER_VERSION = 2
+    REMOTE_POLL_SECONDS = 0.5  # 等待其他 worker 渲染时的轮询间隔
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'cancelled': 0, 'degraded': 0}
+
+    def output_id(self, key: str) -> str:
+        return f"mix_{key}.mp3"
+
+    def output_path(self, key: str) -> str:
+        return os.path.join(settings.OUTPUT_DIR, self.output_id(key))
+
+    async def compute_key(self, request) -> str:
+        """规范化渲染请求并与源文件内容哈希一起计算 key"""
+        from app.services.file_service import file_service
+
+        segments = []
+        for seg in request.segments:
+            if seg.file_id in ('__transition__', '__gap__'):
+                trans_type = seg.transition_type or seg.gap_type or 'silence'
+                segments.append(['transition', trans_type, int(seg.end * 1000)])
+            else:
+                file_path = os.path.join(settings.UPLOAD_DIR, seg.file_id)
+                if not os.path.exists(file_path):
+                    raise FileNotFoundError(f"Audio file not found: {seg.file_id}")
+                content_hash = await file_service.get_content_hash(file_path)
+                segments.append(['clip', content_hash, int(seg.start * 1000), int(seg.end * 1000)])
+
+        canonical = json.dumps({
+            'version': self.RENDER_VERSION,
+            'segments': segments,
+            'transition_duration': request.transition_duration or 0,
+            'transition_type': request.transition_type or 'cut'
+        }, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()[:40]
+
+    async def render(
+        self,
+        request,
+        progress: Optional[Callable[[str, float], None]] = None,
+        task_class: str = 'export',
+        client_id: str = 'unknown'
+    ) -> Tuple[str, bool]:
+        """
+        渲染时间线（命中缓存时直接返回）
+
+        Args:
+            request: MultiMixRequest
+            progress: 可选进度回调，仅在本请求实际触发渲染时调用
+            task_class: 实际渲染时占用的调度类别 (interactive, export)
+            client_id: 客户端标识，用于公平排队
+
+        Returns:
+            (输出文件路径, 是否命中缓存)；降级渲染的结果不在缓存路径下
+        """
+        key = await self.compute_key(request)
+        output_path = self.output_path(key)
+
+        if os.path.exists(output_path):
+            self._stats['hits'] += 1
+            self._touch(key)
+            # 调用方即将下载或播放，保留一段时间
+            eviction_manager.lease(output_path)
+            return output_path, True
+
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats['misses'] += 1
+            task = asyncio.create_task(
+                self._render_or_wait(key, request, progress, (task_class, client_id))
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._stats['coalesced'] += 1
+            logger.info(f"合并相同渲染请求: {key}")
+
+        # shield：单个调用方取消不影响其他挂在同一任务上的请求，
+        # 最后一个等待方取消时才取消渲染
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            output_path = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                task.cancel()
+                self._stats['cancelled'] += 1
+                logger.info(f"渲染已无等待方，取消: {key}")
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+        return output_path, False
+
+    def _claim(self, key: str) -> bool:
+        """登记由本进程渲染；其他存活进程正在渲染时返回 False"""
+        now = time.time()
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT status, owner_pid FROM render_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if (row and row['status'] == 'rendering'
+                    and row['owner_pid'] != os.getpid() and pid_alive(row['owner_pid'])):
+                return False
+            conn.execute(
+                """INSERT OR REPLACE INTO render_cache
+                   (cache_key, status, output_id, owner_pid, created_at, updated_at, last_access)
+                   VALUES (?, 'rendering', ?, ?, ?, ?, ?)""",
+                (key, self.output_id(key), os.getpid(), now, now, now)
+            )
+        return True
+
+    def _release(self, key: str):
+        """删除本进程的渲染记录"""
+        store.execute(
+            "DELETE FROM render_cache WHERE cache_key = ? AND owner_pid = ?", (key, os.getpid())
+        )
+
+    def _touch(self, key: str):
+        store.execute(
+            "UPDATE render_cache SET last_access = ? WHERE cache_key = ?", (time.time(), key)
+        )
+        eviction_manager.touch(self.output_path(key))
+
+    async def _render_or_wait(self, key: str, request, progress, slot: Tuple[str, str]) -> str:
+        """本进程渲染，或等待其他 worker 正在进行的相同渲染，返回输出文件路径"""
+        output_path = self.output_path(key)
+        while not self._claim(key):
+            logger.info(f"等待其他进程渲染: {key}")
+            while True:
+                await asyncio.sleep(self.REMOTE_POLL_SECONDS)
+                if os.path.exists(output_path):
+                    return output_path
+                row = store.query_one(
+                    "SELECT status, owner_pid FROM render_cache WHERE cache_key = ?", (key,)
+                )
+                # 渲染失败（记录已删除）或渲染进程已退出：重新尝试认领
+                if row is None or not pid_alive(row['owner_pid']):
+                    break
+
+        try:
+            output_path, degraded = await self._render(key, request, progress, slot)
+        except BaseException:
+            self._release(key)
+            raise
+        if degraded:
+            # 降级结果不缓存：删除记录，等待中的其他 worker 会重新认领并渲染
+            self._release(key)
+            return output_path
+
+        now = time.time()
+        store.execute(
+            "UPDATE render_cache SET status = 'ready', updated_at = ?, last_access = ? WHERE cache_key = ?",
+            (now, now, key)
+        )
+        return output_path
+
+    async def _render(self, key: str, request, progress, slot: Tuple[str, str]) -> Tuple[str, bool]:
+        """
+        实际渲染（占用 slot 指定的调度槽位），先写临时文件再原子重命名
+
+        Returns:
+            (输出文件路径, 是否降级)；有过渡降级为静音时结果写到不参与缓存的独立文件
+        """
+        from app.services.audio_service import audio_service
+
+        output_path = self.output_path(key)
+        tmp_path = os.path.join(settings.OUTPUT_DIR, 'temp', f"{uuid.uuid4()}.render.mp3")
+        fallbacks = []
+        try:
+            with eviction_manager.pinned(tmp_path):
+                async with scheduler.slot(*slot):
+                    await audio_service.mix_multi_segments(
+                        segments=request.segments,
+                        transition_duration=request.transition_duration or 0,
+                        transition_type=request.transition_type or 'cut',
+                        progress=progress,
+                        output_path=tmp_path,
+                        fallbacks=fallbacks
+                    )
+                if fallbacks:
+                    # 例如 PiAPI 暂时不可用：降级结果只返回给本次请求，不作为该请求的缓存结果
+                    self._stats['degraded'] += 1
+                    logger.warning(f"渲染有过渡降级，不写入缓存: {key} {fallbacks}")
+                    output_path = os.path.join(settings.OUTPUT_DIR, f"{uuid.uuid4()}.mp3")
+                os.replace(tmp_path, output_path)
+            eviction_manager.lease(output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return output_path, bool(fallbacks)
+
+    def stats(self) -> Dict:
+        """缓存命中统计"""
+        return {
+            **self._stats,
+            'inflight': len(self._inflight)
+        }
+
+
+# 单例
+render_cache = RenderCache()
@@ -0,0 +1,250 @@
+"""
+调度服务 - 重任务准入控制与优先级调度
+BigEyeMix 后端并发
+
+在音频服务前统一排队，避免一波预览请求把 CPU 和内存耗尽：
+- 每类任务独立的并发上限和队列长度
+- 优先级：交互预览 > 最终导出 > 分析请求 > 后台预处理
+- 后台预处理（上传后生成产物）是内部任务，不限排队长度，也不占用分析请求的队列
+- 同一类任务内按客户端轮转；每个客户端另有排队上限，单个客户端无法占满队列
+- 队列已满时返回 429 + Retry-After，而不是让所有人一起变慢
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 任务类别，按优先级从高到低排列
+TASK_CLASSES = ('interactive', 'export', 'analysis', 'background')
+
+
+class SchedulerBusyError(HTTPException):
+    """队列已满"""
+
+    def __init__(self, task_class: str, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail=f"Server busy: too many pending {task_class} tasks",
+            headers={"Retry-After": str(retry_after)}
+        )
+        self.task_class = task_class
+        self.retry_after = retry_after
+
+
+class Scheduler:
+    """优先级 + 按客户端公平排队的准入调度器"""
+    DEFAULT_TASK_SECONDS = 5.0  # 尚无统计数据时的任务耗时估计
+
+    def __init__(self):
+        self.limits = {
+            'interactive': settings.SCHEDULER_INTERACTIVE_CONCURRENCY,
+            'export': settings.SCHEDULER_EXPORT_CONCURRENCY,
+            'analysis': settings.SCHEDULER_ANALYSIS_CONCURRENCY,
+            'background': settings.SCHEDULER_BACKGROUND_CONCURRENCY,
+        }
+        # None 表示不限排队长度
+        self.max_queue = {
+            'interactive': settings.SCHEDULER_INTERACTIVE_QUEUE,
+            'export': settings.SCHEDULER_EXPORT_QUEUE,
+            'analysis': settings.SCHEDULER_ANALYSIS_QUEUE,
+            'background': None,
+        }
+        # 单个客户端在每类任务中的排队上限
+        client_queue = settings.SCHEDULER_CLIENT_QUEUE or None
+        self.max_client_queue = {
+            'interactive': client_queue,
+            'export': client_queue,
+            'analysis': client_queue,
+            'background': None,
+        }
+        self._active = {cls: 0 for cls in TASK_CLASSES}
+        # 每类任务：client_id -> 等待队列，按轮转顺序排列
+        self._waiting: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            cls: OrderedDict() for cls in TASK_CLASSES
+        }
+        self._queued = {cls: 0 for cls in TASK_CLASSES}
+        self._avg_seconds = {cls: self.DEFAULT_TASK_SECONDS for cls in TASK_CLASSES}
+        self._rejected = {cls: 0 for cls in TASK_CLASSES}
+
+    @property
+    def capacity(self) -> int:
+        """同时运行的重任务总数上限，默认为各类任务并发上限之和（只由各类上限约束）"""
+        return settings.SCHEDULER_MAX_ACTIVE or sum(self.limits.values())
+
+    def retry_after(self, task_class: str) -> int:
+        """根据排队长度和平均耗时估计重试等待秒数"""
+        waves = (self._queued[task_class] + 1) / self.limits[task_class]
+        return max(1, math.ceil(waves * self._avg_seconds[task_class]))
+
+    def _queue_full(self, task_class: str, client_id: str, extra: int = 0) -> bool:
+        """该类任务的队列或该客户端在其中的排队数已超过上限"""
+        limit = self.max_queue[task_class]
+        if limit is not None and self._queued[task_class] + extra > limit:
+            return True
+        client_limit = self.max_client_queue[task_class]
+        client_queued = len(self._waiting[task_class].get(client_id, ()))
+        return client_limit is not None and client_queued + extra > client_limit
+
+    def ensure_admissible(self, task_class: str, client_id: str):
+        """检查该类任务的队列（以及该客户端的排队数）是否还能接收新任务"""
+        if self._queue_full(task_class, client_id, extra=1):
+            self._rejected[task_class] += 1
+            raise SchedulerBusyError(task_class, self.retry_after(task_class))
+
+    @asynccontextmanager
+    async def slot(self, task_class: str, client_id: str):
+        """
+        获取执行槽位，退出时释放
+
+        Args:
+            task_class: interactive, export, analysis, background
+            client_id: 客户端标识，用于公平排队
+        """
+        if task_class not in self.limits:
+            raise ValueError(f"Unknown task class: {task_class}")
+
+        await self._acquire(task_class, client_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(task_class, time.monotonic() - started)
+
+    async def _acquire(self, task_class: str, client_id: str):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[task_class].setdefault(client_id, deque()).append(future)
+        self._queued[task_class] += 1
+        self._dispatch()
+
+        if not future.done() and self._queue_full(task_class, client_id):
+            self._remove_waiter(task_class, client_id, future)
+            self._rejected[task_class] += 1
+            raise SchedulerBusyError(task_class, self.retry_after(task_class))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配槽位但调用方被取消，归还槽位
+                self._release(task_class, None)
+            else:
+                self._remove_waiter(task_class, client_id, future)
+            raise
+
+    def _remove_waiter(self, task_class: str, client_id: str, future: asyncio.Future):
+        queue = self._waiting[task_class].get(client_id)
+        if queue and future in queue:
+            queue.remove(future)
+            self._queued[task_class] -= 1
+            if not queue:
+                del self._waiting[task_class][client_id]
+        future.cancel()
+
+    def _release(self, task_class: str, elapsed: float | None):
+        self._active[task_class] -= 1
+        if elapsed is not None:
+            # 指数移动平均，用于估计 Retry-After
+            self._avg_seconds[task_class] = 0.8 * self._avg_seconds[task_class] + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self):
+        """按优先级和客户端轮转分配空闲槽位"""
+        while sum(self._active.values()) < self.capacity:
+            granted = False
+            for task_class in TASK_CLASSES:
+                if self._active[task_class] >= self.limits[task_class]:
+                    continue
+                future = self._next_waiter(task_class)
+                if future is None:
+                    continue
+                self._active[task_class] += 1
+                future.set_result(None)
+                granted = True
+                break
+            if not granted:
+                return
+
+    def _next_waiter(self, task_class: str) -> asyncio.Future | None:
+        """轮转取出下一个客户端的最早请求"""
+        waiting = self._waiting[task_class]
+        while waiting:
+            client_id, queue = next(iter(waiting.items()))
+            future = queue.popleft()
+            self._queued[task_class] -= 1
+            # 该客户端移到队尾，其他客户端先执行
+            del waiting[client_id]
+            if queue:
+                waiting[client_id] = queue
+            if not future.done():
+                return future
+        return None
+
+    def stats(self) -> Dict:
+        """各类任务的运行、排队与拒绝统计"""
+        return {
+            'capacity': self.capacity,
+            'classes': {
+                cls: {
+                    'active': self._active[cls],
+                    'queued': self._queued[cls],
+                    'limit': self.limits[cls],
+                    'max_queue': self.max_queue[cls],
+                    'max_client_queue': self.max_client_queue[cls],
+                    'rejected': self._rejected[cls],
+                    'avg_seconds': round(self._avg_seconds[cls], 2),
+                    'clients_waiting': len(self._waiting[cls])
+                }
+                for cls in TASK_CLASSES
+            }
+        }
+
+
+def client_id_from(request: Request) -> str:
+    """客户端标识：优先使用 X-Client-Id，其次代理转发的真实 IP"""
+    client_id = request.headers.get('x-client-id')
+    if client_id:
+        return client_id[:64]
+    forwarded = request.headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+
+@asynccontextmanager
+async def admitted(request: Request, task_class: str):
+    """
+    在请求处理中占用一个调度槽位，排队时客户端断开则退出队列
+
+    只包住真正向进程池提交任务的部分（例如缓存未命中时的转码），
+    静态文件和缓存读取不经过调度器。
+    """
+    from app.services.cancellation import cancellation_monitor
+
+    slot = scheduler.slot(task_class, client_id_from(request))
+    await cancellation_monitor.run(request, slot.__aenter__(), f"queued_{task_class}")
+    try:
+        yield
+    finally:
+        await slot.__aexit__(None, None, None)
+
+
+def admission(task_class: str):
+    """FastAPI 依赖：整个请求处理期间占用一个调度槽位"""
+
+    async def dependency(request: Request):
+        async with admitted(request, task_class):
+            yield
+    return dependency
+
+
+# 单例
+scheduler = Scheduler()
@@ -1,15 +1,177 @@
 """
 过渡优化服务 - 智能分析和推荐最佳过渡方案
 BigEyeMix 音频拼接过渡增强
+
+音频特征（tempo、能量、频谱质心、零交叉率、色度、响度）在上传时作为 features 产物生成，
+这里只读取特征并计算兼容性。给出片段范围时，只看前段末尾和后段开头的窗口，
+从缓存的逐帧特征中切片求均值。
 """
-import librosa
-import numpy as np
-from pydub import AudioSegment
+import asyncio
 import logging
+import numpy as np
 from typing import Dict, List, Tuple, Optional
+from app.services.file_service import file_service
+from app.services.beat_sync_service import boundary_window
 
 logger = logging.getLogger(__name__)
 
+# 片段在源文件中的范围：(开始秒, 结束秒)，结束为 None 表示到曲目末尾
+ClipRange = Tuple[float, Optional[float]]
+
+# 窗口内至少有这么多个节拍时才用局部节拍间隔估计 tempo，否则用整首的 tempo
+MIN_WINDOW_BEATS = 4
+
+# 兼容性分级：(差异比例上限, 取值)，按顺序取第一个满足 比例 < 上限 的级别。
+# 两两分析和兼容性矩阵共用这些阈值。
+# beatsync 置信度按 BPM 差异比例分级，超过最后一级不推荐 beatsync
+TEMPO_RATIO_TIERS = ((0.05, 0.95), (0.15, 0.75), (0.30, 0.50))
+TEMPO_MISMATCH_CONFIDENCE = 0.25
+NO_BEATS_CONFIDENCE = 0.3
+# crossfade 置信度按能量和音色差异比例中较大的一个分级
+TIMBRE_RATIO_TIERS = ((0.3, 0.9), (0.5, 0.7))
+TIMBRE_MISMATCH_CONFIDENCE = 0.5
+# 最佳过渡节拍数（按 BPM 差异比例）和建议淡化时长（按能量、音色差异比例的均值）
+OPTIMAL_BEATS_TIERS = ((0.05, 2), (0.15, 4))
+OPTIMAL_BEATS_DEFAULT = 8
+CROSSFADE_DURATION_TIERS = ((0.2, 2.0), (0.4, 3.0))
+CROSSFADE_DURATION_DEFAULT = 5.0
+
+
+def tier_value(ratio, tiers, default):
+    """按分级取值（ratio 可以是标量或数组）"""
+    ratio = np.asarray(ratio)
+    return np.select([ratio < limit for limit, _ in tiers], [value for _, value in tiers], default)
+
+
+def relative_diff(a, b):
+    """差异比例 |a - b| / max(a, b)（支持广播）"""
+    return np.abs(a - b) / np.maximum(np.maximum(a, b), 1e-9)
+
+
+# 排序搜索保留的候选路径数
+ORDER_BEAM_WIDTH = 32
+# 不超过这么多项时用动态规划求精确解（状态数 2^n · n）
+ORDER_EXACT_MAX_ITEMS = 10
+
+
+def path_cost(cost: np.ndarray, order: List[int]) -> float:
+    """按顺序依次过渡的总代价"""
+    order = np.asarray(order)
+    return float(cost[order[:-1], order[1:]].sum())
+
+
+def _solve_order_exact(cost: np.ndarray, keep_first: bool) -> List[int]:
+    """Held-Karp 动态规划：dp[已访问集合, 最后一项] 为到达该状态的最小代价"""
+    n = len(cost)
+    full = 1 << n
+    bits = 1 << np.arange(n)
+    dp = np.full((full, n), np.inf)
+    parent = np.full((full, n), -1, dtype=np.int64)
+    for start in ([0] if keep_first else range(n)):
+        dp[1 << start, start] = 0.0
+    
+    # 集合按数值递增处理，加入新项后的集合总是更大，处理时已是最终值
+    for mask in range(1, full):
+        if not np.isfinite(dp[mask]).any():
+            continue
+        # 从 mask 内的某一项 i 接到 mask 外的 j，对每个 j 取最优的 i
+        candidates = dp[mask][:, None] + cost
+        best_from = np.argmin(candidates, axis=0)
+        best = candidates[best_from, np.arange(n)]
+        for j in np.flatnonzero((mask & bits) == 0):
+            target = mask | (1 << int(j))
+            if best[j] < dp[target, j]:
+                dp[target, j] = best[j]
+                parent[target, j] = best_from[j]
+    
+    mask = full - 1
+    last = int(np.argmin(dp[mask]))
+    order = []
+    while last >= 0:
+        order.append(last)
+        mask, last = mask ^ (1 << last), int(parent[mask, last])
+    return order[::-1]
+
+
+def solve_order(cost: np.ndarray, keep_first: bool = False, beam_width: int = ORDER_BEAM_WIDTH) -> List[int]:
+    """
+    求总过渡代价最小的排列（开放路径，起点不限）
+
+    不超过 ORDER_EXACT_MAX_ITEMS 项时用动态规划求精确解。更多项时先用束搜索
+    逐步延长路径，每步只保留代价最低的 beam_width 条；再用 2-opt 翻转子序列继续改进
+    （代价不对称，翻转后重新计算整条路径）。
+
+    Args:
+        cost: N×N 代价矩阵，cost[i, j] 为从 i 过渡到 j 的代价
+        keep_first: 第一项固定在开头
+    """
+    n = len(cost)
+    if n < 2:
+        return list(range(n))
+    if n <= ORDER_EXACT_MAX_ITEMS:
+        return _solve_order_exact(np.asarray(cost, dtype=np.float64), keep_first)
+    
+    starts = np.array([0]) if keep_first else np.arange(n)
+    paths = starts[:, None]
+    totals = np.zeros(len(starts))
+    visited = np.zeros((len(starts), n), dtype=bool)
+    visited[np.arange(len(starts)), starts] = True
+    for _ in range(n - 1):
+        # 每条路径接上每个未访问的项
+        candidates = totals[:, None] + cost[paths[:, -1]]
+        candidates[visited] = np.inf
+        flat = candidates.ravel()
+        keep = min(beam_width, int(np.isfinite(flat).sum()))
+        best = np.argpartition(flat, keep - 1)[:keep]
+        rows, nexts = np.divmod(best, n)
+        paths = np.hstack([paths[rows], nexts[:, None]])
+        totals = flat[best]
+        visited = visited[rows]
+        visited[np.arange(keep), nexts] = True
+    order = paths[np.argmin(totals)].tolist()
+    
+    best_cost = path_cost(cost, order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1 if keep_first else 0, n - 1):
+            for j in range(i + 1, n):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidate_cost = path_cost(cost, candidate)
+                if candidate_cost < best_cost - 1e-9:
+                    order, best_cost, improved = candidate, candidate_cost, True
+    return order
+
+
+def slice_features(frames: Dict, start: float, end: float) -> Dict:
+    """从整首曲目的逐帧特征中切出 [start, end) 窗口并求均值（无需解码音频）"""
+    end = min(end, frames['duration'])
+    start = min(max(start, 0.0), end)
+    frame_rate = frames['sr'] / frames['hop_length']
+    frame_count = len(frames['rms'])
+    first = min(int(start * frame_rate), frame_count - 1)
+    last = max(first + 1, min(int(np.ceil(end * frame_rate)), frame_count))
+    
+    lo, hi = np.searchsorted(frames['beat_times'], [start, end])
+    beat_times = frames['beat_times'][lo:hi]
+    tempo = frames['tempo']
+    if len(beat_times) >= MIN_WINDOW_BEATS:
+        tempo = float(60.0 / np.median(np.diff(beat_times)))
+    
+    return {
+        'tempo': tempo,
+        'beat_count': int(hi - lo),
+        'energy': float(np.mean(frames['rms'][first:last])),
+        'spectral_centroid': float(np.mean(frames['spectral_centroid'][first:last])),
+        'zero_crossing_rate': float(np.mean(frames['zero_crossing_rate'][first:last])),
+        'loudness': float(np.mean(frames['loudness'][first:last])),
+        'chroma': [round(float(v), 4) for v in np.mean(frames['chroma'][:, first:last], axis=1)],
+        'duration': end - start,
+        'window': [round(start, 3), round(end, 3)],
+        'analysis_tier': 2
+    }
+
+
 class TransitionOptimizer:
     """过渡优化分析服务"""
     
@@ -25,7 +187,9 @@ class TransitionOptimizer:
         self,
         audio1_path: str,
         audio2_path: str,
-        transition_type: str
+        transition_type: str,
+        range1: Optional[ClipRange] = None,
+        range2: Optional[ClipRange] = None
     ) -> Dict:
         """
         分析两段音频的过渡兼容性
@@ -34,29 +198,16 @@ class TransitionOptimizer:
             audio1_path: 第一段音频路径
             audio2_path: 第二段音频路径
             transition_type: 过渡类型
+            range1: 第一段片段范围（可选，给出时只分析片段末尾）
+            range2: 第二段片段范围（可选，给出时只分析片段开头）
             
         Returns:
             兼容性分析结果
         """
         try:
             logger.info(f"分析过渡兼容性: {transition_type}")
-            
-            # 加载音频特征
-            features1 = await self._extract_features(audio1_path)
-            features2 = await self._extract_features(audio2_path)
-            
-            # 根据过渡类型分析
-            if transition_type == 'beatsync':
-                return self._analyze_beat_compatibility(features1, features2)
-            elif transition_type == 'crossfade':
-                return self._analyze_crossfade_compatibility(features1, features2)
-            else:
-                # magicfill 和 silence 总是兼容
-                return {
-                    'compatible': True,
-                    'confidence': 1.0,
-                    'recommendation': transition_type
-                }
+            features1, features2 = await self._load_features(audio1_path, audio2_path, range1, range2)
+            return self._analyze(features1, features2, transition_type)
                 
         except Exception as e:
             logger.error(f"兼容性分析失败: {str(e)}")
@@ -67,45 +218,72 @@ class TransitionOptimizer:
                 'error': str(e)
             }
     
-    async def _extract_features(self, audio_path: str) -> Dict:
-        """提取音频特征"""
-        try:
-            # 加载音频（降采样）
-            y, sr = librosa.load(audio_path, sr=22050, duration=30)  # 只分析前30秒
-            
-            # 检测节拍
-            tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-            
-            # 检测能量
-            rms = librosa.feature.rms(y=y)[0]
-            avg_energy = float(np.mean(rms))
-            
-            # 检测频谱质心（音色特征）
-            spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            avg_centroid = float(np.mean(spectral_centroid))
-            
-            # 检测零交叉率（节奏特征）
-            zcr = librosa.feature.zero_crossing_rate(y)[0]
-            avg_zcr = float(np.mean(zcr))
+    async def _load_features(
+        self,
+        audio1_path: str,
+        audio2_path: str,
+        range1: Optional[ClipRange] = None,
+        range2: Optional[ClipRange] = None
+    ) -> Tuple[Dict, Dict]:
+        """读取两段音频交界处的特征（上传时已生成，缺失时并行估计）"""
+        features1, features2 = await self._edge_features([(audio1_path, range1, 'tail'), (audio2_path, range2, 'head')])
+        return features1, features2
+    
+    async def _edge_features(self, windows: List[Tuple[str, Optional[ClipRange], str]]) -> List[Dict]:
+        """
+        多个片段交界窗口的特征
+        
+        每个源文件的特征只读取一次（缺失时在进程池中并行估计），相同的窗口只计算一次。
+        还没有逐帧特征的源文件，窗口使用整首曲目的特征。
+        
+        Args:
+            windows: [(音频路径, 片段范围, 'tail' 或 'head')]
             
-            return {
-                'tempo': float(tempo),
-                'beat_count': len(beats),
-                'energy': avg_energy,
-                'spectral_centroid': avg_centroid,
-                'zero_crossing_rate': avg_zcr,
-                'duration': len(y) / sr
-            }
-        except Exception as e:
-            logger.error(f"特征提取失败: {str(e)}")
-            return {
-                'tempo': 120.0,
-                'beat_count': 0,
-                'energy': 0.1,
-                'spectral_centroid': 1000.0,
-                'zero_crossing_rate': 0.1,
-                'duration': 0
+        Returns:
+            与 windows 一一对应的特征；window 为 False 表示使用的是整首曲目的特征
+        """
+        paths = list(dict.fromkeys(path for path, _, _ in windows))
+        summaries = dict(zip(paths, await asyncio.gather(*(file_service.get_features(p) for p in paths))))
+        framed = list(dict.fromkeys(path for path, clip_range, _ in windows if clip_range is not None))
+        frames = dict(zip(framed, await asyncio.gather(*(file_service.cached_feature_frames(p) for p in framed))))
+        
+        computed = {}
+        for window in windows:
+            if window not in computed:
+                path, clip_range, edge = window
+                if clip_range is None or frames[path] is None:
+                    computed[window] = {**summaries[path], 'window': False}
+                else:
+                    computed[window] = {**self._window_features(frames[path], clip_range, edge), 'window': True}
+        return [computed[window] for window in windows]
+    
+    def _window_features(self, frames: Dict, clip_range: ClipRange, edge: str) -> Dict:
+        start, end = clip_range
+        if end is None:
+            end = frames['duration']
+        return slice_features(frames, *boundary_window(start, end, edge))
+    
+    def _analyze(self, features1: Dict, features2: Dict, transition_type: str) -> Dict:
+        """
+        根据过渡类型分析
+
+        analysis_tier 取两段中较低的分析级别；window 表示两段是否都按交界窗口分析
+        （False 时至少一段使用了整首曲目的特征）
+        """
+        if transition_type == 'beatsync':
+            result = self._analyze_beat_compatibility(features1, features2)
+        elif transition_type == 'crossfade':
+            result = self._analyze_crossfade_compatibility(features1, features2)
+        else:
+            # magicfill 和 silence 总是兼容
+            result = {
+                'compatible': True,
+                'confidence': 1.0,
+                'recommendation': transition_type
             }
+        result['analysis_tier'] = min(features1['analysis_tier'], features2['analysis_tier'])
+        result['window'] = features1['window'] and features2['window']
+        return result
     
     def _analyze_beat_compatibility(
         self,
@@ -118,7 +296,7 @@ class TransitionOptimizer:
         
         # 计算 BPM 差异
         tempo_diff = abs(tempo1 - tempo2)
-        tempo_ratio = tempo_diff / max(tempo1, tempo2)
+        tempo_ratio = float(relative_diff(tempo1, tempo2))
         
         # 检查节拍数量
         has_beats1 = features1['beat_count'] > 0
@@ -128,7 +306,7 @@ class TransitionOptimizer:
             # 无法检测节拍，不推荐 beatsync
             return {
                 'compatible': False,
-                'confidence': 0.3,
+                'confidence': NO_BEATS_CONFIDENCE,
                 'recommendation': 'crossfade',
                 'reason': '无法检测到明显节拍',
                 'tempo1': tempo1,
@@ -136,25 +314,19 @@ class TransitionOptimizer:
             }
         
         # 根据 BPM 差异判断兼容性
-        if tempo_ratio < 0.05:
+        confidence = float(tier_value(tempo_ratio, TEMPO_RATIO_TIERS, TEMPO_MISMATCH_CONFIDENCE))
+        compatible = tempo_ratio < TEMPO_RATIO_TIERS[-1][0]
+        if tempo_ratio < TEMPO_RATIO_TIERS[0][0]:
             # BPM 非常接近，强烈推荐 beatsync
-            confidence = 0.95
-            compatible = True
             reason = f'BPM 非常接近 ({tempo1:.1f} vs {tempo2:.1f})'
-        elif tempo_ratio < 0.15:
+        elif tempo_ratio < TEMPO_RATIO_TIERS[1][0]:
             # BPM 较接近，推荐 beatsync
-            confidence = 0.75
-            compatible = True
             reason = f'BPM 较接近 ({tempo1:.1f} vs {tempo2:.1f})'
-        elif tempo_ratio < 0.30:
+        elif compatible:
             # BPM 有差异，可以尝试 beatsync
-            confidence = 0.50
-            compatible = True
             reason = f'BPM 有差异 ({tempo1:.1f} vs {tempo2:.1f})，可能需要较长过渡'
         else:
             # BPM 差异太大，不推荐 beatsync
-            confidence = 0.25
-            compatible = False
             reason = f'BPM 差异过大 ({tempo1:.1f} vs {tempo2:.1f})'
         
         return {
@@ -176,21 +348,20 @@ class TransitionOptimizer:
         """分析淡化过渡兼容性"""
         # 计算能量差异
         energy_diff = abs(features1['energy'] - features2['energy'])
-        energy_ratio = energy_diff / max(features1['energy'], features2['energy'])
+        energy_ratio = float(relative_diff(features1['energy'], features2['energy']))
         
         # 计算音色差异
         centroid_diff = abs(features1['spectral_centroid'] - features2['spectral_centroid'])
-        centroid_ratio = centroid_diff / max(features1['spectral_centroid'], features2['spectral_centroid'])
+        centroid_ratio = float(relative_diff(features1['spectral_centroid'], features2['spectral_centroid']))
         
         # crossfade 几乎总是兼容的，但可以给出质量评估
-        if energy_ratio < 0.3 and centroid_ratio < 0.3:
-            confidence = 0.9
+        ratio = max(energy_ratio, centroid_ratio)
+        confidence = float(tier_value(ratio, TIMBRE_RATIO_TIERS, TIMBRE_MISMATCH_CONFIDENCE))
+        if ratio < TIMBRE_RATIO_TIERS[0][0]:
             reason = '音频特征相似，过渡效果好'
-        elif energy_ratio < 0.5 and centroid_ratio < 0.5:
-            confidence = 0.7
+        elif ratio < TIMBRE_RATIO_TIERS[1][0]:
             reason = '音频特征有差异，过渡效果尚可'
         else:
-            confidence = 0.5
             reason = '音频特征差异较大，建议使用较长过渡时间'
         
         return {
@@ -204,33 +375,145 @@ class TransitionOptimizer:
         }
     
     def _estimate_optimal_beats(self, tempo1: float, tempo2: float) -> int:
-        """估算最佳过渡节拍数"""
-        tempo_diff = abs(tempo1 - tempo2)
-        tempo_ratio = tempo_diff / max(tempo1, tempo2)
-        
-        if tempo_ratio < 0.05:
-            return 2  # 短过渡
-        elif tempo_ratio < 0.15:
-            return 4  # 中等过渡
-        else:
-            return 8  # 长过渡
+        """估算最佳过渡节拍数（差异越大过渡越长）"""
+        return int(tier_value(relative_diff(tempo1, tempo2), OPTIMAL_BEATS_TIERS, OPTIMAL_BEATS_DEFAULT))
     
     def _suggest_crossfade_duration(self, energy_ratio: float, centroid_ratio: float) -> float:
-        """建议淡化过渡时长"""
+        """建议淡化过渡时长（差异越大过渡越长）"""
         avg_diff = (energy_ratio + centroid_ratio) / 2
+        return float(tier_value(avg_diff, CROSSFADE_DURATION_TIERS, CROSSFADE_DURATION_DEFAULT))
+    
+    async def compatibility_matrix(self, clips: List[Tuple[str, Optional[ClipRange]]]) -> Dict:
+        """
+        多段音频两两之间的过渡兼容性矩阵
         
-        if avg_diff < 0.2:
-            return 2.0  # 短过渡
-        elif avg_diff < 0.4:
-            return 3.0  # 中等过渡
-        else:
-            return 5.0  # 长过渡
+        每个源文件的特征只读取一次，所有组合用数组广播一次算出，阈值与两两分析相同。
+        第 i 行第 j 列表示从第 i 段（末尾）过渡到第 j 段（开头）。
+        
+        Args:
+            clips: [(音频路径, 片段范围)]，片段范围为 None 时使用整首曲目的特征
+            
+        Returns:
+            各项指标的 N×N 矩阵
+        """
+        n = len(clips)
+        features = await self._edge_features(
+            [(path, clip_range, 'tail') for path, clip_range in clips]
+            + [(path, clip_range, 'head') for path, clip_range in clips]
+        )
+        tails, heads = features[:n], features[n:]
+        
+        def pair(key: str) -> Tuple[np.ndarray, np.ndarray]:
+            """前段末尾为列向量、后段开头为行向量，广播成 N×N"""
+            return (
+                np.array([f[key] for f in tails], dtype=np.float64)[:, None],
+                np.array([f[key] for f in heads], dtype=np.float64)[None, :]
+            )
+        
+        tempo_tail, tempo_head = pair('tempo')
+        beats_tail, beats_head = pair('beat_count')
+        tempo_ratio = relative_diff(tempo_tail, tempo_head)
+        no_beats = (beats_tail == 0) | (beats_head == 0)
+        beat_confidence = np.where(
+            no_beats,
+            NO_BEATS_CONFIDENCE,
+            tier_value(tempo_ratio, TEMPO_RATIO_TIERS, TEMPO_MISMATCH_CONFIDENCE)
+        )
+        beat_compatible = ~no_beats & (tempo_ratio < TEMPO_RATIO_TIERS[-1][0])
+        
+        energy_ratio = relative_diff(*pair('energy'))
+        centroid_ratio = relative_diff(*pair('spectral_centroid'))
+        crossfade_confidence = tier_value(
+            np.maximum(energy_ratio, centroid_ratio), TIMBRE_RATIO_TIERS, TIMBRE_MISMATCH_CONFIDENCE
+        )
+        
+        # 与 recommend_transition 相同：取置信度较高的类型
+        use_beatsync = beat_confidence > crossfade_confidence
+        return {
+            'recommendation': np.where(use_beatsync, 'beatsync', 'crossfade').tolist(),
+            'confidence': np.maximum(beat_confidence, crossfade_confidence).tolist(),
+            'beatsync': {
+                'compatible': beat_compatible.tolist(),
+                'confidence': beat_confidence.tolist(),
+                'tempo_diff': np.round(np.abs(tempo_tail - tempo_head), 2).tolist(),
+                'optimal_beats': tier_value(tempo_ratio, OPTIMAL_BEATS_TIERS, OPTIMAL_BEATS_DEFAULT).astype(int).tolist()
+            },
+            'crossfade': {
+                'confidence': crossfade_confidence.tolist(),
+                'suggested_duration': tier_value(
+                    (energy_ratio + centroid_ratio) / 2, CROSSFADE_DURATION_TIERS, CROSSFADE_DURATION_DEFAULT
+                ).tolist()
+            },
+            'tempo': {
+                'tail': [round(f['tempo'], 2) for f in tails],
+                'head': [round(f['tempo'], 2) for f in heads]
+            },
+            'analysis_tier': {
+                'tail': [f['analysis_tier'] for f in tails],
+                'head': [f['analysis_tier'] for f in heads]
+            },
+            # False 表示该片段的窗口还没有逐帧特征，使用的是整首曲目的特征
+            'window': {
+                'tail': [f['window'] for f in tails],
+                'head': [f['window'] for f in heads]
+            }
+        }
+    
+    async def order_clips(self, clips: List[Tuple[str, Optional[ClipRange]]], keep_first: bool = False) -> Dict:
+        """
+        按过渡兼容性排列片段，使相邻片段衔接最顺
+        
+        代价为 1 - 兼容性矩阵的置信度，求总代价最小的顺序；每个过渡使用矩阵推荐的
+        类型和时长（beatsync 按最佳节拍数和前段 tempo 换算）。
+        
+        Args:
+            clips: [(音频路径, 片段范围)]
+            keep_first: 第一项固定在开头
+            
+        Returns:
+            order 为原列表中的下标，transitions 为相邻片段之间的过渡
+        """
+        matrix = await self.compatibility_matrix(clips)
+        confidence = np.array(matrix['confidence'], dtype=np.float64)
+        order = solve_order(1.0 - confidence, keep_first)
+        
+        transitions = []
+        for a, b in zip(order, order[1:]):
+            transition_type = matrix['recommendation'][a][b]
+            if transition_type == 'beatsync':
+                seconds = matrix['beatsync']['optimal_beats'][a][b] * 60.0 / matrix['tempo']['tail'][a]
+            else:
+                seconds = matrix['crossfade']['suggested_duration'][a][b]
+            transitions.append({
+                'from': a,
+                'to': b,
+                'type': transition_type,
+                'duration_ms': int(round(seconds * 1000)),
+                'confidence': float(confidence[a, b])
+            })
+        
+        def mean_confidence(sequence: List[int]) -> float:
+            if len(sequence) < 2:
+                return 1.0
+            return round(1.0 - path_cost(1.0 - confidence, sequence) / (len(sequence) - 1), 4)
+        
+        return {
+            'order': order,
+            'transitions': transitions,
+            'score': mean_confidence(order),
+            # 原顺序的得分，便于比较
+            'original_score': mean_confidence(list(range(len(clips)))),
+            'analysis_tier': min(matrix['analysis_tier']['tail'] + matrix['analysis_tier']['head']),
+            'window': all(matrix['window']['tail'] + matrix['window']['head'])
+        }
     
     async def recommend_transition(
         self,
         audio1_path: str,
         audio2_path: str,
-        user_preference: Optional[str] = None
+        user_preference: Optional[str] = None,
+        range1: Optional[ClipRange] = None,
+        range2: Optional[ClipRange] = None
     ) -> Dict:
         """
         推荐最佳过渡方案
@@ -239,53 +522,82 @@ class TransitionOptimizer:
             audio1_path: 第一段音频路径
             audio2_path: 第二段音频路径
             user_preference: 用户偏好的过渡类型（可选）
+            range1: 第一段片段范围（可选，给出时只分析片段末尾）
+            range2: 第二段片段范围（可选，给出时只分析片段开头）
             
         Returns:
             推荐结果
         """
         try:
-            # 如果用户指定了类型，直接分析该类型
-            if user_preference and user_preference in ['beatsync', 'crossfade']:
-                result = await self.analyze_compatibility(
-                    audio1_path,
-                    audio2_path,
-                    user_preference
-                )
-                result['user_preference'] = user_preference
-                return result
+            # 两段音频的特征只读取一次，各类型的分析都是纯计算
+            features1, features2 = await self._load_features(audio1_path, audio2_path, range1, range2)
+            return self._recommend(features1, features2, user_preference)
             
-            # 否则，分析所有类型并推荐最佳
-            beatsync_result = await self.analyze_compatibility(
-                audio1_path,
-                audio2_path,
-                'beatsync'
-            )
+        except Exception as e:
+            logger.error(f"推荐失败: {str(e)}")
+            return self._fallback_recommendation(e)
+    
+    async def recommend_timeline(
+        self,
+        boundaries: List[Tuple[Tuple[str, Optional[ClipRange]], Tuple[str, Optional[ClipRange]]]],
+        user_preference: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        为时间线上的每个交界推荐过渡方案
+        
+        所有交界的窗口一起读取：相同源文件只读取一次特征，缺失时在进程池中并行提取，
+        所以耗时取决于不同源文件的数量，而不是交界数量。
+        
+        Args:
+            boundaries: [((前段路径, 片段范围), (后段路径, 片段范围))]
+            user_preference: 用户偏好的过渡类型（可选，对所有交界生效）
             
-            crossfade_result = await self.analyze_compatibility(
-                audio1_path,
-                audio2_path,
-                'crossfade'
+        Returns:
+            与 boundaries 一一对应的推荐结果
+        """
+        try:
+            features = await self._edge_features(
+                [window for (path1, range1), (path2, range2) in boundaries
+                 for window in ((path1, range1, 'tail'), (path2, range2, 'head'))]
             )
-            
-            # 选择置信度最高的
-            if beatsync_result['confidence'] > crossfade_result['confidence']:
-                recommended = beatsync_result
-                recommended['alternatives'] = [crossfade_result]
-            else:
-                recommended = crossfade_result
-                recommended['alternatives'] = [beatsync_result]
-            
-            return recommended
-            
         except Exception as e:
             logger.error(f"推荐失败: {str(e)}")
-            return {
-                'compatible': True,
-                'confidence': 0.5,
-                'recommendation': 'crossfade',
-                'reason': '分析失败，使用默认方案',
-                'error': str(e)
-            }
+            return [self._fallback_recommendation(e) for _ in boundaries]
+        return [
+            self._recommend(features[2 * i], features[2 * i + 1], user_preference)
+            for i in range(len(boundaries))
+        ]
+    
+    def _recommend(self, features1: Dict, features2: Dict, user_preference: Optional[str] = None) -> Dict:
+        """根据两段的特征选择过渡类型"""
+        # 如果用户指定了类型，直接分析该类型
+        if user_preference and user_preference in ['beatsync', 'crossfade']:
+            result = self._analyze(features1, features2, user_preference)
+            result['user_preference'] = user_preference
+            return result
+        
+        # 否则，分析所有类型并推荐最佳
+        beatsync_result = self._analyze(features1, features2, 'beatsync')
+        crossfade_result = self._analyze(features1, features2, 'crossfade')
+        
+        # 选择置信度最高的
+        if beatsync_result['confidence'] > crossfade_result['confidence']:
+            recommended = beatsync_result
+            recommended['alternatives'] = [crossfade_result]
+        else:
+            recommended = crossfade_result
+            recommended['alternatives'] = [beatsync_result]
+        
+        return recommended
+    
+    def _fallback_recommendation(self, error: Exception) -> Dict:
+        return {
+            'compatible': True,
+            'confidence': 0.5,
+            'recommendation': 'crossfade',
+            'reason': '分析失败，使用默认方案',
+            'error': str(error)
+        }
 
 
 transition_optimizer = TransitionOptimizer()
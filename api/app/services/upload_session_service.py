@@ -0,0 +1,339 @@
+"""
+分片上传服务 - 可续传、可并行的大文件上传
+BigEyeMix 后端并发
+
+单个 multipart POST 在移动网络下断一次就要从头再来，而且文件完整到达前
+无法开始任何处理。这里把上传拆成分片：
+- 会话创建时预分配目标文件，每个分片直接写入对应偏移，无需拼接
+- 已接收的分片记录在共享状态库中，断线后查询会话即可续传，
+  分片可以并行上传、落到不同 worker
+- 开头的分片到达后立即在进程池中探测音频头，无法解码的文件提前拒绝
+- PCM WAV 可按偏移定位采样：开头分片和中段估计窗口所在的分片到达后，
+  不等其余分片就开始一级特征估计，结果随会话状态返回，完成时直接入库；
+  其他格式需要完整文件才能定位中段，一级估计仍在入库后开始
+- 全部到达后流式校验 MD5，再交给 file_service 入库并开始预处理
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator
+
+import soundfile as sf
+
+from app.core.config import settings
+from app.core.store import store
+from app.services.feature_kernel import estimate_features, ESTIMATE_MAX_SECONDS
+from app.services.file_service import file_service
+from app.services.worker_pool import worker_pool
+
+logger = logging.getLogger(__name__)
+
+# libsndfile 能从文件头识别的格式，探测失败即视为损坏
+PROBED_FORMATS = ('wav', 'flac', 'mp3')
+
+# PCM 子类型每个采样的字节数，这些 WAV 可以由帧号直接算出字节偏移
+PCM_SAMPLE_BYTES = {'PCM_U8': 1, 'PCM_S8': 1, 'PCM_16': 2, 'PCM_24': 3, 'PCM_32': 4, 'FLOAT': 4, 'DOUBLE': 8}
+
+
+def wav_data_offset(prefix: bytes) -> int | None:
+    """WAV 文件中 data 块的起始偏移（data 块不在开头数据内时为 None）"""
+    pos = 12
+    while pos + 8 <= len(prefix):
+        chunk_id = prefix[pos:pos + 4]
+        chunk_size = int.from_bytes(prefix[pos + 4:pos + 8], 'little')
+        if chunk_id == b'data':
+            return pos + 8
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def probe_audio_prefix(file_path: str, length: int) -> dict:
+    """
+    读取文件开头并解析音频头（在进程池中执行）
+
+    PCM WAV 另外返回 estimate_range：一级估计要读取的中段窗口的字节范围
+    """
+    with open(file_path, 'rb') as f:
+        prefix = f.read(length)
+    info = sf.info(io.BytesIO(prefix))
+    probe = {
+        'format': info.format,
+        'sample_rate': info.samplerate,
+        'channels': info.channels
+    }
+    data_offset = wav_data_offset(prefix) if info.format == 'WAV' else None
+    if data_offset is not None and info.subtype in PCM_SAMPLE_BYTES:
+        # 只有开头的数据时 libsndfile 按实际长度截断帧数；目标文件已按最终大小预分配，
+        # 从文件本身读文件头才是整首的帧数
+        frames = sf.info(file_path).frames
+        block_align = info.channels * PCM_SAMPLE_BYTES[info.subtype]
+        # 与 estimate_features 相同的中段窗口
+        duration = frames / info.samplerate
+        start_frame = int(max(0.0, (duration - ESTIMATE_MAX_SECONDS) / 2) * info.samplerate)
+        end_frame = min(frames, start_frame + int(ESTIMATE_MAX_SECONDS * info.samplerate))
+        probe['estimate_range'] = [data_offset + start_frame * block_align, data_offset + end_frame * block_align]
+    return probe
+
+
+class UploadSessionService:
+    """分片上传会话管理"""
+    PART_SIZE = 4 * 1024 * 1024  # 分片大小
+    SESSION_TTL_SECONDS = 24 * 3600  # 未完成会话的保留时间
+
+    def __init__(self):
+        self._estimates = {}  # session_id -> 上传期间的一级估计任务
+
+    def _part_path(self, session_id: str) -> str:
+        return os.path.join(settings.UPLOAD_DIR, f".{session_id}.upload")
+
+    def _get(self, session_id: str):
+        row = store.query_one("SELECT * FROM upload_sessions WHERE session_id = ?", (session_id,))
+        if row is None:
+            raise FileNotFoundError(f"Upload session {session_id} not found")
+        return row
+
+    def _part_count(self, row) -> int:
+        return max(1, -(-row['size'] // row['part_size']))
+
+    def _describe(self, row) -> dict:
+        received = [
+            r['part_index'] for r in store.query(
+                "SELECT part_index FROM upload_parts WHERE session_id = ? ORDER BY part_index",
+                (row['session_id'],)
+            )
+        ]
+        return {
+            'session_id': row['session_id'],
+            'filename': row['filename'],
+            'size': row['size'],
+            'part_size': row['part_size'],
+            'part_count': self._part_count(row),
+            'received': received,
+            'probe': json.loads(row['probe']) if row['probe'] else None
+        }
+
+    def create(self, filename: str, size: int, content_hash: str) -> dict:
+        """
+        创建上传会话（相同内容的未完成会话直接返回，用于续传）
+
+        Returns:
+            会话信息，received 为已接收的分片序号
+        """
+        # 不允许的类型和超限的大小在传输任何数据之前拒绝
+        file_service.validate_filename(filename)
+        if size > settings.MAX_UPLOAD_SIZE:
+            raise ValueError("File size exceeds maximum allowed size")
+        self._expire_sessions()
+
+        content_hash = content_hash.lower()
+        now = time.time()
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM upload_sessions WHERE content_hash = ? AND size = ?", (content_hash, size)
+            ).fetchone()
+            if row and os.path.exists(self._part_path(row['session_id'])):
+                conn.execute(
+                    "UPDATE upload_sessions SET filename = ?, updated_at = ? WHERE session_id = ?",
+                    (filename, now, row['session_id'])
+                )
+                session_id = row['session_id']
+            else:
+                session_id = uuid.uuid4().hex
+                # 预分配目标文件，分片按偏移写入
+                with open(self._part_path(session_id), 'wb') as f:
+                    f.truncate(size)
+                conn.execute(
+                    """INSERT INTO upload_sessions
+                       (session_id, filename, size, content_hash, part_size, probe, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, NULL, ?, ?)""",
+                    (session_id, filename, size, content_hash, self.PART_SIZE, now, now)
+                )
+        return self._describe(self._get(session_id))
+
+    def status(self, session_id: str) -> dict:
+        """会话状态（续传时查询缺少的分片）"""
+        return self._describe(self._get(session_id))
+
+    async def write_part(self, session_id: str, part_index: int, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        接收一个分片并写入对应偏移
+
+        Args:
+            session_id: 会话 ID
+            part_index: 分片序号（从 0 开始）
+            chunks: 请求体数据流
+        """
+        row = self._get(session_id)
+        if not 0 <= part_index < self._part_count(row):
+            raise ValueError(f"Part index {part_index} out of range")
+
+        if store.query_one(
+            "SELECT 1 FROM upload_parts WHERE session_id = ? AND part_index = ?", (session_id, part_index)
+        ):
+            # 已接收的分片不再覆盖，重复发送（例如超时重试）直接确认
+            return self._describe(row)
+
+        offset = part_index * row['part_size']
+        expected = min(row['part_size'], row['size'] - offset)
+        written = 0
+        fd = os.open(self._part_path(session_id), os.O_WRONLY)
+        try:
+            async for chunk in chunks:
+                if written + len(chunk) > expected:
+                    raise ValueError("Part is larger than expected")
+                await asyncio.to_thread(os.pwrite, fd, chunk, offset + written)
+                written += len(chunk)
+        finally:
+            os.close(fd)
+        if written != expected:
+            raise ValueError(f"Part {part_index} incomplete: {written}/{expected} bytes")
+
+        with store.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO upload_parts (session_id, part_index) VALUES (?, ?)",
+                (session_id, part_index)
+            )
+            conn.execute(
+                "UPDATE upload_sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id)
+            )
+
+        if part_index == 0:
+            await self._probe(row)
+        self._schedule_estimate(session_id)
+        return self._describe(self._get(session_id))
+
+    async def _probe(self, row):
+        """开头分片到达后解析音频头，不等全部上传完成"""
+        ext = row['filename'].split('.')[-1].lower()
+        if ext not in PROBED_FORMATS or row['probe']:
+            return
+        length = min(row['part_size'], row['size'])
+        try:
+            probe = await worker_pool.run(
+                'decode', probe_audio_prefix, self._part_path(row['session_id']), length
+            )
+        except Exception as e:
+            self.abort(row['session_id'])
+            raise ValueError(f"Failed to read audio file: {e}")
+        store.execute(
+            "UPDATE upload_sessions SET probe = ? WHERE session_id = ?",
+            (json.dumps(probe), row['session_id'])
+        )
+
+    def _estimate_parts(self, row, probe: dict) -> set:
+        """一级估计需要的分片：文件头所在的开头分片和中段窗口覆盖的分片"""
+        start, end = probe['estimate_range']
+        part_size = row['part_size']
+        return {0, *range(start // part_size, max(start, end - 1) // part_size + 1)}
+
+    def _schedule_estimate(self, session_id: str):
+        """估计窗口所在的分片都已到达时，在后台开始一级估计"""
+        if session_id in self._estimates:
+            return
+        row = self._get(session_id)
+        probe = json.loads(row['probe']) if row['probe'] else None
+        if not probe or 'estimate_range' not in probe or 'estimate' in probe:
+            return
+        received = {
+            r['part_index'] for r in store.query(
+                "SELECT part_index FROM upload_parts WHERE session_id = ?", (session_id,)
+            )
+        }
+        if not self._estimate_parts(row, probe) <= received:
+            return
+        task = asyncio.create_task(self._estimate(session_id))
+        self._estimates[session_id] = task
+        task.add_done_callback(lambda _: self._estimates.pop(session_id, None))
+
+    async def _estimate(self, session_id: str):
+        """计算一级估计并记录在会话中（失败时入库后照常重新估计）"""
+        try:
+            data = await worker_pool.run('analysis', estimate_features, self._part_path(session_id))
+        except Exception as e:
+            logger.warning(f"上传期间的一级估计失败: {session_id} {e}")
+            return
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT probe FROM upload_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return
+            probe = json.loads(row['probe'])
+            probe['estimate'] = data
+            conn.execute(
+                "UPDATE upload_sessions SET probe = ? WHERE session_id = ?", (json.dumps(probe), session_id)
+            )
+
+    async def complete(self, session_id: str) -> str:
+        """
+        校验并完成上传
+
+        Returns:
+            上传文件路径
+        """
+        # 正在进行的一级估计比入库后重新计算更早完成，等它写入会话
+        task = self._estimates.get(session_id)
+        if task is not None:
+            await asyncio.wait({task})
+
+        with store.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM upload_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"Upload session {session_id} not found")
+            received = conn.execute(
+                "SELECT COUNT(*) AS n FROM upload_parts WHERE session_id = ?", (session_id,)
+            ).fetchone()['n']
+            if received < self._part_count(row):
+                raise ValueError(f"Upload incomplete: {received}/{self._part_count(row)} parts")
+            # 先删除会话，多个 worker 同时完成时只有一个继续
+            conn.execute("DELETE FROM upload_sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM upload_parts WHERE session_id = ?", (session_id,))
+
+        # 会话记录已删除，之后任何失败都要删除已接收的数据，否则没有人再引用它
+        part_path = self._part_path(session_id)
+        try:
+            file_md5 = await asyncio.to_thread(file_service.hash_file, part_path)
+            if file_md5 != row['content_hash']:
+                raise ValueError("Checksum mismatch, please upload again")
+            probe = json.loads(row['probe']) if row['probe'] else {}
+            if 'estimate' in probe:
+                # 内容已校验，上传期间算好的一级估计直接入库，预处理不再重复计算
+                file_service.seed_artifact(file_md5, 'estimate', probe['estimate'])
+            return await file_service.ingest_file(part_path, row['filename'], file_md5, row['size'])
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    def abort(self, session_id: str):
+        """取消会话并删除已接收的数据"""
+        task = self._estimates.get(session_id)
+        if task is not None:
+            task.cancel()
+        with store.transaction() as conn:
+            conn.execute("DELETE FROM upload_sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM upload_parts WHERE session_id = ?", (session_id,))
+        try:
+            os.remove(self._part_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _expire_sessions(self):
+        """清除长时间没有进展的会话"""
+        expired = store.query(
+            "SELECT session_id FROM upload_sessions WHERE updated_at < ?",
+            (time.time() - self.SESSION_TTL_SECONDS,)
+        )
+        for row in expired:
+            logger.info(f"上传会话已过期: {row['session_id']}")
+            self.abort(row['session_id'])
+
+
+# 单例
+upload_sessions = UploadSessionService()
@@ -0,0 +1,146 @@
+"""
+进程池服务 - 在独立进程中执行 CPU 密集型音频任务
+BigEyeMix 后端并发
+
+pydub / ffmpeg / librosa 都是同步阻塞调用，直接在事件循环里执行会卡住
+所有其他请求（包括 SSE 流和健康检查）。这里统一把解码、分析、渲染、
+编码任务提交到进程池，事件循环只负责 await 结果。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 任务类别：用于统计利用率
+TASK_KINDS = ('decode', 'analysis', 'render', 'encode')
+
+
+def _invoke(fn: Callable, args: tuple, kwargs: dict):
+    """在子进程中执行任务，并返回执行耗时"""
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    return result, time.monotonic() - started
+
+
+class WorkerPool:
+    """CPU 密集型任务进程池"""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.size = 0
+        self.started_at: Optional[float] = None
+        self._in_flight = 0
+        self._kind_stats = {
+            kind: {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'abandoned': 0, 'busy_seconds': 0.0}
+            for kind in TASK_KINDS
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """启动进程池（在应用 lifespan 中调用）"""
+        if self._executor is not None:
+            return
+
+        self.size = settings.WORKER_POOL_SIZE or os.cpu_count() or 1
+        max_tasks = settings.WORKER_POOL_MAX_TASKS_PER_CHILD or None
+        # 使用 spawn：避免 fork 带有事件循环和线程的 uvicorn 进程
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=multiprocessing.get_context('spawn'),
+            max_tasks_per_child=max_tasks
+        )
+        self.started_at = time.monotonic()
+        logger.info(f"进程池已启动: {self.size} 个工作进程")
+
+    def shutdown(self, wait: bool = True):
+        """关闭进程池"""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+        logger.info("进程池已关闭")
+
+    async def run(self, kind: str, fn: Callable, *args, **kwargs) -> Any:
+        """
+        在进程池中执行任务并等待结果
+
+        Args:
+            kind: 任务类别 (decode, analysis, render, encode)
+            fn: 可 pickle 的函数或服务实例的方法
+
+        Returns:
+            任务返回值
+        """
+        if kind not in self._kind_stats:
+            raise ValueError(f"Unknown task kind: {kind}")
+
+        # 脚本直接调用服务时未经过 lifespan，按需启动
+        if self._executor is None:
+            self.start()
+
+        stats = self._kind_stats[kind]
+        stats['submitted'] += 1
+        self._in_flight += 1
+
+        executor = self._executor
+        future = executor.submit(_invoke, fn, args, kwargs)
+        try:
+            result, elapsed = await asyncio.wrap_future(future)
+            stats['completed'] += 1
+            stats['busy_seconds'] += elapsed
+            return result
+        except asyncio.CancelledError:
+            # 尚未开始的任务直接从队列中撤销；已在执行的任务无法中断，结果被丢弃
+            if future.cancel():
+                stats['cancelled'] += 1
+            else:
+                stats['abandoned'] += 1
+            raise
+        except BrokenProcessPool:
+            # 工作进程异常退出（如 OOM），重建进程池
+            stats['failed'] += 1
+            if self._executor is executor:
+                logger.error("进程池已损坏，正在重建")
+                self.shutdown(wait=False)
+                self.start()
+            raise
+        except Exception:
+            stats['failed'] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def stats(self) -> Dict:
+        """进程池利用率统计"""
+        active = min(self._in_flight, self.size)
+        busy_seconds = sum(s['busy_seconds'] for s in self._kind_stats.values())
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+
+        return {
+            'running': self.running,
+            'size': self.size,
+            'active': active,
+            'queued': self._in_flight - active,
+            'utilization': round(active / self.size, 3) if self.size else 0.0,
+            'busy_ratio': round(busy_seconds / (uptime * self.size), 3) if uptime and self.size else 0.0,
+            'uptime_seconds': round(uptime, 1),
+            'tasks': {
+                kind: {**s, 'busy_seconds': round(s['busy_seconds'], 2)}
+                for kind, s in self._kind_stats.items()
+            }
+        }
+
+
+# 单例
+worker_pool = WorkerPool()
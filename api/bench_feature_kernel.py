@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+特征提取性能对比：逐个调用 librosa vs 单次 STFT 内核
+
+用法: python bench_feature_kernel.py [音频文件 ...]
+不指定文件时使用 data/uploads 中的音频。
+"""
+import os
+import sys
+import time
+
+import librosa
+import numpy as np
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.services.feature_kernel import analyze_signal, BEAT_GRID_SR, BEAT_GRID_HOP
+
+REPEATS = 3
+
+
+def separate_calls(y: np.ndarray, sr: int) -> dict:
+    """原来的调用方式：各特征分别分帧，onset 和频谱质心各做一次 STFT"""
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=BEAT_GRID_HOP)
+    tempo, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=BEAT_GRID_HOP)
+    return {
+        'onset_env': onset_env,
+        'rms': librosa.feature.rms(y=y, hop_length=BEAT_GRID_HOP)[0],
+        'spectral_centroid': librosa.feature.spectral_centroid(y=y, sr=sr, hop_length=BEAT_GRID_HOP)[0],
+        'zero_crossing_rate': librosa.feature.zero_crossing_rate(y, hop_length=BEAT_GRID_HOP)[0]
+    }
+
+
+def best_time(fn, *args) -> float:
+    """多次运行取最短时间（首次运行包含 numba 编译）"""
+    fn(*args)
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        upload_dir = "data/uploads"
+        if os.path.isdir(upload_dir):
+            paths = [
+                os.path.join(upload_dir, f) for f in sorted(os.listdir(upload_dir))
+                if f.endswith(('.mp3', '.flac', '.wav'))
+            ]
+    if not paths:
+        print("❌ 没有音频文件，请指定文件路径")
+        return
+
+    print(f"{'文件':<40} {'时长':>8} {'分别调用':>10} {'单次内核':>10} {'加速':>6}  最大偏差")
+    for path in paths:
+        y, sr = librosa.load(path, sr=BEAT_GRID_SR, mono=True)
+        separate = separate_calls(y, sr)
+        kernel = analyze_signal(y, sr, BEAT_GRID_HOP)
+        # 内核结果与逐个调用一致（零交叉率的边界处理略有不同）
+        deviation = max(
+            float(np.max(np.abs(kernel[key] - separate[key]) / (np.max(np.abs(separate[key])) or 1)))
+            for key in separate
+        )
+
+        separate_time = best_time(separate_calls, y, sr)
+        kernel_time = best_time(analyze_signal, y, sr, BEAT_GRID_HOP)
+        print(
+            f"{os.path.basename(path)[:40]:<40} {len(y) / sr:>7.1f}s {separate_time:>9.3f}s "
+            f"{kernel_time:>9.3f}s {separate_time / kernel_time:>5.2f}x  {deviation:.1e}"
+        )
+    print("\n单次内核额外计算了色度和响度，分别调用的一侧不包含这两项")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.api import upload, process, health, muggle_splice, asr
+from app.api import upload, process, health, muggle_splice, asr, jobs
+from app.services.worker_pool import worker_pool
+from app.services.eviction_service import eviction_manager
+from app.services.file_service import file_service
+from app.services.job_service import job_service
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 创建目录，上传目录表与磁盘对账
+    file_service.start()
+    # 上次运行中断的渲染任务标记为失败
+    job_service.start()
+    # 启动 CPU 密集型任务进程池
+    worker_pool.start()
+    # 定期清理输出目录、缓存和临时文件
+    eviction_manager.start()
+    yield
+    await eviction_manager.stop()
+    worker_pool.shutdown()
 
 app = FastAPI(
     title="BigEyeMix API",
     description="AI-powered music mixing and transition API",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -16,12 +36,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 # Include routers
 app.include_router(health.router, prefix="/api", tags=["health"])
 app.include_router(upload.router, prefix="/api", tags=["upload"])
 app.include_router(process.router, prefix="/api", tags=["process"])
+app.include_router(jobs.router, prefix="/api", tags=["jobs"])
 app.include_router(muggle_splice.router, prefix="/api", tags=["muggle_splice"])
 app.include_router(asr.router, prefix="/api", tags=["asr"])
 
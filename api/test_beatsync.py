@@ -9,7 +9,8 @@ import os
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app.services.beat_sync_service import BeatSyncService
+from app.services.beat_sync_service import boundary_window, slice_beat_grid, detect_window_beats
+from app.services.file_service import file_service
 from app.services.transition_optimizer import transition_optimizer
 
 async def test_beat_detection():
@@ -18,8 +19,6 @@ async def test_beat_detection():
     print("测试节拍检测功能")
     print("=" * 60)
     
-    service = BeatSyncService()
-    
     # 查找测试音频文件
     upload_dir = "data/uploads"
     if not os.path.exists(upload_dir):
@@ -40,21 +39,31 @@ async def test_beat_detection():
     print(f"  文件2: {audio_files[1]}")
     
     try:
-        # 测试节拍检测
-        print("\n[1/3] 检测文件1的节拍...")
-        beat_info1 = service._detect_beats(file1)
+        # 测试节拍检测（整首的节拍网格，切片得到整首的节拍）
+        print("\n[1/4] 检测文件1的节拍...")
+        grid1 = await file_service.get_beat_grid(file1)
+        beat_info1 = slice_beat_grid(grid1, 0, grid1['duration'])
         print(f"  ✓ BPM: {beat_info1['tempo']:.1f}")
         print(f"  ✓ 节拍数: {beat_info1['beat_count']}")
         print(f"  ✓ 时长: {beat_info1['duration']:.2f}s")
         
-        print("\n[2/3] 检测文件2的节拍...")
-        beat_info2 = service._detect_beats(file2)
+        print("\n[2/4] 检测文件2的节拍...")
+        grid2 = await file_service.get_beat_grid(file2)
+        beat_info2 = slice_beat_grid(grid2, 0, grid2['duration'])
         print(f"  ✓ BPM: {beat_info2['tempo']:.1f}")
         print(f"  ✓ 节拍数: {beat_info2['beat_count']}")
         print(f"  ✓ 时长: {beat_info2['duration']:.2f}s")
         
+        # 只解码交界窗口的检测结果应与网格切片接近
+        print("\n[3/4] 检测文件1末尾窗口的节拍...")
+        window_start, window_end = boundary_window(0, grid1['duration'], 'tail')
+        sliced = slice_beat_grid(grid1, window_start, window_end)
+        window_info = detect_window_beats(file1, window_start, window_end)
+        print(f"  ✓ 窗口: {window_start:.2f}s - {window_end:.2f}s")
+        print(f"  ✓ 网格切片: {sliced['beat_count']} 拍, 单独检测: {window_info['beat_count']} 拍 (BPM {window_info['tempo']:.1f})")
+        
         # 测试兼容性分析
-        print("\n[3/3] 分析过渡兼容性...")
+        print("\n[4/4] 分析过渡兼容性...")
         analysis = await transition_optimizer.analyze_compatibility(
             file1, file2, 'beatsync'
         )
@@ -117,6 +126,9 @@ async def main():
     """主测试函数"""
     print("\n🎵 BigEyeMix 节拍对齐功能测试\n")
     
+    # 创建缓存目录（应用中由 lifespan 执行）
+    file_service.start()
+    
     await test_beat_detection()
     await test_transition_optimizer()
     
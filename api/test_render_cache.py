@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试渲染缓存：相同的并发请求只渲染一次，完成后命中缓存
+"""
+import asyncio
+import hashlib
+import shutil
+import sys
+import os
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# 使用临时目录，不影响 data/ 下的上传和状态库
+DATA_DIR = tempfile.mkdtemp(prefix="render_cache_test_")
+os.environ['UPLOAD_DIR'] = os.path.join(DATA_DIR, 'uploads')
+os.environ['OUTPUT_DIR'] = os.path.join(DATA_DIR, 'outputs')
+os.environ['STATE_DB_PATH'] = os.path.join(DATA_DIR, 'state.db')
+
+from app.models.schemas import MultiMixRequest
+from app.services.file_service import file_service
+from app.services.render_cache import render_cache
+from app.services.worker_pool import worker_pool
+
+
+async def upload_tone(name: str, frequency: float, seconds: float = 4.0) -> str:
+    """生成正弦波 WAV 并入库，返回 file_id"""
+    sr = 22050
+    t = np.arange(int(sr * seconds)) / sr
+    tmp_path = os.path.join(DATA_DIR, name)
+    sf.write(tmp_path, 0.3 * np.sin(2 * np.pi * frequency * t), sr)
+    with open(tmp_path, 'rb') as f:
+        md5 = hashlib.md5(f.read()).hexdigest()
+    file_path = await file_service.ingest_file(tmp_path, name, md5, os.path.getsize(tmp_path))
+    return os.path.basename(file_path)
+
+
+def mix_request(file_ids: list, end: float) -> MultiMixRequest:
+    return MultiMixRequest(segments=[
+        {'file_id': file_ids[0], 'start': 0, 'end': end},
+        {'file_id': '__transition__', 'start': 0, 'end': 0.5, 'transition_type': 'crossfade'},
+        {'file_id': file_ids[1], 'start': 0, 'end': end}
+    ])
+
+
+async def run_tests() -> bool:
+    passed = 0
+    failed = 0
+
+    def check(name: str, ok: bool):
+        nonlocal passed, failed
+        if ok:
+            passed += 1
+            print(f"   ✅ {name}")
+        else:
+            failed += 1
+            print(f"   ❌ {name}")
+
+    print("\n" + "=" * 60)
+    print("渲染缓存测试")
+    print("=" * 60)
+
+    file_service.start()
+    file_ids = [await upload_tone('a.wav', 440), await upload_tone('b.wav', 660)]
+
+    # 场景 1：4 个相同的并发请求只触发 1 次渲染
+    print("\n场景 1: 合并相同的并发请求")
+    before = render_cache.stats()
+    results = await asyncio.gather(*(render_cache.render(mix_request(file_ids, 3)) for _ in range(4)))
+    after = render_cache.stats()
+    check("只渲染 1 次", after['misses'] - before['misses'] == 1)
+    check("其余 3 个请求合并到同一渲染", after['coalesced'] - before['coalesced'] == 3)
+    check("所有请求得到同一个输出文件", len({path for path, _ in results}) == 1)
+    check("输出文件存在", os.path.exists(results[0][0]))
+
+    # 场景 2：完成后的相同请求命中缓存
+    print("\n场景 2: 命中缓存")
+    path, cached = await render_cache.render(mix_request(file_ids, 3))
+    check("第 5 个请求命中缓存", cached and path == results[0][0])
+    check("命中计数增加", render_cache.stats()['hits'] - after['hits'] == 1)
+
+    # 场景 3：一个等待方取消不影响其他等待方
+    print("\n场景 3: 部分等待方取消")
+    first = asyncio.create_task(render_cache.render(mix_request(file_ids, 2)))
+    second = asyncio.create_task(render_cache.render(mix_request(file_ids, 2)))
+    await asyncio.sleep(0)
+    first.cancel()
+    path, cached = await second
+    check("剩余的等待方得到渲染结果", os.path.exists(path) and not cached)
+
+    # 场景 4：所有等待方都取消时渲染被取消，之后的相同请求重新渲染
+    print("\n场景 4: 所有等待方取消")
+    before = render_cache.stats()
+    waiters = [asyncio.create_task(render_cache.render(mix_request(file_ids, 1))) for _ in range(2)]
+    await asyncio.sleep(0)
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0.1)
+    check("渲染任务已取消", render_cache.stats()['cancelled'] - before['cancelled'] == 1)
+    check("没有进行中的渲染", render_cache.stats()['inflight'] == 0)
+    path, cached = await render_cache.render(mix_request(file_ids, 1))
+    check("重新请求时正常渲染", os.path.exists(path) and not cached)
+
+    print(f"\n{'=' * 60}")
+    print(f"✅ 通过: {passed}")
+    print(f"❌ 失败: {failed}")
+    print(f"{'=' * 60}\n")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    try:
+        success = asyncio.run(run_tests())
+    finally:
+        worker_pool.shutdown()
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
+    sys.exit(0 if success else 1)
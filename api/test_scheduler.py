@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+测试调度器的准入控制：按客户端的排队上限、429 和客户端轮转
+"""
+import asyncio
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.services.scheduler import Scheduler, SchedulerBusyError
+
+
+def make_scheduler() -> Scheduler:
+    """导出任务并发 1、队列 3、单个客户端最多排队 2"""
+    scheduler = Scheduler()
+    scheduler.limits['export'] = 1
+    scheduler.max_queue['export'] = 3
+    scheduler.max_client_queue['export'] = 2
+    return scheduler
+
+
+async def hold(scheduler: Scheduler, client_id: str, release: asyncio.Event, order: list):
+    async with scheduler.slot('export', client_id):
+        order.append(client_id)
+        await release.wait()
+
+
+async def try_queue(scheduler: Scheduler, client_id: str, release: asyncio.Event, order: list):
+    """排队并返回任务；被拒绝时返回 429 异常"""
+    task = asyncio.create_task(hold(scheduler, client_id, release, order))
+    await asyncio.sleep(0)
+    if task.done() and task.exception():
+        return task.exception()
+    return task
+
+
+async def run_tests() -> bool:
+    passed = 0
+    failed = 0
+
+    def check(name: str, ok: bool):
+        nonlocal passed, failed
+        if ok:
+            passed += 1
+            print(f"   ✅ {name}")
+        else:
+            failed += 1
+            print(f"   ❌ {name}")
+
+    print("\n" + "=" * 60)
+    print("调度器准入控制测试")
+    print("=" * 60)
+
+    # 场景 1：单个客户端占满自己的排队上限后，其他客户端仍可排队
+    print("\n场景 1: 按客户端的排队上限")
+    scheduler = make_scheduler()
+    release = asyncio.Event()
+    order = []
+    running = await try_queue(scheduler, 'A', release, order)
+    queued_a = [await try_queue(scheduler, 'A', release, order) for _ in range(2)]
+    rejected_a = await try_queue(scheduler, 'A', release, order)
+    check("客户端 A 第 3 个排队请求返回 429", isinstance(rejected_a, SchedulerBusyError) and rejected_a.status_code == 429)
+    check("429 带 Retry-After", isinstance(rejected_a, SchedulerBusyError) and 'Retry-After' in rejected_a.headers)
+
+    queued_b = await try_queue(scheduler, 'B', release, order)
+    check("客户端 B 仍可排队", isinstance(queued_b, asyncio.Task))
+
+    try:
+        scheduler.ensure_admissible('export', 'A')
+        check("ensure_admissible 拒绝已达上限的客户端 A", False)
+    except SchedulerBusyError:
+        check("ensure_admissible 拒绝已达上限的客户端 A", True)
+
+    # 队列总数已满（A 2 个 + B 1 个），新客户端也被拒绝
+    rejected_c = await try_queue(scheduler, 'C', release, order)
+    check("类别队列已满时客户端 C 返回 429", isinstance(rejected_c, SchedulerBusyError))
+
+    # 场景 2：槽位释放后按客户端轮转，B 先于 A 的第二个请求
+    print("\n场景 2: 客户端轮转")
+    release.set()
+    await asyncio.gather(running, *queued_a, queued_b)
+    check(f"执行顺序 {order} == ['A', 'A', 'B', 'A']", order == ['A', 'A', 'B', 'A'])
+    stats = scheduler.stats()['classes']['export']
+    check("全部完成后无排队和运行中的任务", stats['queued'] == 0 and stats['active'] == 0)
+    check("拒绝计数为 3", stats['rejected'] == 3)
+
+    # 场景 3：排队中取消会退出队列，释放客户端名额
+    print("\n场景 3: 取消排队")
+    scheduler = make_scheduler()
+    release = asyncio.Event()
+    order = []
+    running = await try_queue(scheduler, 'A', release, order)
+    queued_a = [await try_queue(scheduler, 'A', release, order) for _ in range(2)]
+    queued_a[0].cancel()
+    await asyncio.gather(queued_a[0], return_exceptions=True)
+    again = await try_queue(scheduler, 'A', release, order)
+    check("取消后客户端 A 可以再次排队", isinstance(again, asyncio.Task))
+    release.set()
+    await asyncio.gather(running, queued_a[1], again)
+    check("取消的请求没有执行", order == ['A', 'A', 'A'])
+
+    print(f"\n{'=' * 60}")
+    print(f"✅ 通过: {passed}")
+    print(f"❌ 失败: {failed}")
+    print(f"{'=' * 60}\n")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = asyncio.run(run_tests())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试片段排序：小规模时动态规划的结果与穷举一致
+"""
+import itertools
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.services.transition_optimizer import solve_order, path_cost
+
+
+def brute_force(cost: np.ndarray, keep_first: bool) -> float:
+    """穷举所有排列的最小总代价"""
+    n = len(cost)
+    if keep_first:
+        orders = ([0, *rest] for rest in itertools.permutations(range(1, n)))
+    else:
+        orders = (list(order) for order in itertools.permutations(range(n)))
+    return min(path_cost(cost, order) for order in orders)
+
+
+def run_tests() -> bool:
+    passed = 0
+    failed = 0
+
+    def check(name: str, ok: bool):
+        nonlocal passed, failed
+        if ok:
+            passed += 1
+            print(f"   ✅ {name}")
+        else:
+            failed += 1
+            print(f"   ❌ {name}")
+
+    print("\n" + "=" * 60)
+    print("片段排序测试")
+    print("=" * 60)
+
+    rng = np.random.default_rng(0)
+
+    # 场景 1：随机的不对称代价矩阵，n ≤ 7 时与穷举的最优代价一致
+    for keep_first in (False, True):
+        print(f"\n场景 1: 动态规划 vs 穷举 (keep_first={keep_first})")
+        for n in range(2, 8):
+            mismatches = 0
+            invalid = 0
+            for _ in range(20):
+                cost = rng.random((n, n))
+                np.fill_diagonal(cost, 0)
+                order = solve_order(cost, keep_first)
+                if sorted(order) != list(range(n)) or (keep_first and order[0] != 0):
+                    invalid += 1
+                elif abs(path_cost(cost, order) - brute_force(cost, keep_first)) > 1e-9:
+                    mismatches += 1
+            check(f"n={n}: 20 个矩阵全部是合法排列且代价最优", invalid == 0 and mismatches == 0)
+
+    # 场景 2：代价相同的矩阵（例如全部特征缺失时的置信度）也返回合法排列
+    print("\n场景 2: 代价全部相同")
+    order = solve_order(np.full((5, 5), 0.5), keep_first=True)
+    check(f"排列 {order} 合法且以第一项开头", sorted(order) == list(range(5)) and order[0] == 0)
+
+    # 场景 3：超过精确求解上限时使用束搜索，结果仍是合法排列
+    print("\n场景 3: 束搜索")
+    cost = rng.random((12, 12))
+    np.fill_diagonal(cost, 0)
+    order = solve_order(cost, keep_first=True)
+    check("12 项的排列合法且以第一项开头", sorted(order) == list(range(12)) and order[0] == 0)
+    identity_cost = path_cost(cost, list(range(12)))
+    check("总代价不高于原顺序", path_cost(cost, order) <= identity_cost + 1e-9)
+
+    print(f"\n{'=' * 60}")
+    print(f"✅ 通过: {passed}")
+    print(f"❌ 失败: {failed}")
+    print(f"{'=' * 60}\n")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+测试分片上传会话：续传、MD5 校验失败时拒绝，以及上传期间的一级估计
+"""
+import asyncio
+import hashlib
+import io
+import shutil
+import sys
+import os
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+# 使用临时目录，不影响 data/ 下的上传和状态库
+DATA_DIR = tempfile.mkdtemp(prefix="upload_sessions_test_")
+os.environ['UPLOAD_DIR'] = os.path.join(DATA_DIR, 'uploads')
+os.environ['OUTPUT_DIR'] = os.path.join(DATA_DIR, 'outputs')
+os.environ['STATE_DB_PATH'] = os.path.join(DATA_DIR, 'state.db')
+
+from app.core.store import store
+from app.services.file_service import file_service
+from app.services.upload_session_service import upload_sessions
+from app.services.worker_pool import worker_pool
+
+
+def make_wav(seconds: float, sr: int = 22050) -> bytes:
+    """生成带噪声的正弦波 WAV（每次内容不同，避免会话按内容复用）"""
+    t = np.arange(int(sr * seconds)) / sr
+    y = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.01 * np.random.default_rng().standard_normal(len(t))
+    buffer = io.BytesIO()
+    sf.write(buffer, y, sr, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+
+async def chunks(data: bytes):
+    yield data
+
+
+async def put_part(session: dict, data: bytes, index: int) -> dict:
+    part_size = session['part_size']
+    return await upload_sessions.write_part(
+        session['session_id'], index, chunks(data[index * part_size:(index + 1) * part_size])
+    )
+
+
+async def run_tests() -> bool:
+    passed = 0
+    failed = 0
+
+    def check(name: str, ok: bool):
+        nonlocal passed, failed
+        if ok:
+            passed += 1
+            print(f"   ✅ {name}")
+        else:
+            failed += 1
+            print(f"   ❌ {name}")
+
+    print("\n" + "=" * 60)
+    print("分片上传会话测试")
+    print("=" * 60)
+
+    file_service.start()
+    # 分片调小，几秒的音频就能分成多片
+    upload_sessions.PART_SIZE = 64 * 1024
+
+    # 场景 1：内容与声明的 MD5 不一致时拒绝，并删除已接收的数据
+    print("\n场景 1: MD5 不一致")
+    data = make_wav(3)
+    session = upload_sessions.create('bad.wav', len(data), '0' * 32)
+    for index in range(session['part_count']):
+        await put_part(session, data, index)
+    part_path = upload_sessions._part_path(session['session_id'])
+    try:
+        await upload_sessions.complete(session['session_id'])
+        check("complete 拒绝 MD5 不一致的内容", False)
+    except ValueError as e:
+        check(f"complete 拒绝 MD5 不一致的内容 ({e})", True)
+    check("已接收的数据被删除", not os.path.exists(part_path))
+    check("没有入库", store.query_one("SELECT 1 FROM uploads WHERE original_name = 'bad.wav'") is None)
+    try:
+        upload_sessions.status(session['session_id'])
+        check("会话已删除", False)
+    except FileNotFoundError:
+        check("会话已删除", True)
+
+    # 场景 2：断线后重新创建会话，只需补传缺少的分片
+    print("\n场景 2: 续传")
+    data = make_wav(3)
+    md5 = hashlib.md5(data).hexdigest()
+    session = upload_sessions.create('good.wav', len(data), md5)
+    await put_part(session, data, 0)
+    await put_part(session, data, 2)
+    resumed = upload_sessions.create('good.wav', len(data), md5)
+    check("相同内容返回同一会话", resumed['session_id'] == session['session_id'])
+    check(f"已接收分片 {resumed['received']} == [0, 2]", resumed['received'] == [0, 2])
+    check("开头分片到达后已探测音频头", resumed['probe'] is not None and resumed['probe']['format'] == 'WAV')
+    # 重复发送已接收的分片直接确认
+    await put_part(session, data, 0)
+    for index in range(session['part_count']):
+        if index not in resumed['received']:
+            await put_part(session, data, index)
+    file_path = await upload_sessions.complete(session['session_id'])
+    with open(file_path, 'rb') as f:
+        check("入库文件与原始内容一致", f.read() == data)
+
+    # 场景 3：PCM WAV 的开头和中段窗口到达后就开始一级估计
+    print("\n场景 3: 上传期间的一级估计")
+    # 比估计窗口（ESTIMATE_MAX_SECONDS）长，窗口只覆盖中间的分片
+    data = make_wav(120, sr=8000)
+    md5 = hashlib.md5(data).hexdigest()
+    session = upload_sessions.create('early.wav', len(data), md5)
+    session = await put_part(session, data, 0)
+    needed = upload_sessions._estimate_parts(upload_sessions._get(session['session_id']), session['probe'])
+    for index in sorted(needed - {0}):
+        session = await put_part(session, data, index)
+    check(f"只收到 {len(needed)}/{session['part_count']} 个分片", len(session['received']) < session['part_count'])
+    for _ in range(300):
+        session = upload_sessions.status(session['session_id'])
+        if 'estimate' in session['probe']:
+            break
+        await asyncio.sleep(0.1)
+    check("会话状态返回一级估计", 'estimate' in session['probe'])
+    for index in range(session['part_count']):
+        if index not in session['received']:
+            await put_part(session, data, index)
+    await upload_sessions.complete(session['session_id'])
+    row = store.query_one(
+        "SELECT status, data FROM artifacts WHERE content_hash = ? AND artifact = 'estimate'", (md5,)
+    )
+    check("完成后估计结果直接入库", row is not None and row['status'] == 'ready')
+
+    print(f"\n{'=' * 60}")
+    print(f"✅ 通过: {passed}")
+    print(f"❌ 失败: {failed}")
+    print(f"{'=' * 60}\n")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    try:
+        success = asyncio.run(run_tests())
+    finally:
+        worker_pool.shutdown()
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
+    sys.exit(0 if success else 1)
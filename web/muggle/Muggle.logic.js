@@ -150,17 +150,19 @@ async function startMixing() {
             }
         });
         
-        const response = await axios.post(API_BASE + '/api/mix/multi', {
+        // 提交异步渲染任务，避免长时间线超过代理超时
+        const submitRes = await axios.post(API_BASE + '/api/jobs/mix/multi', {
             segments: segments,
             transition_duration: 0,
             transition_type: 'cut'
         });
+        const result = await waitForRenderJob(submitRes.data.job_id);
         
         document.getElementById('processingView').style.display = 'none';
         document.getElementById('resultView').style.display = 'block';
         
         document.getElementById('downloadBtn').onclick = () => {
-            window.location.href = API_BASE + `/api/download/${response.data.output_id}`;
+            window.location.href = API_BASE + `/api/download/${result.output_id}`;
         };
         
         refreshIcons();
@@ -171,3 +173,55 @@ async function startMixing() {
         updateStep();
     }
 }
+
+const renderStageNames = {
+    queued: '排队中',
+    prepare: '准备素材',
+    render: '渲染混音',
+    waveform: '生成波形',
+    done: '完成'
+};
+
+/**
+ * 通过 SSE 跟踪渲染任务进度，完成后返回结果
+ */
+function waitForRenderJob(jobId) {
+    return new Promise((resolve, reject) => {
+        const loadingText = document.querySelector('#processingView .loading-text');
+        const source = new EventSource(API_BASE + `/api/jobs/${jobId}/events`);
+        
+        source.onmessage = async (event) => {
+            const job = JSON.parse(event.data);
+            if (loadingText) {
+                loadingText.textContent = `${renderStageNames[job.stage] || job.stage} ${Math.round(job.progress)}%`;
+            }
+            
+            if (job.status === 'completed' || job.status === 'failed') {
+                source.close();
+                try {
+                    const response = await axios.get(API_BASE + `/api/jobs/${jobId}/result`);
+                    resolve(response.data);
+                } catch (error) {
+                    reject(error);
+                }
+            }
+        };
+        
+        source.onerror = async () => {
+            // SSE 中断时改为查询一次任务状态，任务在服务端持久化不会丢失
+            source.close();
+            try {
+                const response = await axios.get(API_BASE + `/api/jobs/${jobId}`);
+                const job = response.data.job;
+                if (job.status === 'completed' || job.status === 'failed') {
+                    const resultRes = await axios.get(API_BASE + `/api/jobs/${jobId}/result`);
+                    resolve(resultRes.data);
+                } else {
+                    setTimeout(() => waitForRenderJob(jobId).then(resolve, reject), 2000);
+                }
+            } catch (error) {
+                reject(error);
+            }
+        };
+    });
+}
@@ -7,7 +7,8 @@
 const muggleSpliceState = {
     currentTab: 'muggle',
     isGenerating: false,
-    lastResult: null
+    lastResult: null,
+    abortController: null  // 离开麻瓜拼接时中止生成，后端随之停止消耗 token
 };
 
 // 初始化标签页功能
@@ -40,6 +41,11 @@ function switchTimelineTab(tabName) {
     
     muggleSpliceState.currentTab = tabName;
     
+    // 离开麻瓜拼接标签时中止正在进行的生成
+    if (tabName !== 'muggle' && muggleSpliceState.abortController) {
+        muggleSpliceState.abortController.abort();
+    }
+    
     // 如果切换到手动拼接，确保拖拽功能正常
     if (tabName === 'manual') {
         setTimeout(() => {
@@ -118,12 +124,20 @@ async function handleMuggleGenerate() {
         await generateSpliceInstructionsStream(userDescription, context, thinkingContent, resultContent);
         
     } catch (error) {
+        if (error.name === 'AbortError') {
+            console.log('麻瓜拼接生成已中止');
+            if (resultContent) {
+                resultContent.innerHTML = '<div class="generating-status">已中止生成</div>';
+            }
+            return;
+        }
         console.error('麻瓜拼接生成失败:', error);
         if (resultContent) {
             resultContent.innerHTML = `<div class="error-content">❌ 生成失败: ${error.message}</div>`;
         }
     } finally {
         muggleSpliceState.isGenerating = false;
+        muggleSpliceState.abortController = null;
         generateBtn.disabled = false;
         generateBtn.innerHTML = '<i data-lucide="sparkles"></i> 生成拼接方案';
         refreshIcons();
@@ -197,13 +211,17 @@ async function generateSpliceInstructionsStream(userDescription, context, thinki
             user_description: userDescription
         };
         
+        const abortController = new AbortController();
+        muggleSpliceState.abortController = abortController;
+        
         // 使用 fetch 的流式读取
         fetch('/api/ai/splice/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify(requestBody)
+            body: JSON.stringify(requestBody),
+            signal: abortController.signal
         })
         .then(response => {
             if (!response.ok) {
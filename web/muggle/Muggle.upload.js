@@ -69,7 +69,7 @@ function renderUploadList() {
                 </button>
             ` : ''}
         </div>
-        <input type="file" id="fileInput${index}" accept="audio/*,.mp3,.wav,.flac,.m4a,.aac,.ogg" style="display:none">
+        <input type="file" id="fileInput${index}" accept="audio/*,.mp3,.wav,.flac,.m4a,.aac,.ogg" multiple style="display:none">
     `).join('');
     
     state.tracks.forEach((track, index) => {
@@ -90,7 +90,11 @@ function renderUploadList() {
 }
 
 async function handleFileSelect(event, index) {
-    const file = event.target.files[0];
+    const files = Array.from(event.target.files);
+    if (files.length > 1) {
+        return handleBatchSelect(files, index);
+    }
+    const file = files[0];
     if (!file) return;
     
     const track = state.tracks[index];
@@ -100,24 +104,42 @@ async function handleFileSelect(event, index) {
     
     renderUploadList();
     
+    const updateProgress = (percent) => {
+        track.progress = percent;
+        const progressFill = document.querySelector(`[data-index="${index}"] .progress-fill`);
+        const statusText = document.querySelector(`[data-index="${index}"] .upload-status`);
+        if (progressFill) progressFill.style.width = percent + '%';
+        if (statusText) statusText.textContent = `上传中 ${percent}%`;
+    };
+    
     try {
-        const formData = new FormData();
-        formData.append('file', file);
-        
-        const response = await axios.post(API_BASE + '/api/upload', formData, {
-            headers: { 'Content-Type': 'multipart/form-data' },
-            onUploadProgress: (progressEvent) => {
-                const percent = Math.round((progressEvent.loaded * 100) / progressEvent.total);
-                track.progress = percent;
-                const progressFill = document.querySelector(`[data-index="${index}"] .progress-fill`);
-                const statusText = document.querySelector(`[data-index="${index}"] .upload-status`);
-                if (progressFill) progressFill.style.width = percent + '%';
-                if (statusText) statusText.textContent = `上传中 ${percent}%`;
-            }
-        });
+        let response;
+        if (typeof SparkMD5 !== 'undefined') {
+            // 分片上传：已有相同内容时跳过传输，断线重试从已接收的分片继续
+            response = await uploadInParts(file, updateProgress);
+        } else {
+            const formData = new FormData();
+            formData.append('file', file);
+            
+            response = await axios.post(API_BASE + '/api/upload', formData, {
+                headers: { 'Content-Type': 'multipart/form-data' },
+                onUploadProgress: (progressEvent) => {
+                    updateProgress(Math.round((progressEvent.loaded * 100) / progressEvent.total));
+                }
+            });
+        }
         
         track.uploaded = response.data;
         track.info = response.data.info;
+        
+        // 上传后立即返回，元数据可能仍在后台生成
+        if (!track.info) {
+            track.progress = null;
+            renderUploadList();
+            const infoResponse = await axios.get(API_BASE + `/api/uploads/${response.data.file_id}/info`);
+            track.info = infoResponse.data.info;
+        }
+        
         track.uploading = false;
         track.clips = [{ id: 1, start: 0, end: track.info.duration }];
         
@@ -130,6 +152,168 @@ async function handleFileSelect(event, index) {
     }
 }
 
+// 一次选择多个文件：从当前位置起依次填入空位，一个请求上传，各文件就绪后分别解锁
+async function handleBatchSelect(files, index) {
+    const slots = [];
+    for (let i = index; slots.length < files.length && i < trackLabels.length; i++) {
+        if (i >= state.tracks.length) addUploadSlot();
+        const track = state.tracks[i];
+        if (track.uploaded || track.uploading) continue;
+        track.file = files[slots.length];
+        track.uploading = true;
+        track.progress = null;
+        slots.push(track);
+    }
+    renderUploadList();
+    
+    const finish = (track, info) => {
+        track.info = info;
+        track.uploading = false;
+        track.clips = [{ id: 1, start: 0, end: info.duration }];
+    };
+    const fail = (track) => {
+        track.uploading = false;
+        track.uploaded = null;
+        track.file = null;
+    };
+    
+    const errors = [];
+    try {
+        const formData = new FormData();
+        slots.forEach(track => formData.append('files', track.file));
+        
+        const response = await fetch(API_BASE + '/api/upload/batch', { method: 'POST', body: formData });
+        if (!response.ok) {
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.detail || response.statusText);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            
+            for (const line of lines) {
+                if (!line.startsWith('data: ')) continue;
+                const event = JSON.parse(line.slice(6));
+                const track = slots[event.index];
+                if (!track || !track.uploading) continue;
+                
+                if (event.type === 'uploaded') {
+                    if (!event.success) {
+                        errors.push(`${track.file.name}: ${event.error}`);
+                        fail(track);
+                    } else {
+                        track.uploaded = event;
+                        if (event.info) finish(track, event.info);
+                    }
+                } else if (event.type === 'status') {
+                    const metadata = event.status.artifacts.metadata;
+                    if (metadata.status === 'ready') {
+                        finish(track, metadata.data);
+                    } else if (metadata.status === 'failed') {
+                        errors.push(`${track.file.name}: ${metadata.error}`);
+                        fail(track);
+                    }
+                }
+                renderUploadList();
+            }
+        }
+    } catch (error) {
+        errors.push(error.message);
+    }
+    
+    // 连接中断时未就绪的文件逐个补查
+    for (const track of slots.filter(t => t.uploading)) {
+        try {
+            if (!track.uploaded) throw new Error('上传中断');
+            const infoResponse = await axios.get(API_BASE + `/api/uploads/${track.uploaded.file_id}/info`);
+            finish(track, infoResponse.data.info);
+        } catch (error) {
+            errors.push(`${track.file.name}: ${error.response?.data?.detail || error.message}`);
+            fail(track);
+        }
+    }
+    renderUploadList();
+    
+    if (errors.length) {
+        alert('上传失败：\n' + errors.join('\n'));
+    }
+}
+
+const HASH_CHUNK_SIZE = 2 * 1024 * 1024;
+
+// 分块计算文件 MD5，不把整个文件读入内存
+async function computeFileMD5(file) {
+    const spark = new SparkMD5.ArrayBuffer();
+    for (let offset = 0; offset < file.size; offset += HASH_CHUNK_SIZE) {
+        spark.append(await file.slice(offset, offset + HASH_CHUNK_SIZE).arrayBuffer());
+    }
+    return spark.end();
+}
+
+const PART_CONCURRENCY = 3;  // 并行上传的分片数
+const PART_RETRIES = 3;
+
+// 分片上传，返回与 /api/upload 相同格式的结果
+async function uploadInParts(file, onProgress) {
+    const created = await axios.post(API_BASE + '/api/upload/sessions', {
+        content_hash: await computeFileMD5(file),
+        size: file.size,
+        filename: file.name
+    });
+    if (created.data.exists) return created;
+    
+    const session = created.data.session;
+    const received = new Set(session.received);
+    const pending = [];
+    for (let i = 0; i < session.part_count; i++) {
+        if (!received.has(i)) pending.push(i);
+    }
+    
+    // 已接收的分片计入进度
+    let baseBytes = 0;
+    received.forEach(i => {
+        baseBytes += Math.min(session.part_size, file.size - i * session.part_size);
+    });
+    const loaded = {};
+    const report = () => {
+        const total = baseBytes + Object.values(loaded).reduce((sum, n) => sum + n, 0);
+        onProgress(Math.min(100, Math.round(total * 100 / Math.max(file.size, 1))));
+    };
+    
+    const sendPart = async (i) => {
+        const start = i * session.part_size;
+        const blob = file.slice(start, start + session.part_size);
+        for (let attempt = 1; ; attempt++) {
+            try {
+                await axios.put(API_BASE + `/api/upload/sessions/${session.session_id}/parts/${i}`, blob, {
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    onUploadProgress: (e) => { loaded[i] = e.loaded; report(); }
+                });
+                return;
+            } catch (error) {
+                // 4xx 不重试（例如文件无法解码）
+                if (attempt >= PART_RETRIES || (error.response && error.response.status < 500)) throw error;
+                loaded[i] = 0;
+                await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+            }
+        }
+    };
+    
+    const workers = Array.from({ length: Math.min(PART_CONCURRENCY, pending.length) }, async () => {
+        while (pending.length) await sendPart(pending.shift());
+    });
+    await Promise.all(workers);
+    
+    return axios.post(API_BASE + `/api/upload/sessions/${session.session_id}/complete`);
+}
+
 window.removeTrack = function(index) {
     const track = state.tracks[index];
     